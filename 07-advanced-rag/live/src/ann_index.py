@@ -0,0 +1,179 @@
+import json
+import logging
+from pathlib import Path
+import numpy as np
+from config import config
+
+logger = logging.getLogger(__name__)
+
+HNSW_INDEX_FILE = "hnsw.bin"
+HNSW_META_FILE = "hnsw.json"
+
+def _import_hnswlib():
+    """Ленивый импорт опциональной зависимости"""
+    try:
+        import hnswlib
+        return hnswlib
+    except ImportError as e:
+        raise ImportError(
+            "VECTOR_INDEX_BACKEND=hnsw requires hnswlib. Install it with: uv sync --extra ann"
+        ) from e
+
+class HnswIndex:
+    """
+    Приближенный поиск ближайших соседей (HNSW, hnswlib)
+
+    Метки элементов - chunk_id, поэтому индекс переживает инкрементальную
+    переиндексацию: чанки удаленных файлов помечаются удаленными, новые
+    добавляются без перестройки графа. Векторы должны быть L2-нормализованы
+    (пространство 'ip', близость = скалярное произведение).
+
+    Параметры точности/скорости:
+        m: число связей вершины графа (больше - выше recall, больше памяти)
+        ef_construction: ширина поиска при построении
+        ef_search: ширина поиска при запросе (главный параметр recall/latency)
+    """
+
+    def __init__(self, dim: int, m: int, ef_construction: int, ef_search: int):
+        self.dim = dim
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.index = None
+        self.deleted = 0
+        self.recall = None  # recall@k относительно точного поиска (если измерялся)
+
+    @classmethod
+    def from_config(cls, dim: int) -> "HnswIndex":
+        return cls(dim, config.HNSW_M, config.HNSW_EF_CONSTRUCTION, config.HNSW_EF_SEARCH)
+
+    def _init_index(self, max_elements: int):
+        hnswlib = _import_hnswlib()
+        self.index = hnswlib.Index(space="ip", dim=self.dim)
+        self.index.init_index(max_elements=max(max_elements, 1), ef_construction=self.ef_construction, M=self.m)
+        self.index.set_ef(self.ef_search)
+
+    def add(self, vectors: np.ndarray, labels: np.ndarray):
+        """Добавление векторов (с расширением индекса при необходимости)"""
+        if len(vectors) == 0:
+            return
+        if self.index is None:
+            self._init_index(len(vectors))
+        required = self.index.get_current_count() + len(vectors)
+        if required > self.index.get_max_elements():
+            self.index.resize_index(max(required, int(self.index.get_max_elements() * 1.5)))
+        self.index.add_items(np.asarray(vectors, dtype=np.float32), np.asarray(labels, dtype=np.int64))
+        # Recall измерялся на прежнем графе
+        self.recall = None
+
+    def delete(self, labels):
+        """Пометка элементов удаленными (исключаются из выдачи)"""
+        for label in labels:
+            self.index.mark_deleted(int(label))
+            self.deleted += 1
+        self.recall = None
+
+    def __len__(self) -> int:
+        if self.index is None:
+            return 0
+        return self.index.get_current_count() - self.deleted
+
+    def set_ef(self, ef_search: int):
+        if ef_search != self.ef_search:
+            self.recall = None
+        self.ef_search = ef_search
+        if self.index is not None:
+            self.index.set_ef(ef_search)
+
+    def search(self, queries: np.ndarray, k: int):
+        """
+        Поиск k ближайших соседей
+
+        Returns:
+            tuple: (labels, scores) - массивы (len(queries) x k), scores - косинусная близость
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0), dtype=np.float32)
+        # ef не может быть меньше k
+        self.index.set_ef(max(self.ef_search, k))
+        labels, distances = self.index.knn_query(np.asarray(queries, dtype=np.float32), k=k)
+        return labels.astype(np.int64), 1.0 - distances
+
+    def save(self, index_dir: str, corpus_hash: str):
+        """Сохранение графа рядом с сохраненным индексом"""
+        index_path = Path(index_dir)
+        self.index.save_index(str(index_path / HNSW_INDEX_FILE))
+        meta = {
+            "dim": self.dim,
+            "m": self.m,
+            "ef_construction": self.ef_construction,
+            "deleted": self.deleted,
+            "corpus_hash": corpus_hash,
+        }
+        if self.recall is not None:
+            meta["recall"] = self.recall
+            meta["recall_params"] = recall_params(self.ef_search)
+        (index_path / HNSW_META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        logger.info(f"HNSW index saved to {index_path} ({len(self)} elements)")
+
+    @classmethod
+    def load(cls, index_dir: str, dim: int, corpus_hash: str):
+        """Загрузка графа, если он построен для того же корпуса и с теми же параметрами (иначе None)"""
+        index_path = Path(index_dir)
+        meta_path = index_path / HNSW_META_FILE
+        if not meta_path.exists() or not (index_path / HNSW_INDEX_FILE).exists():
+            return None
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        expected = {"dim": dim, "m": config.HNSW_M, "ef_construction": config.HNSW_EF_CONSTRUCTION, "corpus_hash": corpus_hash}
+        if any(meta.get(key) != value for key, value in expected.items()):
+            logger.info("Saved HNSW index does not match the current index, rebuilding")
+            return None
+
+        hnswlib = _import_hnswlib()
+        ann = cls.from_config(dim)
+        ann.index = hnswlib.Index(space="ip", dim=dim)
+        ann.index.load_index(str(index_path / HNSW_INDEX_FILE), allow_replace_deleted=False)
+        ann.index.set_ef(ann.ef_search)
+        ann.deleted = meta.get("deleted", 0)
+        # Recall не меняется, пока не изменились граф, ef_search и параметры измерения
+        if meta.get("recall_params") == recall_params(ann.ef_search):
+            ann.recall = meta.get("recall")
+        return ann
+
+def recall_params(ef_search: int) -> dict:
+    """Параметры измерения recall из конфига (сохраняются вместе с результатом)"""
+    return {"k": config.SEMANTIC_RETRIEVER_K, "num_queries": config.ANN_RECALL_SAMPLE, "ef_search": ef_search}
+
+def measure_recall(matrix: np.ndarray, ann: HnswIndex, k: int = 10,
+                   num_queries: int = 100, seed: int = 0) -> float:
+    """
+    Recall@k приближенного поиска относительно точного на текущем корпусе
+
+    Запросы - случайная выборка векторов корпуса; точный top-k считается
+    матричным произведением. Найденный ANN результат засчитывается, если его
+    близость не ниже k-й точной (так дубликаты чанков не занижают recall).
+
+    Args:
+        matrix: нормализованная матрица эмбеддингов корпуса
+        ann: HNSW индекс по той же матрице
+    """
+    if len(matrix) == 0:
+        return 1.0
+    k = min(k, len(matrix))
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(matrix), size=min(num_queries, len(matrix)), replace=False)
+    queries = np.asarray(matrix[sample], dtype=np.float32)
+
+    hits = 0
+    for start in range(0, len(queries), 16):
+        batch = queries[start:start + 16]
+        exact_scores = batch @ np.asarray(matrix).T
+        kth_scores = -np.partition(-exact_scores, k - 1, axis=1)[:, k - 1]
+        _, ann_scores = ann.search(batch, k)
+        hits += int(np.sum(ann_scores >= kth_scores[:, None] - 1e-5))
+    return hits / (len(queries) * k)
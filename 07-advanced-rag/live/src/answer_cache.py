@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Накопительная статистика кеша за время работы процесса
+_stats = {"hits": 0, "misses": 0, "saved_ms": 0.0, "lookup_ms": 0.0}
+
+class CachedAnswer:
+    """Ответ с источниками и временем, которое ушло на его получение"""
+
+    def __init__(self, query: str, answer: str, documents: list, cost_ms: float):
+        self.query = query
+        self.answer = answer
+        self.documents = documents
+        self.cost_ms = cost_ms
+        self.created = time.time()
+
+class SemanticAnswerCache:
+    """
+    Кеш ответов по смысловой близости запроса
+
+    Ключ - эмбеддинг самостоятельного запроса после трансформации: «условия
+    досрочного погашения» и «досрочное погашение: какие условия?» дают близкие
+    векторы и один ответ. Попадание - косинусная близость не ниже threshold
+    к сохраненному запросу, не старше ttl секунд. При переполнении вытесняется
+    давно не использованный ответ. Версия (режим retrieval, модель, индекс)
+    при смене сбрасывает кеш: ответы по старому индексу не возвращаются.
+    """
+
+    def __init__(self, threshold: float, ttl: float, max_entries: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = None
+        self._entries = OrderedDict()  # id -> CachedAnswer, в порядке использования
+        self._vectors = {}  # id -> нормализованный эмбеддинг
+        self._matrix = None  # (ids, матрица) - строится лениво после изменений
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def set_version(self, version: str):
+        with self._lock:
+            if version == self.version:
+                return
+            if self._entries:
+                logger.info(f"Answer cache reset: {len(self._entries)} answers dropped")
+            self.version = version
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrix = None
+
+    def _get_matrix(self):
+        if self._matrix is None:
+            ids = list(self._vectors)
+            matrix = np.vstack([self._vectors[i] for i in ids]) if ids else np.zeros((0, 0), dtype=np.float32)
+            self._matrix = (ids, matrix)
+        return self._matrix
+
+    def _drop(self, entry_id: int):
+        self._entries.pop(entry_id, None)
+        self._vectors.pop(entry_id, None)
+        self._matrix = None
+
+    def lookup(self, vector, version: str):
+        """Ближайший сохраненный ответ (None - промах)"""
+        started = time.perf_counter()
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        found = None
+        with self._lock:
+            if version == self.version:
+                # Устаревшие ответы убираем до поиска, чтобы они не заслоняли свежие
+                now = time.time()
+                for entry_id in [i for i, entry in self._entries.items() if now - entry.created > self.ttl]:
+                    self._drop(entry_id)
+            if version == self.version and self._entries:
+                ids, matrix = self._get_matrix()
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(ids[best])
+                    found = self._entries[ids[best]]
+        _stats["lookup_ms"] += (time.perf_counter() - started) * 1000
+        if found is None:
+            _stats["misses"] += 1
+        else:
+            _stats["hits"] += 1
+            _stats["saved_ms"] += found.cost_ms
+        return found
+
+    def put(self, vector, entry: CachedAnswer, version: str):
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            if version != self.version:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._vectors[entry_id] = query
+            self._matrix = None
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def get_cache_stats(cache: SemanticAnswerCache = None) -> dict:
+    """Статистика кеша ответов для /index_status"""
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        "enabled": config.ANSWER_CACHE_ENABLED,
+        "entries": len(cache) if cache is not None else 0,
+        "hits": _stats["hits"],
+        "misses": _stats["misses"],
+        "hit_rate": _stats["hits"] / total if total else 0.0,
+        "saved_ms": _stats["saved_ms"],
+        "mean_lookup_ms": _stats["lookup_ms"] / total if total else 0.0,
+    }
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import openai
+from langchain_core.embeddings import Embeddings
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых запрос имеет смысл повторить (429, 5xx, сеть, таймаут)
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+)
+
+def get_token_counter(model: str):
+    """Функция подсчета токенов для модели (tiktoken, с грубой оценкой как запасным вариантом)"""
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model.split("/")[-1])
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable ({e}), using character-based token estimate")
+        # Для русского текста ~2-3 символа на токен, оцениваем с запасом
+        return lambda text: len(text) // 2 + 1
+
+def make_batches(token_counts: list, max_batch_tokens: int, max_batch_size: int) -> list:
+    """
+    Нарезка текстов на батчи с ограничением по токенам и по количеству
+
+    Returns:
+        list: список (start, end) - диапазонов индексов текстов
+    """
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        batch_full = i - start >= max_batch_size or batch_tokens + tokens > max_batch_tokens
+        if i > start and batch_full:
+            batches.append((start, i))
+            start = i
+            batch_tokens = 0
+        batch_tokens += tokens
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+class TokenRateLimiter:
+    """
+    Ограничитель tokens-per-minute (token bucket с непрерывным пополнением)
+
+    Бюджет - состояние экземпляра, а не вызова: все батчи и все вызовы
+    embed_documents одной индексации делят один минутный лимит. Токены
+    резервируются под threading.Lock, ожидание идет уже без блокировки,
+    поэтому ограничитель не привязан к конкретному event loop.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.available = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        """Резерв токенов; возвращает, сколько секунд ждать до их появления в bucket"""
+        # Батч больше минутного лимита ждет полного bucket, иначе он не пройдет никогда
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.available = min(
+                self.capacity,
+                self.available + (now - self.updated) * self.capacity / 60
+            )
+            self.updated = now
+            # Долг (отрицательный остаток) гасится пополнением - это и есть время ожидания
+            self.available -= tokens
+            return max(0.0, -self.available * 60 / self.capacity)
+
+    async def acquire(self, tokens: int):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class BatchedOpenAIEmbeddings(Embeddings):
+    """
+    Эмбеддинги через OpenAI-совместимый API с управляемой нагрузкой
+
+    - батчи ограничены по токенам (max_batch_tokens) и по числу текстов (max_batch_size)
+    - не больше concurrency одновременных async запросов
+    - повтор при 429/5xx/сетевых ошибках с экспоненциальной задержкой и jitter
+      (учитывается заголовок Retry-After)
+    - опциональный лимит tokens-per-minute
+    - прогресс пишется в лог и передается в progress_callback(done, total)
+
+    Эмбеддинг документов выполняется в собственном event loop в отдельном
+    потоке: клиент, семафор и лимит tokens-per-minute создаются один раз
+    и общие для всех вызовов (индексатор вызывает embed_documents по частям).
+    client_factory позволяет подставить заглушку вместо AsyncOpenAI.
+    """
+
+    def __init__(self, model: str, base_url: str = None, api_key: str = None,
+                 max_batch_tokens: int = 50000, max_batch_size: int = 256,
+                 concurrency: int = 4, max_retries: int = 6,
+                 tokens_per_minute: int = 0, progress_callback=None, client_factory=None):
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.tokens_per_minute = tokens_per_minute
+        self.progress_callback = progress_callback
+        self.client_factory = client_factory or self._create_client
+        self._count_tokens = get_token_counter(model)
+        self._limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute > 0 else None
+        # Loop для эмбеддинга документов, его клиент и семафор (создаются при первом вызове)
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._documents_client = None
+        self._semaphore = None
+        # Клиенты для запросов пользователей переиспользуются между вызовами
+        self._query_client = None
+        self._sync_query_client = None
+
+    def _create_client(self):
+        # Ретраи делаем сами, встроенные в SDK отключаем
+        return openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+
+    async def _request(self, client, texts: list) -> list:
+        """Один запрос к API с повторами при временных ошибках"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.embeddings.create(model=self.model, input=texts)
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                logger.warning(
+                    f"Embedding request failed ({type(e).__name__}), "
+                    f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retry_delay(error, attempt: int) -> float:
+        """Задержка перед повтором: Retry-After от сервера или экспонента с full jitter"""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, 1)
+            except ValueError:
+                pass
+        return random.uniform(0, min(60.0, 2 ** attempt))
+
+    def _run(self, coro):
+        """Запуск корутины в loop эмбеддинга документов (concurrent.futures.Future)"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="embeddings-loop", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _embed_documents(self, texts: list) -> list:
+        if self._documents_client is None:
+            self._documents_client = self.client_factory()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        # API не принимает пустые строки
+        texts = [text if text else " " for text in texts]
+        token_counts = [self._count_tokens(text) for text in texts]
+        batches = make_batches(token_counts, self.max_batch_tokens, self.max_batch_size)
+        logger.info(
+            f"Embedding {len(texts)} texts ({sum(token_counts)} tokens) in {len(batches)} batches, "
+            f"concurrency {self.concurrency}"
+        )
+
+        results = [None] * len(texts)
+        progress = {"done": 0, "logged": 0}
+        started = time.perf_counter()
+
+        async def run_batch(start: int, end: int):
+            async with self._semaphore:
+                if self._limiter is not None:
+                    await self._limiter.acquire(sum(token_counts[start:end]))
+                results[start:end] = await self._request(self._documents_client, texts[start:end])
+            progress["done"] += end - start
+            if self.progress_callback is not None:
+                self.progress_callback(progress["done"], len(texts))
+            # Логируем прогресс шагами по ~10%
+            if progress["done"] - progress["logged"] >= len(texts) / 10 or progress["done"] == len(texts):
+                progress["logged"] = progress["done"]
+                logger.info(f"Embedding progress: {progress['done']}/{len(texts)}")
+
+        await asyncio.gather(*(run_batch(start, end) for start, end in batches))
+
+        logger.info(f"Embedded {len(texts)} texts in {time.perf_counter() - started:.1f}s")
+        return results
+
+    async def aembed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+        return await asyncio.wrap_future(self._run(self._embed_documents(texts)))
+
+    def embed_documents(self, texts: list) -> list:
+        # Синхронный вызов может прийти из потока с работающим event loop,
+        # поэтому ждем результат из loop эмбеддинга, а не запускаем свой
+        if not texts:
+            return []
+        return self._run(self._embed_documents(texts)).result()
+
+    async def aembed_query(self, text: str) -> list:
+        # Клиент создается в event loop бота и дальше используется только в нем
+        if self._query_client is None:
+            self._query_client = self.client_factory()
+        return (await self._request(self._query_client, [text or " "]))[0]
+
+    def embed_query(self, text: str) -> list:
+        if self._sync_query_client is None:
+            self._sync_query_client = openai.OpenAI(
+                api_key=self.api_key, base_url=self.base_url, max_retries=self.max_retries
+            )
+        response = self._sync_query_client.embeddings.create(model=self.model, input=[text or " "])
+        return response.data[0].embedding
+
+def create_batched_openai_embeddings(model: str) -> BatchedOpenAIEmbeddings:
+    """Создание батчевых OpenAI embeddings с параметрами из конфига"""
+    return BatchedOpenAIEmbeddings(
+        model=model,
+        base_url=config.OPENAI_BASE_URL,
+        api_key=config.OPENAI_API_KEY,
+        max_batch_tokens=config.EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_size=config.EMBEDDING_BATCH_MAX_SIZE,
+        concurrency=config.EMBEDDING_CONCURRENCY,
+        max_retries=config.EMBEDDING_MAX_RETRIES,
+        tokens_per_minute=config.EMBEDDING_TPM_LIMIT,
+    )
@@ -0,0 +1,566 @@
+import argparse
+import json
+import logging
+import time
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import FakeEmbeddings
+from langchain_core.vectorstores import InMemoryVectorStore
+from langchain_community.retrievers import BM25Retriever
+from pathlib import Path
+from config import config
+from numpy_vector_store import NumpyVectorStore, normalize_rows, top_k_indices
+from ann_index import HnswIndex, measure_recall
+from quantization import Float16Quantizer, Int8Quantizer, ProductQuantizer, measure_quantization_recall
+from bm25_index import BM25Index, BM25IndexRetriever
+import index_store
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+def measure_latency(search, queries: list) -> dict:
+    """Латентность поиска: среднее и p95 в миллисекундах"""
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        search(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {"mean_ms": float(np.mean(latencies)), "p95_ms": float(np.percentile(latencies, 95))}
+
+def random_vectors(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Случайные нормализованные векторы (генерируются блоками, чтобы не раздувать память)"""
+    rng = np.random.default_rng(seed)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 100_000):
+        end = min(start + 100_000, count)
+        vectors[start:end] = normalize_rows(rng.standard_normal((end - start, dim), dtype=np.float32))
+    return vectors
+
+def bench_vector_store(sizes: list, dim: int, k: int, num_queries: int, inmemory_max: int):
+    """Сравнение NumpyVectorStore с InMemoryVectorStore на синтетическом корпусе"""
+    embedding = FakeEmbeddings(size=dim)
+    queries = list(random_vectors(num_queries, dim, seed=1))
+
+    logger.info(f"Vector store benchmark: dim={dim}, k={k}, queries={num_queries}")
+    logger.info(f"{'chunks':>10} | {'store':>12} | {'build, s':>9} | {'mean, ms':>9} | {'p95, ms':>9}")
+
+    for size in sizes:
+        vectors = random_vectors(size, dim)
+        documents = [Document(page_content=f"chunk {i}", metadata={"chunk_id": i}) for i in range(size)]
+
+        started = time.perf_counter()
+        numpy_store = NumpyVectorStore.from_vectors(documents, vectors, embedding, normalized=True)
+        build = time.perf_counter() - started
+        result = measure_latency(lambda q: numpy_store.similarity_search_by_vector(q, k=k), queries)
+        logger.info(f"{size:>10} | {'numpy':>12} | {build:>9.2f} | {result['mean_ms']:>9.2f} | {result['p95_ms']:>9.2f}")
+
+        if size > inmemory_max:
+            logger.info(f"{size:>10} | {'in-memory':>12} | {'skipped (--inmemory-max)':>33}")
+            continue
+
+        # Так хранилище заполнял индексатор до перехода на NumpyVectorStore
+        started = time.perf_counter()
+        inmemory_store = InMemoryVectorStore(embedding=embedding)
+        for i, (doc, vector) in enumerate(zip(documents, vectors)):
+            inmemory_store.store[str(i)] = {
+                "id": str(i), "vector": vector, "text": doc.page_content, "metadata": doc.metadata
+            }
+        build = time.perf_counter() - started
+        # Старое хранилище медленное: меряем на части запросов
+        result = measure_latency(lambda q: inmemory_store.similarity_search_by_vector(q, k=k), queries[:max(3, num_queries // 10)])
+        logger.info(f"{size:>10} | {'in-memory':>12} | {build:>9.2f} | {result['mean_ms']:>9.2f} | {result['p95_ms']:>9.2f}")
+
+def bench_ann(sizes: list, dim: int, k: int, num_queries: int, ef_values: list, use_saved_index: bool):
+    """HNSW против точного поиска: время построения, recall@k и латентность для разных ef_search"""
+    if use_saved_index:
+        loaded = index_store.load_index(config.INDEX_DIR)
+        if loaded is None:
+            logger.error(f"No saved index in {config.INDEX_DIR}, run the bot or /index first")
+            return
+        corpora = [("saved", np.asarray(loaded[1], dtype=np.float32))]
+    else:
+        corpora = [(str(size), random_vectors(size, dim)) for size in sizes]
+
+    logger.info(f"ANN benchmark: M={config.HNSW_M}, ef_construction={config.HNSW_EF_CONSTRUCTION}, k={k}, queries={num_queries}")
+    logger.info(f"{'chunks':>10} | {'search':>12} | {'build, s':>9} | {'recall@k':>9} | {'mean, ms':>9} | {'p95, ms':>9}")
+
+    for name, vectors in corpora:
+        # Запросы - векторы корпуса (как в проверке recall при индексации)
+        queries = [vectors[i] for i in np.random.default_rng(1).choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+        result = measure_latency(lambda q: top_k_indices(vectors @ q, k), queries)
+        logger.info(f"{name:>10} | {'exact':>12} | {0:>9.2f} | {1:>9.3f} | {result['mean_ms']:>9.2f} | {result['p95_ms']:>9.2f}")
+
+        started = time.perf_counter()
+        ann = HnswIndex.from_config(vectors.shape[1])
+        ann.add(vectors, np.arange(len(vectors), dtype=np.int64))
+        build = time.perf_counter() - started
+
+        for ef in ef_values:
+            ann.set_ef(ef)
+            recall = measure_recall(vectors, ann, k=k, num_queries=num_queries)
+            result = measure_latency(lambda q: ann.search(q.reshape(1, -1), k), queries)
+            logger.info(
+                f"{name:>10} | {f'hnsw ef={ef}':>12} | {build:>9.2f} | {recall:>9.3f} | "
+                f"{result['mean_ms']:>9.2f} | {result['p95_ms']:>9.2f}"
+            )
+
+def bench_quantization(sizes: list, dim: int, k: int, num_queries: int, subvectors: int,
+                       rescore_factor: int, use_saved_index: bool):
+    """Сжатие эмбеддингов: память, recall@k и латентность для float16/int8/PQ против float32"""
+    if use_saved_index:
+        loaded = index_store.load_index(config.INDEX_DIR)
+        if loaded is None:
+            logger.error(f"No saved index in {config.INDEX_DIR}, run the bot or /index first")
+            return
+        corpora = [("saved", np.asarray(loaded[1], dtype=np.float32))]
+    else:
+        corpora = [(str(size), random_vectors(size, dim)) for size in sizes]
+
+    logger.info(f"Quantization benchmark: k={k}, queries={num_queries}, rescore x{rescore_factor}")
+    logger.info(
+        f"{'chunks':>10} | {'storage':>14} | {'MB':>8} | {'encode, s':>9} | {'recall@k':>9} | "
+        f"{'rescored':>9} | {'mean, ms':>9}"
+    )
+
+    for name, vectors in corpora:
+        embedding = FakeEmbeddings(size=vectors.shape[1])
+        documents = [Document(page_content=f"chunk {i}") for i in range(len(vectors))]
+        queries = [vectors[i] for i in np.random.default_rng(1).choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+
+        store = NumpyVectorStore.from_vectors(documents, vectors, embedding, normalized=True)
+        result = measure_latency(lambda q: store.similarity_search_by_vector(q, k=k), queries)
+        logger.info(
+            f"{name:>10} | {'float32':>14} | {vectors.nbytes / 1024 / 1024:>8.1f} | {0:>9.2f} | "
+            f"{1:>9.3f} | {'-':>9} | {result['mean_ms']:>9.2f}"
+        )
+
+        pq_subvectors = subvectors or max(1, vectors.shape[1] // 8)
+        for quantizer in [Float16Quantizer(vectors.shape[1]), Int8Quantizer(vectors.shape[1]),
+                          ProductQuantizer(vectors.shape[1], pq_subvectors)]:
+            started = time.perf_counter()
+            quantizer.fit(vectors)
+            quantizer.add(vectors)
+            encode = time.perf_counter() - started
+            recall = measure_quantization_recall(vectors, quantizer, k=k, num_queries=num_queries)
+            rescored = measure_quantization_recall(vectors, quantizer, k=k, num_queries=num_queries,
+                                                   rescore_factor=rescore_factor)
+            store.attach_quantizer(quantizer, rescore_factor)
+            result = measure_latency(lambda q: store.similarity_search_by_vector(q, k=k), queries)
+            logger.info(
+                f"{name:>10} | {quantizer.mode:>14} | {quantizer.nbytes / 1024 / 1024:>8.1f} | {encode:>9.2f} | "
+                f"{recall:>9.3f} | {rescored:>9.3f} | {result['mean_ms']:>9.2f}"
+            )
+
+def random_texts(count: int, vocabulary_size: int, length: int, seed: int = 0) -> list:
+    """Синтетические тексты: слова с распределением Ципфа, как в естественном языке"""
+    rng = np.random.default_rng(seed)
+    words = np.array([f"w{i}" for i in range(vocabulary_size)])
+    ranks = np.arange(1, vocabulary_size + 1)
+    probabilities = 1.0 / ranks / np.sum(1.0 / ranks)
+    return [" ".join(words[rng.choice(vocabulary_size, size=length, p=probabilities)]) for _ in range(count)]
+
+def bench_bm25(sizes: list, k: int, num_queries: int, query_terms: int, okapi_max: int):
+    """Postings BM25 (BM25IndexRetriever) против BM25Retriever (rank_bm25) на растущем корпусе"""
+    queries = random_texts(num_queries, 50_000, query_terms, seed=1)
+
+    logger.info(f"BM25 benchmark: k={k}, queries={num_queries}, terms per query={query_terms}")
+    logger.info(f"{'chunks':>10} | {'retriever':>12} | {'build, s':>9} | {'mean, ms':>9} | {'p95, ms':>9} | {'same top-k':>10}")
+
+    for size in sizes:
+        documents = [
+            Document(page_content=text, metadata={"chunk_id": i})
+            for i, text in enumerate(random_texts(size, 50_000, 150))
+        ]
+
+        started = time.perf_counter()
+        index = BM25Index.build(doc.page_content for doc in documents)
+        build = time.perf_counter() - started
+        retriever = BM25IndexRetriever.from_index(index, documents, k=k)
+        result = measure_latency(retriever.invoke, queries)
+        logger.info(
+            f"{size:>10} | {'postings':>12} | {build:>9.2f} | {result['mean_ms']:>9.2f} | "
+            f"{result['p95_ms']:>9.2f} | {'-':>10}"
+        )
+
+        if size > okapi_max:
+            logger.info(f"{size:>10} | {'rank_bm25':>12} | {'skipped (--okapi-max)':>33}")
+            continue
+
+        started = time.perf_counter()
+        okapi = BM25Retriever.from_documents(documents, k=k)
+        build = time.perf_counter() - started
+        result = measure_latency(okapi.invoke, queries)
+        # Совпадение выдачи по оценкам (порядок равных оценок у реализаций может отличаться)
+        same = 0
+        for query in queries:
+            tokens = index.tokenize(query)
+            expected = np.sort(okapi.vectorizer.get_scores(tokens))[::-1]
+            expected = expected[expected > 0][:k]
+            found = np.sort(index.get_scores(tokens)[index.top_k(tokens, k)])[::-1]
+            same += int(len(found) == len(expected) and np.allclose(found, expected))
+        logger.info(
+            f"{size:>10} | {'rank_bm25':>12} | {build:>9.2f} | {result['mean_ms']:>9.2f} | "
+            f"{result['p95_ms']:>9.2f} | {same / len(queries):>10.0%}"
+        )
+
+def load_rerank_workload(dataset_path: str, num_queries: int):
+    """
+    Вопросы eval датасета и корпус для reranking
+
+    Корпус - чанки сохраненного индекса (INDEX_DIR); если индекса нет,
+    ответы из JSON файлов DATA_DIR (как при индексации).
+    """
+    path = Path(dataset_path)
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            questions = [item["question"] for item in json.load(f)]
+    else:
+        logger.warning(f"No eval dataset {path} (make dataset), using questions from {config.DATA_DIR}")
+        questions = []
+        for json_file in sorted(Path(config.DATA_DIR).glob("*.json")):
+            with open(json_file, encoding="utf-8") as f:
+                questions.extend(item["question"] for item in json.load(f))
+
+    loaded = index_store.load_index(config.INDEX_DIR)
+    if loaded is not None:
+        texts = [chunk.page_content for chunk in loaded[0]]
+    else:
+        logger.warning(f"No saved index in {config.INDEX_DIR}, using answers from {config.DATA_DIR} as corpus")
+        texts = []
+        for json_file in sorted(Path(config.DATA_DIR).glob("*.json")):
+            with open(json_file, encoding="utf-8") as f:
+                texts.extend(item["answer"] for item in json.load(f))
+
+    questions = [question for question in questions if question][:num_queries]
+    return questions, texts
+
+def rank_correlation(a: np.ndarray, b: np.ndarray) -> float:
+    """Корреляция Спирмена (оценки cross-encoder почти не бывают равными, ранги без поправки на ties)"""
+    ranks_a = np.argsort(np.argsort(a)).astype(np.float64)
+    ranks_b = np.argsort(np.argsort(b)).astype(np.float64)
+    if len(a) < 2 or ranks_a.std() == 0 or ranks_b.std() == 0:
+        return 1.0
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+def bench_rerank(dataset_path: str, candidates: int, top_k: int, num_queries: int, threads: int):
+    """Cross-encoder: torch против ONNX Runtime int8 - латентность и согласие оценок на eval датасете"""
+    from sentence_transformers import CrossEncoder
+    from cross_encoder_onnx import OnnxCrossEncoder
+
+    questions, texts = load_rerank_workload(dataset_path, num_queries)
+    if not questions or not texts:
+        logger.error("No questions or corpus for the rerank benchmark")
+        return
+    # Кандидаты как в hybrid_reranker: BM25 top-N по корпусу
+    index = BM25Index.build(texts)
+    workload = []
+    for question in questions:
+        positions, _ = index.search(index.tokenize(question), candidates)
+        if len(positions):
+            workload.append([(question, texts[position]) for position in positions])
+
+    if threads > 0:
+        import torch
+        torch.set_num_threads(threads)
+    backends = {
+        "torch": CrossEncoder(config.CROSS_ENCODER_MODEL),
+        "onnx int8": OnnxCrossEncoder(config.CROSS_ENCODER_MODEL, config.CROSS_ENCODER_ONNX_DIR, threads=threads),
+    }
+
+    logger.info(
+        f"Rerank benchmark: {config.CROSS_ENCODER_MODEL}, queries={len(workload)}, "
+        f"candidates={candidates}, top_k={top_k}, threads={threads or 'auto'}"
+    )
+    logger.info(f"{'backend':>10} | {'mean, ms':>9} | {'p95, ms':>9} | {'spearman':>9} | {'top-k':>6} | {'max |d|':>8}")
+
+    scores = {}
+    for name, model in backends.items():
+        model.predict(workload[0], batch_size=len(workload[0]), show_progress_bar=False)  # Прогрев
+        scores[name] = []
+        result = measure_latency(
+            lambda pairs: scores[name].append(np.asarray(
+                model.predict(pairs, batch_size=len(pairs), show_progress_bar=False), dtype=np.float64
+            )),
+            workload,
+        )
+        if name == "torch":
+            logger.info(f"{name:>10} | {result['mean_ms']:>9.1f} | {result['p95_ms']:>9.1f} | {'-':>9} | {'-':>6} | {'-':>8}")
+            continue
+
+        correlations, overlaps, max_diff = [], [], 0.0
+        for reference, found in zip(scores["torch"], scores[name]):
+            correlations.append(rank_correlation(reference, found))
+            k = min(top_k, len(reference))
+            overlaps.append(len(set(np.argsort(-reference)[:k]) & set(np.argsort(-found)[:k])) / k)
+            max_diff = max(max_diff, float(np.abs(reference - found).max()))
+        logger.info(
+            f"{name:>10} | {result['mean_ms']:>9.1f} | {result['p95_ms']:>9.1f} | "
+            f"{np.mean(correlations):>9.3f} | {np.mean(overlaps):>6.0%} | {max_diff:>8.3f}"
+        )
+
+def bench_chain(num_requests: int):
+    """Накладные расходы RAG-цепочки на запрос: сборка на каждый запрос (как раньше) против кеша"""
+    from langchain_core.language_models import FakeListChatModel
+    from langchain_core.messages import HumanMessage
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables import RunnableLambda
+    import rag
+
+    # LLM и retriever - заглушки без сети и модели: меряется только LCEL обвязка
+    documents = [
+        Document(page_content=f"chunk {i}", metadata={"source": "bench.pdf", "page": i, "chunk_id": i})
+        for i in range(config.RERANKER_TOP_K)
+    ]
+    config.RETRIEVAL_MODE = "hybrid"
+    rag.retriever = RunnableLambda(lambda query: documents)
+    rag._llm = FakeListChatModel(responses=["ответ"])
+    rag._llm_query_transform = FakeListChatModel(responses=["запрос"])
+    prompt, _ = rag._load_prompts()
+    inputs = {"messages": [HumanMessage(content="Как оформить кредитную карту?")]}
+    requests = list(range(num_requests))
+
+    def rebuilt_request(_):
+        # Прежний путь: цепочка собиралась в rag_answer(), подцепочка ответа - внутри шага
+        chain = rag._build_rag_chain(rag.retriever, rag.vector_store)
+        prompt | rag._get_llm() | StrOutputParser()
+        return chain.invoke(inputs)
+
+    rag.get_rag_chain()
+    results = [
+        ("chain build", measure_latency(lambda _: rag._build_rag_chain(rag.retriever, rag.vector_store), requests)),
+        ("rebuilt", measure_latency(rebuilt_request, requests)),
+        ("cached", measure_latency(lambda _: rag.get_rag_chain().invoke(inputs), requests)),
+    ]
+
+    logger.info(f"RAG chain benchmark: {num_requests} requests, fake LLM and retriever")
+    logger.info(f"{'path':>12} | {'mean, ms':>9} | {'p95, ms':>9}")
+    for name, result in results:
+        logger.info(f"{name:>12} | {result['mean_ms']:>9.3f} | {result['p95_ms']:>9.3f}")
+    saved = results[1][1]["mean_ms"] - results[2][1]["mean_ms"]
+    logger.info(f"Per-request overhead removed: {saved:.3f} ms ({saved / results[1][1]['mean_ms']:.0%})")
+
+class StubEmbeddingsClient:
+    """
+    Заглушка AsyncOpenAI для BatchedOpenAIEmbeddings: фиксированная задержка ответа,
+    учет одновременных запросов и моментов прихода токенов
+    """
+
+    def __init__(self, latency: float, dim: int = 8):
+        self.latency = latency
+        self.dim = dim
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []  # (время начала запроса, токенов в батче)
+        self.count_tokens = None
+        self.embeddings = self
+
+    async def create(self, model: str, input: list):
+        import asyncio
+        from types import SimpleNamespace
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.requests.append((time.monotonic(), sum(self.count_tokens(text) for text in input)))
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        data = [SimpleNamespace(index=i, embedding=[1.0] * self.dim) for i in range(len(input))]
+        return SimpleNamespace(data=data)
+
+def bench_embeddings(num_texts: int, slice_size: int, concurrency: int, tpm: int, latency_ms: int):
+    """
+    BatchedOpenAIEmbeddings против заглушки API: соблюдаются ли concurrency и лимит
+    tokens-per-minute на всей индексации, вызванной по частям, как в indexer.embed_chunks
+    """
+    from batched_embeddings import BatchedOpenAIEmbeddings
+
+    client = StubEmbeddingsClient(latency_ms / 1000)
+    embeddings = BatchedOpenAIEmbeddings(
+        model=config.EMBEDDING_MODEL,
+        max_batch_tokens=config.EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_size=config.EMBEDDING_BATCH_MAX_SIZE,
+        concurrency=concurrency,
+        tokens_per_minute=tpm,
+        client_factory=lambda: client,
+    )
+    client.count_tokens = embeddings._count_tokens
+    texts = [f"Условия по вкладу номер {i}: " + "ставка и срок размещения " * 5 for i in range(num_texts)]
+    total_tokens = sum(embeddings._count_tokens(text) for text in texts)
+
+    logger.info(
+        f"Embeddings benchmark: {num_texts} texts ({total_tokens} tokens), slices of {slice_size}, "
+        f"concurrency {concurrency}, TPM limit {tpm or 'off'}, stub latency {latency_ms} ms"
+    )
+    started = time.monotonic()
+    for start in range(0, num_texts, slice_size):
+        embeddings.embed_documents(texts[start:start + slice_size])
+    elapsed = time.monotonic() - started
+
+    # Бюджет token bucket к моменту начала каждого запроса: полный bucket + пополнение
+    worst_excess = 0.0
+    sent = 0
+    for request_started, tokens in client.requests:
+        sent += tokens
+        if tpm:
+            allowed = tpm + (request_started - started) * tpm / 60
+            worst_excess = max(worst_excess, sent - allowed)
+    min_elapsed = max(0.0, (total_tokens - tpm) * 60 / tpm) if tpm else 0.0
+
+    logger.info(f"Requests: {len(client.requests)}, elapsed {elapsed:.1f}s (TPM floor {min_elapsed:.1f}s)")
+    logger.info(
+        f"Max concurrent requests: {client.max_in_flight} (limit {concurrency}) - "
+        f"{'OK' if client.max_in_flight <= concurrency else 'VIOLATED'}"
+    )
+    if tpm:
+        # Небольшой допуск на неточность часов между резервом и стартом запроса
+        ok = worst_excess <= tpm * 0.01
+        logger.info(f"Tokens over TPM budget at worst: {max(worst_excess, 0):.0f} - {'OK' if ok else 'VIOLATED'}")
+
+def bench_rerank_worker(num_requests: int, pairs_per_request: int, latency_ms: int):
+    """
+    RerankWorker против заглушки cross-encoder: микробатчинг одновременных запросов
+    и живучесть потока-обработчика после отмены вызывающего (asyncio.wait_for)
+    """
+    import asyncio
+    from rerank_worker import RerankWorker
+
+    def predict(pairs):
+        time.sleep(latency_ms / 1000)
+        return [float(len(text)) for _, text in pairs]
+
+    worker = RerankWorker(
+        predict,
+        window=config.RERANK_BATCH_WINDOW_MS / 1000,
+        max_batch_pairs=config.RERANK_MAX_BATCH_PAIRS,
+    )
+    workload = [
+        [(f"вопрос {i}", "текст" * (j + 1)) for j in range(pairs_per_request)]
+        for i in range(num_requests)
+    ]
+
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(worker.ascore(pairs) for pairs in workload))
+        elapsed = time.perf_counter() - started
+        correct = all(
+            scores == [float(len(text)) for _, text in pairs] for pairs, scores in zip(workload, results)
+        )
+
+        # Первый запрос занимает обработчик, второй ждет в очереди и отменяется по таймауту
+        busy = asyncio.ensure_future(worker.ascore(workload[0]))
+        await asyncio.sleep(latency_ms / 4000)
+        try:
+            await asyncio.wait_for(worker.ascore(workload[1]), timeout=latency_ms / 4000)
+        except asyncio.TimeoutError:
+            pass
+        await busy
+        try:
+            await asyncio.wait_for(worker.ascore(workload[2 % num_requests]), timeout=latency_ms / 1000 * 10 + 1)
+            survived = True
+        except asyncio.TimeoutError:
+            survived = False
+        return elapsed, correct, survived
+
+    logger.info(
+        f"Rerank worker benchmark: {num_requests} concurrent requests x {pairs_per_request} pairs, "
+        f"window {config.RERANK_BATCH_WINDOW_MS} ms, max batch {config.RERANK_MAX_BATCH_PAIRS} pairs, "
+        f"stub latency {latency_ms} ms"
+    )
+    elapsed, correct, survived = asyncio.run(run())
+    stats = worker.get_stats()
+    logger.info(
+        f"Elapsed {elapsed * 1000:.0f} ms, sequential floor {num_requests * latency_ms} ms; "
+        f"batches: {stats['batches']}, mean {stats['mean_batch_requests']:.1f} requests / "
+        f"{stats['mean_batch_pairs']:.1f} pairs"
+    )
+    logger.info(f"Scores routed to callers: {'OK' if correct else 'VIOLATED'}")
+    logger.info(f"Worker alive after a cancelled caller: {'OK' if survived else 'VIOLATED'}")
+
+def main():
+    """Main CLI function"""
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the RAG pipeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    vector_parser = subparsers.add_parser("vector-store", help="NumpyVectorStore vs InMemoryVectorStore")
+    vector_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    vector_parser.add_argument("--dim", type=int, default=384, help="Embedding dimension")
+    vector_parser.add_argument("--k", type=int, default=10)
+    vector_parser.add_argument("--queries", type=int, default=50)
+    vector_parser.add_argument("--inmemory-max", type=int, default=100_000,
+                               help="Skip InMemoryVectorStore above this corpus size")
+
+    ann_parser = subparsers.add_parser("ann", help="HNSW recall@k and latency vs exact search")
+    ann_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    ann_parser.add_argument("--dim", type=int, default=384, help="Embedding dimension")
+    ann_parser.add_argument("--k", type=int, default=10)
+    ann_parser.add_argument("--queries", type=int, default=200)
+    ann_parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    ann_parser.add_argument("--saved-index", action="store_true",
+                            help="Use embeddings of the saved index (INDEX_DIR) instead of random vectors")
+
+    quant_parser = subparsers.add_parser("quantization", help="float16/int8/PQ memory, recall@k and latency")
+    quant_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    quant_parser.add_argument("--dim", type=int, default=3072, help="Embedding dimension")
+    quant_parser.add_argument("--k", type=int, default=10)
+    quant_parser.add_argument("--queries", type=int, default=50)
+    quant_parser.add_argument("--subvectors", type=int, default=0, help="PQ subvectors (0 - dim / 8)")
+    quant_parser.add_argument("--rescore-factor", type=int, default=4)
+    quant_parser.add_argument("--saved-index", action="store_true",
+                              help="Use embeddings of the saved index (INDEX_DIR) instead of random vectors")
+
+    bm25_parser = subparsers.add_parser("bm25", help="Postings BM25 vs BM25Retriever (rank_bm25) latency")
+    bm25_parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    bm25_parser.add_argument("--k", type=int, default=10)
+    bm25_parser.add_argument("--queries", type=int, default=50)
+    bm25_parser.add_argument("--query-terms", type=int, default=5)
+    bm25_parser.add_argument("--okapi-max", type=int, default=100_000,
+                             help="Skip BM25Retriever above this corpus size")
+
+    rerank_parser = subparsers.add_parser("rerank", help="Cross-encoder torch vs ONNX Runtime int8 latency and agreement")
+    rerank_parser.add_argument("--dataset", default="datasets/06-rag-qa-dataset.json", help="Eval dataset (make dataset)")
+    rerank_parser.add_argument("--candidates", type=int, default=20, help="BM25 candidates per question")
+    rerank_parser.add_argument("--top-k", type=int, default=config.RERANKER_TOP_K)
+    rerank_parser.add_argument("--queries", type=int, default=50)
+    rerank_parser.add_argument("--threads", type=int, default=config.CROSS_ENCODER_THREADS, help="0 - default")
+
+    worker_parser = subparsers.add_parser(
+        "rerank-worker", help="Rerank micro-batching against a stub cross-encoder, survives cancelled callers"
+    )
+    worker_parser.add_argument("--requests", type=int, default=32)
+    worker_parser.add_argument("--pairs", type=int, default=10, help="Candidates per request")
+    worker_parser.add_argument("--latency-ms", type=int, default=40, help="Stub predict time per batch")
+
+    chain_parser = subparsers.add_parser("chain", help="RAG chain rebuilt per request vs cached")
+    chain_parser.add_argument("--requests", type=int, default=200)
+
+    embeddings_parser = subparsers.add_parser(
+        "embeddings", help="Batched embeddings against a stub API: concurrency and TPM limit"
+    )
+    embeddings_parser.add_argument("--texts", type=int, default=3000)
+    embeddings_parser.add_argument("--slice-size", type=int, default=1024, help="Texts per embed_documents call")
+    embeddings_parser.add_argument("--concurrency", type=int, default=config.EMBEDDING_CONCURRENCY)
+    embeddings_parser.add_argument("--tpm", type=int, default=150_000, help="Tokens per minute, 0 - no limit")
+    embeddings_parser.add_argument("--latency-ms", type=int, default=50, help="Stub API response time")
+
+    args = parser.parse_args()
+
+    if args.command == "vector-store":
+        bench_vector_store(args.sizes, args.dim, args.k, args.queries, args.inmemory_max)
+    elif args.command == "ann":
+        bench_ann(args.sizes, args.dim, args.k, args.queries, args.ef, args.saved_index)
+    elif args.command == "quantization":
+        bench_quantization(args.sizes, args.dim, args.k, args.queries, args.subvectors,
+                           args.rescore_factor, args.saved_index)
+    elif args.command == "bm25":
+        bench_bm25(args.sizes, args.k, args.queries, args.query_terms, args.okapi_max)
+    elif args.command == "rerank":
+        bench_rerank(args.dataset, args.candidates, args.top_k, args.queries, args.threads)
+    elif args.command == "rerank-worker":
+        bench_rerank_worker(args.requests, args.pairs, args.latency_ms)
+    elif args.command == "chain":
+        bench_chain(args.requests)
+    elif args.command == "embeddings":
+        bench_embeddings(args.texts, args.slice_size, args.concurrency, args.tpm, args.latency_ms)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+import json
+import logging
+import re
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.retrievers.bm25 import default_preprocessing_func
+from pydantic import ConfigDict, Field, PrivateAttr
+from numpy_vector_store import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+BM25_FILE = "bm25.npz"
+BM25_META_FILE = "bm25.json"
+BM25_TERMS_FILE = "bm25_terms.json"
+BM25_LEMMAS_FILE = "bm25_lemmas.json"
+
+# Параметры BM25Okapi (rank_bm25), которые использовал BM25Retriever
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+# Слова для нормализации: буквы/цифры без пунктуации
+WORD_PATTERN = re.compile(r"\w+")
+
+# Сколько нормализованных слов запросов (не из корпуса) держать в памяти
+QUERY_LEMMAS_SIZE = 10000
+
+def _import_morphology(normalization: str):
+    """Ленивый импорт опциональной зависимости: стеммер или лемматизатор"""
+    try:
+        if normalization == "stem":
+            import snowballstemmer
+            return snowballstemmer.stemmer("russian").stemWord
+        import pymorphy3
+        analyzer = pymorphy3.MorphAnalyzer()
+        return lambda word: analyzer.parse(word)[0].normal_form
+    except ImportError as e:
+        raise ImportError(
+            f"BM25_NORMALIZATION={normalization} requires pymorphy3 and snowballstemmer. "
+            "Install them with: uv sync --extra morph"
+        ) from e
+
+class TokenNormalizer:
+    """
+    Нормализация токенов для BM25: none (как BM25Retriever), stem (Snowball) или lemma (pymorphy3)
+
+    Результат нормализации запоминается в таблице token -> lemma. Таблица
+    заполняется при индексации по всему корпусу и сохраняется вместе с индексом,
+    поэтому для запроса нормализация - обычно поиск в словаре; стеммер/лемматизатор
+    загружается только для слов, которых не было в корпусе.
+
+    После построения индекса (freeze) таблица корпуса больше не растет: слова
+    запросов запоминаются в отдельном LRU на QUERY_LEMMAS_SIZE слов и не сохраняются.
+    """
+
+    def __init__(self, normalization: str = "none", lemmas: dict = None):
+        self.normalization = normalization
+        self.lemmas = lemmas if lemmas is not None else {}
+        # Загруженная таблица - уже словарь всего корпуса
+        self.frozen = lemmas is not None
+        self._query_lemmas = OrderedDict()
+        self._lock = threading.Lock()
+        self._morph = None
+
+    def freeze(self):
+        """Корпус нормализован: новые слова дальше идут только в LRU запросов"""
+        self.frozen = True
+
+    def _normalize_word(self, word: str) -> str:
+        lemma = self.lemmas.get(word)
+        if lemma is not None:
+            return lemma
+        if not self.frozen:
+            lemma = self._lemmatize(word)
+            self.lemmas[word] = lemma
+            return lemma
+        with self._lock:
+            lemma = self._query_lemmas.get(word)
+            if lemma is not None:
+                self._query_lemmas.move_to_end(word)
+                return lemma
+        lemma = self._lemmatize(word)
+        with self._lock:
+            self._query_lemmas[word] = lemma
+            while len(self._query_lemmas) > QUERY_LEMMAS_SIZE:
+                self._query_lemmas.popitem(last=False)
+        return lemma
+
+    def _lemmatize(self, word: str) -> str:
+        if self._morph is None:
+            self._morph = _import_morphology(self.normalization)
+        return self._morph(word)
+
+    def __call__(self, text: str) -> list:
+        if self.normalization == "none":
+            return default_preprocessing_func(text)
+        return [self._normalize_word(word) for word in WORD_PATTERN.findall(text.lower().replace("ё", "е"))]
+
+class BM25Index:
+    """
+    Статистики BM25, построенные один раз при индексации
+
+    Словарь (термин -> id), document frequency, длины документов и postings
+    в CSR-виде: для термина t его документы и частоты лежат в
+    posting_docs/posting_tfs[term_offsets[t]:term_offsets[t + 1]].
+    Оценки совпадают с rank_bm25.BM25Okapi (включая eps-пол для отрицательных idf),
+    токенизация без нормализации - как у BM25Retriever по умолчанию. С нормализацией
+    словарь состоит из основ/лемм, и запрос приводится к ним через тот же TokenNormalizer.
+    """
+
+    def __init__(self, vocabulary: dict, doc_len: np.ndarray, term_offsets: np.ndarray,
+                 posting_docs: np.ndarray, posting_tfs: np.ndarray, normalizer: TokenNormalizer = None):
+        self.normalizer = normalizer or TokenNormalizer()
+        self.vocabulary = vocabulary
+        self.doc_len = doc_len
+        self.term_offsets = term_offsets
+        self.posting_docs = posting_docs
+        self.posting_tfs = posting_tfs
+
+        self.corpus_size = len(doc_len)
+        self.avgdl = float(doc_len.sum()) / self.corpus_size if self.corpus_size else 0.0
+        self.df = np.diff(term_offsets)
+        idf = np.log(self.corpus_size - self.df + 0.5) - np.log(self.df + 0.5)
+        if len(idf):
+            idf[idf < 0] = BM25_EPSILON * idf.mean()
+        self.idf = idf
+        # Нормировка длины документа из знаменателя BM25
+        self.doc_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / self.avgdl) if self.avgdl else np.ones(len(doc_len))
+
+    def __len__(self) -> int:
+        return self.corpus_size
+
+    @property
+    def normalization(self) -> str:
+        return self.normalizer.normalization
+
+    def tokenize(self, text: str) -> list:
+        return self.normalizer(text)
+
+    @classmethod
+    def build(cls, texts, normalization: str = "none") -> "BM25Index":
+        """Токенизация (и нормализация) корпуса и построение postings"""
+        normalizer = TokenNormalizer(normalization)
+        vocabulary = {}
+        posting_terms = array("q")
+        posting_docs = array("q")
+        posting_tfs = array("l")
+        doc_len = array("l")
+        for doc_id, text in enumerate(texts):
+            tokens = normalizer(text)
+            doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                posting_terms.append(vocabulary.setdefault(term, len(vocabulary)))
+                posting_docs.append(doc_id)
+                posting_tfs.append(tf)
+
+        terms = np.frombuffer(posting_terms, dtype=np.int64)
+        order = np.argsort(terms, kind="stable")
+        term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=term_offsets[1:])
+        normalizer.freeze()
+        return cls(
+            vocabulary,
+            np.frombuffer(doc_len, dtype=np.int64).astype(np.int32),
+            term_offsets,
+            np.frombuffer(posting_docs, dtype=np.int64)[order].astype(np.int32),
+            np.frombuffer(posting_tfs, dtype=np.int64)[order].astype(np.int32),
+            normalizer,
+        )
+
+    def score_matches(self, query_tokens: list):
+        """
+        BM25 оценки только документов, содержащих термины запроса
+
+        Просматриваются postings терминов запроса, вклад каждого термина
+        суммируется по документу (повторы терминов в запросе считаются, как в BM25Okapi).
+        Стоимость - суммарная длина postings, а не размер корпуса.
+
+        Returns:
+            tuple: (docs, scores) - позиции документов (по возрастанию) и их оценки
+        """
+        terms = [self.vocabulary[token] for token in query_tokens if token in self.vocabulary]
+        if not terms:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        starts = self.term_offsets[terms]
+        ends = self.term_offsets[np.asarray(terms) + 1]
+        docs = np.concatenate([self.posting_docs[start:end] for start, end in zip(starts, ends)])
+        tfs = np.concatenate([self.posting_tfs[start:end] for start, end in zip(starts, ends)])
+        idf = np.repeat(self.idf[terms], ends - starts)
+        contributions = idf * tfs * (BM25_K1 + 1) / (tfs + self.doc_norm[docs])
+        if len(terms) == 1:
+            return docs, contributions
+        matched, inverse = np.unique(docs, return_inverse=True)
+        return matched, np.bincount(inverse, weights=contributions, minlength=len(matched))
+
+    def get_scores(self, query_tokens: list) -> np.ndarray:
+        """BM25 оценки всех документов (как BM25Okapi.get_scores)"""
+        scores = np.zeros(self.corpus_size)
+        docs, matched_scores = self.score_matches(query_tokens)
+        scores[docs] = matched_scores
+        return scores
+
+    def search(self, query_tokens: list, k: int):
+        """
+        k лучших документов по убыванию оценки
+
+        Выбираются только среди документов с терминами запроса (частичная
+        сортировка через argpartition), документы без совпадений не возвращаются.
+
+        Returns:
+            tuple: (positions, scores)
+        """
+        docs, scores = self.score_matches(query_tokens)
+        best = top_k_indices(scores, k)
+        return docs[best], scores[best]
+
+    def top_k(self, query_tokens: list, k: int) -> list:
+        """Позиции k лучших документов по убыванию оценки"""
+        positions, _ = self.search(query_tokens, k)
+        return [int(position) for position in positions]
+
+    def save(self, index_dir: str, corpus_hash: str):
+        """Сохранение рядом с сохраненным индексом"""
+        index_path = Path(index_dir)
+        np.savez(
+            index_path / BM25_FILE,
+            doc_len=self.doc_len,
+            term_offsets=self.term_offsets,
+            posting_docs=self.posting_docs,
+            posting_tfs=self.posting_tfs,
+        )
+        terms = [None] * len(self.vocabulary)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+        (index_path / BM25_TERMS_FILE).write_text(json.dumps(terms, ensure_ascii=False), encoding="utf-8")
+        if self.normalization != "none":
+            lemmas = json.dumps(self.normalizer.lemmas, ensure_ascii=False)
+            (index_path / BM25_LEMMAS_FILE).write_text(lemmas, encoding="utf-8")
+        meta = {
+            "corpus_hash": corpus_hash,
+            "count": self.corpus_size,
+            "normalization": self.normalization,
+            "terms": len(terms),
+        }
+        (index_path / BM25_META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        logger.info(f"BM25 index saved to {index_path} ({len(terms)} terms, {len(self.posting_docs)} postings)")
+
+    @staticmethod
+    def is_saved(index_dir: str, corpus_hash: str, count: int, normalization: str = "none") -> bool:
+        """Есть ли сохраненный индекс для того же корпуса и нормализации"""
+        index_path = Path(index_dir)
+        meta_path = index_path / BM25_META_FILE
+        if not meta_path.exists() or not (index_path / BM25_FILE).exists() or not (index_path / BM25_TERMS_FILE).exists():
+            return False
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return False
+        return (
+            meta.get("corpus_hash") == corpus_hash
+            and meta.get("count") == count
+            and meta.get("normalization", "none") == normalization
+        )
+
+    @classmethod
+    def load(cls, index_dir: str, corpus_hash: str, count: int, normalization: str = "none"):
+        """Загрузка, если индекс построен для того же корпуса и нормализации (иначе None)"""
+        index_path = Path(index_dir)
+        if not cls.is_saved(index_dir, corpus_hash, count, normalization):
+            logger.info(f"No matching BM25 index in {index_path}")
+            return None
+        try:
+            terms = json.loads((index_path / BM25_TERMS_FILE).read_text(encoding="utf-8"))
+            lemmas = None
+            if normalization != "none":
+                lemmas = json.loads((index_path / BM25_LEMMAS_FILE).read_text(encoding="utf-8"))
+            with np.load(index_path / BM25_FILE) as data:
+                arrays = {key: data[key] for key in data.files}
+        except (OSError, ValueError, json.JSONDecodeError) as e:
+            logger.warning(f"Cannot load BM25 index from {index_path}: {e}")
+            return None
+        vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+        return cls(
+            vocabulary, arrays["doc_len"], arrays["term_offsets"], arrays["posting_docs"], arrays["posting_tfs"],
+            TokenNormalizer(normalization, lemmas),
+        )
+
+class BM25IndexRetriever(BaseRetriever):
+    """
+    BM25 retriever поверх BM25Index (замена BM25Retriever с тем же поведением)
+
+    Индекс загружается лениво при первом запросе из index_dir, если он построен
+    для того же корпуса (corpus_hash, число документов) и нормализации, иначе строится из docs.
+    """
+
+    docs: list = Field(repr=False)
+    k: int = 4
+    index_dir: Optional[str] = None
+    corpus_hash: Optional[str] = None
+    normalization: str = "none"
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    _index: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def from_index(cls, index: BM25Index, docs: list, **kwargs) -> "BM25IndexRetriever":
+        retriever = cls(docs=docs, **kwargs)
+        retriever._index = index
+        return retriever
+
+    @property
+    def index(self) -> BM25Index:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load_or_build()
+        return self._index
+
+    def _load_or_build(self) -> BM25Index:
+        index = None
+        if self.index_dir and self.corpus_hash:
+            index = BM25Index.load(self.index_dir, self.corpus_hash, len(self.docs), self.normalization)
+        if index is not None:
+            logger.info(f"Loaded BM25 index: {len(index.vocabulary)} terms")
+            return index
+        logger.info(f"Building BM25 index for {len(self.docs)} documents (normalization: {self.normalization})")
+        return BM25Index.build((doc.page_content for doc in self.docs), self.normalization)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        index = self.index
+        positions = index.top_k(index.tokenize(query), self.k)
+        return [self.docs[i] for i in positions]
@@ -11,6 +11,7 @@ from handlers import router
 from config import config
 import indexer
 import rag
+import warmup
 
 # Создаем директорию для логов
 log_dir = Path("logs")
@@ -55,7 +56,8 @@ async def main():
     
     # Индексация при старте
     logger.info("📚 Starting indexing...")
-    result = await indexer.reindex_all()
+    # Сохраненный индекс загружается с диска, пересборка - только если манифест устарел
+    result = await indexer.load_or_reindex()
     if result and result[0] is not None:
         rag.vector_store, rag.chunks = result
         # Инициализируем retriever
@@ -65,6 +67,16 @@ async def main():
     else:
         logger.warning("⚠️  Indexing completed with no documents - bot will run but cannot answer questions")
     
+    # Прогрев моделей: первый вопрос не платит за загрузку эмбеддингов и cross-encoder
+    if config.WARMUP_MODE == "blocking":
+        logger.info("🔥 Warming up models...")
+        await warmup.warmup()
+    elif config.WARMUP_MODE == "background":
+        logger.info("🔥 Warming up models in background...")
+        warmup.start_background()
+    else:
+        warmup.disable()
+    
     bot = Bot(token=config.TELEGRAM_TOKEN)
     dp = Dispatcher()
     dp.include_router(router)
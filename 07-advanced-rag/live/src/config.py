@@ -17,21 +17,86 @@ class Config:
     QUERY_TRANSFORM_PROMPT_FILE = os.getenv("QUERY_TRANSFORM_PROMPT_FILE", "query_transform.txt")
     SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT")
     
+    # Index Configuration
+    INDEX_DIR = os.getenv("INDEX_DIR", "index")  # Сохраненный индекс (эмбеддинги + чанки + манифест)
+    CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+    PDF_INGEST_WORKERS = int(os.getenv("PDF_INGEST_WORKERS", "1"))  # >1 - парсинг PDF в пуле процессов
+    PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "50"))  # Диапазон страниц на одну задачу пула
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "2"))  # Батчей в очереди между стадиями индексации
+    
     # Embeddings Configuration
     EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai/huggingface
     HUGGINGFACE_EMBEDDING_MODEL = os.getenv("HUGGINGFACE_EMBEDDING_MODEL", "intfloat/multilingual-e5-small")
     HUGGINGFACE_DEVICE = os.getenv("HUGGINGFACE_DEVICE", "cpu")  # cpu/cuda/mps
     
+    # OpenAI Embedding Batching Configuration (индексация)
+    EMBEDDING_BATCHING_ENABLED = os.getenv("EMBEDDING_BATCHING_ENABLED", "false").lower() == "true"
+    EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "50000"))
+    EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "256"))
+    EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+    EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+    EMBEDDING_TPM_LIMIT = int(os.getenv("EMBEDDING_TPM_LIMIT", "0"))  # 0 - без ограничения
+    
+    # Embedding Cache Configuration
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite")
+    EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+    
     # Retrieval Configuration
     RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "semantic")  # semantic/hybrid/hybrid_reranker
     SEMANTIC_RETRIEVER_K = int(os.getenv("SEMANTIC_RETRIEVER_K", "10"))
     BM25_RETRIEVER_K = int(os.getenv("BM25_RETRIEVER_K", "10"))
     ENSEMBLE_SEMANTIC_WEIGHT = float(os.getenv("ENSEMBLE_SEMANTIC_WEIGHT", "0.5"))
     ENSEMBLE_BM25_WEIGHT = float(os.getenv("ENSEMBLE_BM25_WEIGHT", "0.5"))
+    BM25_NORMALIZATION = os.getenv("BM25_NORMALIZATION", "none")  # none/stem/lemma
+    HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")  # rrf/score
+    HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", "0"))  # 0 - все найденные ветками документы
+    HYBRID_LEG_TIMEOUT_MS = int(os.getenv("HYBRID_LEG_TIMEOUT_MS", "0"))  # Дедлайн ветки hybrid, 0 - без дедлайна (по умолчанию)
+    
+    # Vector Index Configuration
+    VECTOR_INDEX_BACKEND = os.getenv("VECTOR_INDEX_BACKEND", "exact")  # exact/hnsw
+    HNSW_M = int(os.getenv("HNSW_M", "16"))
+    HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+    ANN_RECALL_SAMPLE = int(os.getenv("ANN_RECALL_SAMPLE", "100"))  # Запросов для проверки recall@k, 0 - не проверять
+    VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")  # none/float16/int8/pq (для exact backend)
+    PQ_SUBVECTORS = int(os.getenv("PQ_SUBVECTORS", "0"))  # 0 - dim / 8
+    VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))  # Пересчет k * factor кандидатов по float32, 0 - без пересчета
     
     # Cross-Encoder Reranking Configuration
     CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
     RERANKER_TOP_K = int(os.getenv("RERANKER_TOP_K", "3"))
+    CROSS_ENCODER_BACKEND = os.getenv("CROSS_ENCODER_BACKEND", "torch")  # torch/onnx (int8, CPU)
+    CROSS_ENCODER_THREADS = int(os.getenv("CROSS_ENCODER_THREADS", "0"))  # Intra-op потоки, 0 - по умолчанию
+    CROSS_ENCODER_ONNX_DIR = os.getenv("CROSS_ENCODER_ONNX_DIR", "cache/onnx")  # Экспортированные ONNX модели
+    RERANK_CASCADE_ENABLED = os.getenv("RERANK_CASCADE_ENABLED", "false").lower() == "true"  # Оценивать только top N по hybrid
+    RERANK_CASCADE_DEPTH = int(os.getenv("RERANK_CASCADE_DEPTH", "6"))  # Начальная глубина N и шаг расширения
+    RERANK_CASCADE_MIN_GAP = float(os.getenv("RERANK_CASCADE_MIN_GAP", "0.15"))  # Отрыв (доля разброса оценок hybrid), при котором не расширяем
+    RERANK_CASCADE_MAX_DEPTH = int(os.getenv("RERANK_CASCADE_MAX_DEPTH", "12"))  # Жесткий предел (не ниже RERANKER_TOP_K), 0 - все кандидаты
+    RERANK_BATCH_WINDOW_MS = int(os.getenv("RERANK_BATCH_WINDOW_MS", "10"))  # Окно сбора пар одновременных запросов
+    RERANK_MAX_BATCH_PAIRS = int(os.getenv("RERANK_MAX_BATCH_PAIRS", "128"))
+    RERANK_CACHE_ENABLED = os.getenv("RERANK_CACHE_ENABLED", "true").lower() == "true"
+    RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "50000"))
+    RERANK_CACHE_PATH = os.getenv("RERANK_CACHE_PATH", "")  # Пусто - только в памяти
+    
+    # Трансформация запроса (MODEL_QUERY_TRANSFORM)
+    QUERY_TRANSFORM_SKIP_FIRST = os.getenv("QUERY_TRANSFORM_SKIP_FIRST", "false").lower() == "true"  # Первый вопрос диалога - без LLM
+    QUERY_TRANSFORM_HISTORY_WINDOW = int(os.getenv("QUERY_TRANSFORM_HISTORY_WINDOW", "0"))  # Сообщений истории в промпте, 0 - вся история
+    QUERY_TRANSFORM_CACHE_SIZE = int(os.getenv("QUERY_TRANSFORM_CACHE_SIZE", "0"))  # Запомненных запросов, 0 - без кеша (по умолчанию)
+    
+    # Кеш ответов по смысловой близости самостоятельного запроса
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # Минимальная косинусная близость
+    ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))  # Время жизни ответа
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    
+    # Потоковая отправка ответа в Telegram
+    STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "false").lower() == "true"
+    STREAM_EDIT_INTERVAL_MS = int(os.getenv("STREAM_EDIT_INTERVAL_MS", "1000"))  # Не чаще одного edit_text в интервал
+    
+    # Прогрев моделей при старте
+    WARMUP_MODE = os.getenv("WARMUP_MODE", "off")  # off - модели грузятся при первом запросе, blocking - до приема сообщений, background - параллельно
     
     # Отображение источников
     SHOW_SOURCES = os.getenv("SHOW_SOURCES", "false").lower() == "true"
@@ -69,6 +134,74 @@ class Config:
                 f"Must be one of: {', '.join(valid_retrieval_modes)}"
             )
         
+        # Валидация BM25_NORMALIZATION
+        valid_bm25_normalizations = ["none", "stem", "lemma"]
+        if cls.BM25_NORMALIZATION not in valid_bm25_normalizations:
+            raise ValueError(
+                f"Invalid BM25_NORMALIZATION: {cls.BM25_NORMALIZATION}. "
+                f"Must be one of: {', '.join(valid_bm25_normalizations)}"
+            )
+        
+        # Валидация HYBRID_FUSION
+        valid_hybrid_fusions = ["rrf", "score"]
+        if cls.HYBRID_FUSION not in valid_hybrid_fusions:
+            raise ValueError(
+                f"Invalid HYBRID_FUSION: {cls.HYBRID_FUSION}. "
+                f"Must be one of: {', '.join(valid_hybrid_fusions)}"
+            )
+        
+        # Валидация CROSS_ENCODER_BACKEND
+        valid_cross_encoder_backends = ["torch", "onnx"]
+        if cls.CROSS_ENCODER_BACKEND not in valid_cross_encoder_backends:
+            raise ValueError(
+                f"Invalid CROSS_ENCODER_BACKEND: {cls.CROSS_ENCODER_BACKEND}. "
+                f"Must be one of: {', '.join(valid_cross_encoder_backends)}"
+            )
+        
+        # Валидация каскадного reranking
+        if cls.RERANK_CASCADE_DEPTH < 1:
+            raise ValueError("RERANK_CASCADE_DEPTH must be >= 1")
+        if not 0 <= cls.RERANK_CASCADE_MIN_GAP <= 1:
+            raise ValueError("RERANK_CASCADE_MIN_GAP must be between 0 and 1")
+        
+        # Валидация трансформации запроса
+        if cls.QUERY_TRANSFORM_HISTORY_WINDOW < 0:
+            raise ValueError("QUERY_TRANSFORM_HISTORY_WINDOW must be >= 0")
+        if cls.QUERY_TRANSFORM_CACHE_SIZE < 0:
+            raise ValueError("QUERY_TRANSFORM_CACHE_SIZE must be >= 0")
+        
+        # Валидация кеша ответов
+        if not 0 <= cls.ANSWER_CACHE_THRESHOLD <= 1:
+            raise ValueError("ANSWER_CACHE_THRESHOLD must be between 0 and 1")
+        if cls.ANSWER_CACHE_MAX_ENTRIES < 1:
+            raise ValueError("ANSWER_CACHE_MAX_ENTRIES must be >= 1")
+        
+        # Валидация WARMUP_MODE
+        valid_warmup_modes = ["blocking", "background", "off"]
+        if cls.WARMUP_MODE not in valid_warmup_modes:
+            raise ValueError(
+                f"Invalid WARMUP_MODE: {cls.WARMUP_MODE}. "
+                f"Must be one of: {', '.join(valid_warmup_modes)}"
+            )
+        
+        # Валидация VECTOR_INDEX_BACKEND
+        valid_vector_index_backends = ["exact", "hnsw"]
+        if cls.VECTOR_INDEX_BACKEND not in valid_vector_index_backends:
+            raise ValueError(
+                f"Invalid VECTOR_INDEX_BACKEND: {cls.VECTOR_INDEX_BACKEND}. "
+                f"Must be one of: {', '.join(valid_vector_index_backends)}"
+            )
+        
+        # Валидация VECTOR_QUANTIZATION
+        valid_vector_quantizations = ["none", "float16", "int8", "pq"]
+        if cls.VECTOR_QUANTIZATION not in valid_vector_quantizations:
+            raise ValueError(
+                f"Invalid VECTOR_QUANTIZATION: {cls.VECTOR_QUANTIZATION}. "
+                f"Must be one of: {', '.join(valid_vector_quantizations)}"
+            )
+        if cls.VECTOR_QUANTIZATION != "none" and cls.VECTOR_INDEX_BACKEND != "exact":
+            raise ValueError("VECTOR_QUANTIZATION is supported only with VECTOR_INDEX_BACKEND=exact")
+        
         # Валидация EMBEDDING_PROVIDER
         valid_embedding_providers = ["openai", "huggingface"]
         if cls.EMBEDDING_PROVIDER not in valid_embedding_providers:
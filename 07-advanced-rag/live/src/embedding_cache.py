@@ -0,0 +1,231 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Накопительная статистика кеша за время работы процесса
+_stats = {"hits": 0, "misses": 0}
+
+# Лимит параметров в одном SQL запросе (SQLITE_MAX_VARIABLE_NUMBER)
+_SQL_BATCH = 500
+
+# Сколько последних эмбеддингов запросов держать в памяти
+QUERY_MEMO_SIZE = 256
+
+# Пул для эмбеддинга запросов моделями без async API (HuggingFace): async цепочка
+# не должна занимать executor по умолчанию
+_query_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="query-embed")
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для ключа кеша: NFC + схлопывание пробелов"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def make_cache_key(provider: str, model: str, text: str) -> str:
+    """Ключ кеша: хеш от (провайдер, модель, нормализованный текст)"""
+    payload = f"{provider}\0{model}\0{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обертка над embeddings с content-addressed кешем в SQLite
+
+    Кешируются только эмбеддинги документов (embed_documents): при переиндексации
+    модель вызывается лишь для новых и измененных чанков. При превышении max_bytes
+    вытесняются давно не использованные записи. Запросы пользователей (embed_query)
+    проходят напрямую.
+    """
+
+    def __init__(self, embeddings: Embeddings, provider: str, model: str,
+                 path: str, max_bytes: int):
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model = model
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _get_conn(self):
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        return self._conn
+
+    def _lookup(self, keys: list) -> dict:
+        """Поиск векторов по ключам с обновлением времени использования"""
+        conn = self._get_conn()
+        found = {}
+        for start in range(0, len(keys), _SQL_BATCH):
+            batch = keys[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        if found:
+            now = time.time()
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            conn.commit()
+        return found
+
+    def _store(self, items: dict):
+        """Сохранение новых векторов и вытеснение старых записей при превышении лимита"""
+        conn = self._get_conn()
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+        self._evict()
+
+    def _evict(self):
+        conn = self._get_conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Освобождаем с запасом (до 90% лимита), чтобы не вытеснять на каждой вставке
+        to_free = total - int(self.max_bytes * 0.9)
+        freed = 0
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+            evicted.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+        conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        conn.commit()
+        logger.info(f"Embedding cache: evicted {len(evicted)} entries ({freed / 1024 / 1024:.1f} MB)")
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [make_cache_key(self.provider, self.model, text) for text in texts]
+
+        with self._lock:
+            cached = self._lookup(list(set(keys)))
+
+        # Дубликаты внутри одного вызова считаем одним промахом
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                self._store(computed)
+            cached.update({key: np.asarray(vector, dtype=np.float32) for key, vector in computed.items()})
+
+        hits = len(texts) - len(missing)
+        self.hits += hits
+        self.misses += len(missing)
+        _stats["hits"] += hits
+        _stats["misses"] += len(missing)
+
+        return [cached[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list:
+        return await self.embeddings.aembed_query(text)
+
+    def get_info(self) -> dict:
+        """Размер кеша на диске"""
+        with self._lock:
+            count, total = self._get_conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()
+        return {"entries": count, "size_mb": total / 1024 / 1024}
+
+class QueryMemoEmbeddings(Embeddings):
+    """
+    Обертка над embeddings, запоминающая последние QUERY_MEMO_SIZE эмбеддингов запросов
+
+    Один и тот же запрос эмбеддится кешем ответов и semantic веткой retrieval,
+    второй вызов берется из памяти. Не зависит от кеша эмбеддингов на диске
+    (EMBEDDING_CACHE_ENABLED), эмбеддинги документов проходят напрямую.
+
+    У моделей без собственного aembed_query (HuggingFace) базовый Embeddings
+    отправляет вызов в executor по умолчанию; здесь он идет в свой пул _query_executor.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self._native_async = type(embeddings).aembed_query is not Embeddings.aembed_query
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, text: str):
+        with self._lock:
+            vector = self._memo.get(text)
+            if vector is not None:
+                self._memo.move_to_end(text)
+            return vector
+
+    def _put(self, text: str, vector: list):
+        with self._lock:
+            self._memo[text] = vector
+            while len(self._memo) > QUERY_MEMO_SIZE:
+                self._memo.popitem(last=False)
+
+    def embed_documents(self, texts: list) -> list:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list) -> list:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> list:
+        vector = self._get(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._put(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list:
+        vector = self._get(text)
+        if vector is None:
+            if self._native_async:
+                vector = await self.embeddings.aembed_query(text)
+            else:
+                loop = asyncio.get_running_loop()
+                vector = await loop.run_in_executor(_query_executor, self.embeddings.embed_query, text)
+            self._put(text, vector)
+        return vector
+
+def get_cache_stats() -> dict:
+    """Статистика кеша для /index_status"""
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        "enabled": config.EMBEDDING_CACHE_ENABLED,
+        "hits": _stats["hits"],
+        "misses": _stats["misses"],
+        "hit_rate": _stats["hits"] / total if total else 0.0,
+    }
@@ -172,6 +172,9 @@ def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]:
     # ========== Шаг 1: Запуск эксперимента и сбор данных ==========
     logger.info("\n[1/3] Running experiment and collecting data...")
     
+    # Цепочка собирается один раз на весь эксперимент (индекс во время evaluation тот же)
+    rag_chain = rag.get_rag_chain()
+    
     # Создаем target функцию для нашего RAG
     def target(inputs: dict) -> dict:
         """Target функция для evaluation"""
@@ -180,7 +183,7 @@ def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]:
         # Используем существующую RAG цепочку
         # Передаем только вопрос (без истории для evaluation)
         from langchain_core.messages import HumanMessage
-        result = rag.get_rag_chain().invoke({"messages": [HumanMessage(content=question)]})
+        result = rag_chain.invoke({"messages": [HumanMessage(content=question)]})
         
         return {
             "answer": result["answer"],
@@ -1,16 +1,49 @@
 import logging
+import time
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from config import config
-import indexer
+import index_jobs
 import rag
 import evaluation
+import warmup
+from telegram_stream import StreamingReply
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+# Названия этапов фоновой переиндексации для /index_status
+INDEX_STAGE_TITLES = {
+    "queued": "в очереди",
+    "scan": "проверка файлов",
+    "load": "загрузка документов",
+    "embed": "эмбеддинги",
+    "build": "векторное хранилище",
+    "ann": "HNSW индекс",
+    "quantize": "сжатие векторов",
+    "bm25": "BM25 индекс",
+    "save": "сохранение индекса",
+    "retriever": "построение retriever",
+    "warmup": "прогрев моделей",
+    "swap": "подмена индекса",
+}
+
+# Готовность бота и компоненты прогрева для /index_status
+WARMUP_STATUS_TITLES = {
+    "pending": "ожидает прогрева",
+    "warming": "прогрев моделей",
+    "ready": "готов",
+    "degraded": "готов (часть моделей не загрузилась)",
+    "off": "прогрев отключен",
+}
+WARMUP_COMPONENT_TITLES = {
+    "embeddings": "Эмбеддинги",
+    "bm25": "BM25",
+    "cross_encoder": "Cross-encoder",
+}
+
 # Глобальный словарь для хранения историй диалогов в формате LangChain Messages
 chat_conversations: dict[int, list] = {}
 
@@ -41,7 +74,9 @@ async def cmd_help(message: Message):
         "*Доступные команды:*\n"
         "/start \\- Начать новый диалог\n"
         "/help \\- Показать эту справку\n"
-        "/index \\- Переиндексировать документы\n"
+        "/index \\- Переиндексировать измененные документы\n"
+        "/index full \\- Полная переиндексация\n"
+        "/index\\_cancel \\- Отменить переиндексацию\n"
         "/index\\_status \\- Статус и конфигурация\n"
         "/evaluate\\_dataset \\- Оценить качество RAG\n\n"
         "*🔍 Режимы Retrieval:*\n"
@@ -65,40 +100,89 @@ async def cmd_help(message: Message):
     )
     await message.answer(help_text, parse_mode="MarkdownV2")
 
+def format_index_report(report: dict) -> str:
+    """Отчет индексации: изменения по файлам и время этапов"""
+    if not report:
+        return ""
+    
+    mode = "полная" if report["mode"] == "full" else "инкрементальная"
+    lines = [f"Тип: {mode}"]
+    for key, title in [("added", "Добавлено"), ("changed", "Изменено"), ("removed", "Удалено"), ("kept", "Без изменений")]:
+        files = report.get(key) or []
+        if files:
+            lines.append(f"{title}: {len(files)} ({', '.join(files[:5])}{', ...' if len(files) > 5 else ''})")
+    lines.append(f"Чанков: +{report['chunks_added']} / -{report['chunks_removed']}, всего {report['chunks_total']}")
+    
+    timings = ", ".join(f"{stage} {seconds:.1f}с" for stage, seconds in report.get("timings", {}).items())
+    if timings:
+        lines.append(f"Время: {timings}")
+    return "\n".join(lines)
+
 @router.message(Command("index"))
 async def cmd_index(message: Message):
     logger.info(f"User {message.chat.id} requested reindexing")
-    await message.answer("Начинаю переиндексацию документов...")
     
-    try:
-        result = await indexer.reindex_all()
-        if result and result[0] is not None:
-            rag.vector_store, rag.chunks = result
-            rag.initialize_retriever()
+    # /index full - полная переиндексация, по умолчанию пересчитываются только измененные файлы
+    command_parts = (message.text or "").split(maxsplit=1)
+    full = len(command_parts) > 1 and command_parts[1].strip().lower() == "full"
+    
+    if index_jobs.is_running():
+        await message.answer(
+            "⏳ Переиндексация уже выполняется.\n"
+            "Прогресс: /index_status, отмена: /index_cancel"
+        )
+        return
+    
+    async def on_finish(job):
+        if job.status == "completed":
             stats = rag.get_vector_store_stats()
             await message.answer(
-                f"✅ Переиндексация завершена!\n"
+                f"✅ Переиндексация завершена за {job.elapsed:.1f}с!\n"
                 f"Проиндексировано документов: {stats['count']}\n"
                 f"Режим: {stats['retrieval_mode']}\n"
-                f"Провайдер: {stats['embedding_provider']}"
+                f"Провайдер: {stats['embedding_provider']}\n\n"
+                f"{format_index_report(job.report)}"
             )
+        elif job.status == "cancelled":
+            await message.answer("🛑 Переиндексация отменена, используется прежний индекс")
         else:
-            await message.answer("⚠️ Не найдено документов для индексации")
-    except Exception as e:
-        logger.error(f"Error during reindexing: {e}")
-        await message.answer(f"❌ Ошибка при переиндексации: {str(e)}")
+            await message.answer(f"❌ Ошибка при переиндексации: {job.error}")
+    
+    index_jobs.start_reindex(full=full, on_finish=on_finish)
+    await message.answer(
+        ("Начинаю полную переиндексацию документов в фоне..." if full
+         else "Начинаю переиндексацию измененных документов в фоне...")
+        + "\nБот продолжает отвечать на старом индексе. Отмена: /index_cancel"
+    )
+
+@router.message(Command("index_cancel"))
+async def cmd_index_cancel(message: Message):
+    logger.info(f"User {message.chat.id} requested reindexing cancellation")
+    if index_jobs.cancel_reindex():
+        await message.answer("Отменяю переиндексацию...")
+    elif index_jobs.is_running():
+        await message.answer("Новый индекс уже записан, отменить переиндексацию нельзя: бот переходит на него")
+    else:
+        await message.answer("Переиндексация не выполняется")
 
 @router.message(Command("index_status"))
 async def cmd_index_status(message: Message):
     logger.info(f"User {message.chat.id} requested index status")
     stats = rag.get_vector_store_stats()
     
+    job = index_jobs.current_job
+    job_text = ""
+    if job is not None and job.status == "running":
+        progress = f" {job.done}/{job.total}" if job.total else (f" {job.done}" if job.done else "")
+        stage = INDEX_STAGE_TITLES.get(job.stage, job.stage)
+        job_text = f"⏳ Переиндексация: {stage}{progress}, {job.elapsed:.0f}с\n\n"
+    
     if stats["status"] == "not initialized":
-        await message.answer("⚠️ Векторное хранилище не инициализировано")
+        await message.answer(f"{job_text}⚠️ Векторное хранилище не инициализировано")
         return
     
     # Базовая информация
-    status_text = (
+    status_text = job_text + (
         f"📊 *Статус индексации*\n"
             f"Статус: {stats['status']}\n"
         f"Документов: {stats['count']}\n\n"
@@ -112,14 +196,92 @@ async def cmd_index_status(message: Message):
         status_text += (
             f"• Semantic k: {stats.get('semantic_k', 'N/A')}\n"
             f"• BM25 k: {stats.get('bm25_k', 'N/A')}\n"
+            f"• BM25 нормализация: {stats.get('bm25_normalization', 'none')}\n"
             f"• Веса: {stats.get('semantic_weight', 0):.1f}/{stats.get('bm25_weight', 0):.1f}\n"
         )
     elif stats['retrieval_mode'] == 'hybrid_reranker':
         status_text += (
             f"• Semantic k: {stats.get('semantic_k', 'N/A')}\n"
             f"• BM25 k: {stats.get('bm25_k', 'N/A')}\n"
+            f"• BM25 нормализация: {stats.get('bm25_normalization', 'none')}\n"
             f"• Reranker top k: {stats.get('reranker_top_k', 'N/A')}\n"
-            f"• Cross-encoder: {stats.get('cross_encoder_model', 'N/A').split('/')[-1]}\n"
+            f"• Cross-encoder: {stats.get('cross_encoder_model', 'N/A').split('/')[-1]} "
+            f"({stats.get('cross_encoder_backend', 'N/A')})\n"
+        )
+        rerank_stats = stats.get('rerank')
+        if rerank_stats and rerank_stats['batches']:
+            status_text += (
+                f"• Rerank батчи: {rerank_stats['batches']}, в среднем {rerank_stats['mean_batch_pairs']:.0f} пар "
+                f"/ {rerank_stats['mean_batch_requests']:.1f} запроса\n"
+                f"• Rerank очередь: {rerank_stats['mean_queue_ms']:.0f} мс, "
+                f"модель: {rerank_stats['mean_predict_ms']:.0f} мс на батч\n"
+            )
+        depth_stats = stats.get('rerank_depth')
+        if depth_stats and depth_stats['requests']:
+            cascade = "каскад" if depth_stats['cascade'] else "все кандидаты"
+            status_text += (
+                f"• Rerank пары на запрос ({cascade}): {depth_stats['mean_depth']:.1f} из "
+                f"{depth_stats['mean_candidates']:.1f}, в модель {depth_stats['mean_scored']:.1f}\n"
+            )
+        rerank_cache_stats = stats.get('rerank_cache')
+        if rerank_cache_stats and rerank_cache_stats['enabled']:
+            status_text += (
+                f"• Кеш reranking: {rerank_cache_stats['hits']} попаданий / {rerank_cache_stats['misses']} промахов "
+                f"({rerank_cache_stats['hit_rate']:.0%})\n"
+            )
+    
+    hybrid_stats = stats.get('hybrid')
+    if hybrid_stats:
+        legs = hybrid_stats['legs']
+        status_text += (
+            f"• Время веток: semantic {legs['semantic']['mean_ms']:.0f} мс, "
+            f"BM25 {legs['bm25']['mean_ms']:.0f} мс (среднее)\n"
+            f"• Объединение: {stats.get('hybrid_fusion', 'rrf')}\n"
+            f"• Дедлайн ветки: {f'{config.HYBRID_LEG_TIMEOUT_MS} мс' if config.HYBRID_LEG_TIMEOUT_MS else 'нет'}, "
+            f"ответов без одной ветки: {hybrid_stats['fallbacks']}\n"
+        )
+    
+    chain_stats = stats.get('rag_chain')
+    if chain_stats:
+        status_text += f"• RAG-цепочка: собрана {chain_stats['builds']} раз, из кеша {chain_stats['hits']}\n"
+    
+    transform_stats = stats.get('query_transform')
+    if transform_stats:
+        status_text += (
+            f"• Трансформация запроса: {transform_stats['calls']} вызовов LLM, сэкономлено "
+            f"{transform_stats['avoided']} ({transform_stats['avoided_rate']:.0%}): "
+            f"первый вопрос {transform_stats['skipped']}, из кеша {transform_stats['memo_hits']}\n"
+        )
+    
+    answer_cache_stats = stats.get('answer_cache')
+    if answer_cache_stats and answer_cache_stats['enabled']:
+        status_text += (
+            f"• Кеш ответов: {answer_cache_stats['hits']} попаданий / {answer_cache_stats['misses']} промахов "
+            f"({answer_cache_stats['hit_rate']:.0%}), записей {answer_cache_stats['entries']}\n"
+            f"• Сэкономлено: {answer_cache_stats['saved_ms'] / 1000:.1f} с, "
+            f"поиск в кеше {answer_cache_stats['mean_lookup_ms']:.1f} мс (среднее)\n"
+        )
+    
+    status_text += f"• Векторный индекс: {stats['vector_index_backend']}\n"
+    if 'hnsw_m' in stats:
+        recall = stats.get('ann_recall')
+        status_text += (
+            f"• HNSW: M {stats['hnsw_m']}, ef construction {stats['hnsw_ef_construction']}, "
+            f"ef search {stats['hnsw_ef_search']}\n"
+            f"• Recall@{config.SEMANTIC_RETRIEVER_K}: {f'{recall:.3f}' if recall is not None else 'N/A'}\n"
+        )
+    
+    if stats.get('vector_quantization', 'none') != 'none':
+        recall = stats.get('quantization_recall')
+        rescore = f", пересчет x{stats['rescore_factor']}" if stats.get('rescore_factor', 0) > 1 else ""
+        status_text += (
+            f"• Сжатие: {stats['vector_quantization']}{rescore}, "
+            f"recall@{config.SEMANTIC_RETRIEVER_K}: {f'{recall:.3f}' if recall is not None else 'N/A'}\n"
+        )
+    if 'vector_memory_bytes' in stats:
+        status_text += (
+            f"• Память векторов: {stats['vector_memory_bytes'] / 1024 / 1024:.1f} МБ "
+            f"(float32: {stats['vector_memory_float32_bytes'] / 1024 / 1024:.1f} МБ)\n"
         )
     
     # Информация об embeddings
@@ -132,6 +294,31 @@ async def cmd_index_status(message: Message):
             f"• Устройство: {stats.get('device', 'N/A')}\n"
         )
     
+    cache_stats = stats.get('embedding_cache')
+    if cache_stats and cache_stats['enabled']:
+        status_text += (
+            f"• Кеш: {cache_stats['hits']} попаданий / {cache_stats['misses']} промахов "
+            f"({cache_stats['hit_rate']:.0%})\n"
+        )
+    
+    warmup_stats = warmup.get_warmup_stats()
+    status_text += (
+        f"\n🔥 *Готовность: {WARMUP_STATUS_TITLES.get(warmup_stats['status'], warmup_stats['status'])}*\n"
+    )
+    if warmup_stats['status'] not in ('pending', 'off'):
+        status_text += f"• Прогрев: {warmup_stats['elapsed_ms'] / 1000:.1f}с\n"
+        for name, component in warmup_stats['components'].items():
+            title = WARMUP_COMPONENT_TITLES.get(name, name)
+            if component['status'] == 'ready':
+                status_text += (
+                    f"• {title}: загрузка {component['load_ms']:.0f} мс, первый вызов {component['first_ms']:.0f} мс, "
+                    f"повторный {component['warm_ms']:.0f} мс\n"
+                )
+            elif component['status'] == 'failed':
+                status_text += f"• {title}: ошибка загрузки\n"
+            elif component['status'] in ('pending', 'loading'):
+                status_text += f"• {title}: загружается\n"
+    
     await message.answer(status_text, parse_mode="Markdown")
 
 @router.message(Command("evaluate_dataset"))
@@ -222,6 +409,38 @@ async def cmd_evaluate_dataset(message: Message):
             f"Проверьте логи для подробностей."
         )
 
+async def stream_answer(chat_id: int, messages: list, reply: StreamingReply):
+    """
+    Потоковый ответ RAG в сообщение reply
+    
+    Заглушка отправляется сразу после retrieval, текст дописывается по мере
+    генерации. В лог пишутся время retrieval, до первого токена (TTFT) и полное.
+    
+    Returns:
+        tuple: (answer, documents)
+    """
+    started = time.perf_counter()
+    retrieval_ms = first_token_ms = None
+    answer = ""
+    documents = []
+    async for chunk in rag.rag_answer_stream(messages):
+        if "documents" in chunk:
+            documents = chunk["documents"]
+            retrieval_ms = (time.perf_counter() - started) * 1000
+            await reply.start()
+        if chunk.get("answer"):
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+            answer += chunk["answer"]
+            await reply.update(answer)
+    
+    total_ms = (time.perf_counter() - started) * 1000
+    logger.info(
+        f"Streamed answer for chat {chat_id}: retrieval {retrieval_ms or 0:.0f} ms, "
+        f"TTFT {first_token_ms or 0:.0f} ms, total {total_ms:.0f} ms, {reply.edits} edits"
+    )
+    return answer, documents
+
 @router.message()
 async def handle_message(message: Message):
     # Игнорируем сообщения без текста (стикеры, фото и т.д.)
@@ -242,6 +461,15 @@ async def handle_message(message: Message):
         HumanMessage(content=message.text)
     )
     
+    # В потоковом режиме ответ (и ошибка) пишутся в одно сообщение, которое дописывается
+    reply = StreamingReply(message, config.STREAM_EDIT_INTERVAL_MS / 1000) if config.STREAM_ANSWERS else None
+    
+    async def send(text: str):
+        if reply is not None:
+            await reply.fail(text)
+        else:
+            await message.answer(text)
+    
     try:
         # Проверка инициализации векторного хранилища
         if rag.vector_store is None or rag.retriever is None:
@@ -255,10 +483,13 @@ async def handle_message(message: Message):
             return
         
         # Получаем ответ через RAG (передаем историю без system message)
-        # Теперь возвращает dict с answer и documents
-        result = await rag.rag_answer(chat_conversations[message.chat.id][1:])
-        answer = result["answer"]
-        documents = result["documents"]
+        if reply is not None:
+            answer, documents = await stream_answer(message.chat.id, chat_conversations[message.chat.id][1:], reply)
+        else:
+            # Возвращает dict с answer и documents
+            result = await rag.rag_answer(chat_conversations[message.chat.id][1:])
+            answer = result["answer"]
+            documents = result["documents"]
         
         # Добавляем ответ в историю
         chat_conversations[message.chat.id].append(
@@ -272,13 +503,16 @@ async def handle_message(message: Message):
             if sources:
                 final_response = f"{answer}\n\n{sources}"
         
-        await message.answer(final_response)
+        if reply is not None:
+            await reply.finish(final_response)
+        else:
+            await message.answer(final_response)
         
     except ValueError as e:
         logger.error(f"ValueError in handle_message for chat {message.chat.id}: {e}")
         # Удаляем последнее сообщение из истории
         chat_conversations[message.chat.id].pop()
-        await message.answer(
+        await send(
             "⚠️ Векторное хранилище не готово. "
             "Используйте /index для индексации документов."
         )
@@ -286,8 +520,7 @@ async def handle_message(message: Message):
         logger.error(f"Error in handle_message for chat {message.chat.id}: {e}", exc_info=True)
         # Удаляем последнее сообщение из истории
         chat_conversations[message.chat.id].pop()
-        await message.answer(
+        await send(
             "Произошла ошибка при обработке вашего сообщения. "
             "Попробуйте еще раз или используйте /start для начала нового диалога."
         )
-
@@ -0,0 +1,254 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Any, List
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, Field, PrivateAttr
+from bm25_index import BM25IndexRetriever
+
+logger = logging.getLogger(__name__)
+
+# Названия веток в порядке weights
+LEG_NAMES = ("semantic", "bm25")
+
+# Потоки для веток: sync запросы (evaluation) и CPU-bound BM25 в async режиме.
+# Ветка, не уложившаяся в дедлайн, дорабатывает в своем потоке, ее результат отбрасывается
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-leg")
+
+_stats = {
+    name: {"count": 0, "total_ms": 0.0, "last_ms": 0.0, "timeouts": 0, "errors": 0}
+    for name in LEG_NAMES
+}
+_stats_fallbacks = {"count": 0}
+
+def _record_leg(name: str, elapsed_ms: float, error: BaseException = None):
+    leg = _stats[name]
+    leg["count"] += 1
+    leg["total_ms"] += elapsed_ms
+    leg["last_ms"] = elapsed_ms
+    if error is not None:
+        leg["errors"] += 1
+
+def _merge(id_lists: list, contributions: list):
+    """
+    Суммирование вкладов веток по chunk_id
+
+    Returns:
+        tuple: (ids, scores) по убыванию оценки; при равных оценках - в порядке
+            первого появления (semantic, затем BM25), как у EnsembleRetriever
+    """
+    ids = np.concatenate(id_lists)
+    if len(ids) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    unique_ids, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(contributions), minlength=len(unique_ids))
+    order = np.lexsort((first, -scores))
+    return unique_ids[order], scores[order]
+
+def weighted_rrf(id_lists: list, weights: list, c: int = 60):
+    """Weighted Reciprocal Rank Fusion: сумма weight / (rank + c) по веткам"""
+    contributions = [
+        np.full(len(ids), weight) / (np.arange(1, len(ids) + 1) + c)
+        for ids, weight in zip(id_lists, weights)
+    ]
+    return _merge(id_lists, contributions)
+
+def weighted_score_fusion(id_lists: list, score_lists: list, weights: list):
+    """
+    Взвешенная сумма нормализованных оценок
+
+    Оценки каждой ветки (косинусная близость, BM25) приводятся min-max к [0, 1],
+    документ, не найденный веткой, получает от нее 0.
+    """
+    contributions = []
+    for scores, weight in zip(score_lists, weights):
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) == 0:
+            contributions.append(scores)
+            continue
+        spread = scores.max() - scores.min()
+        normalized = (scores - scores.min()) / spread if spread > 0 else np.ones(len(scores))
+        contributions.append(weight * normalized)
+    return _merge(id_lists, contributions)
+
+class _LegResult:
+    """Результат ветки: chunk_id и оценки (по убыванию) или исключение, время выполнения"""
+
+    def __init__(self, name: str, ids: np.ndarray = None, scores: np.ndarray = None,
+                 error: BaseException = None, elapsed_ms: float = 0.0):
+        self.name = name
+        self.ids = ids
+        self.scores = scores
+        self.error = error
+        self.elapsed_ms = elapsed_ms
+
+def _timed_leg(name: str, run, *args) -> _LegResult:
+    started = time.perf_counter()
+    try:
+        ids, scores = run(*args)
+        result = _LegResult(name, ids=ids, scores=scores)
+    except Exception as e:
+        result = _LegResult(name, error=e)
+    result.elapsed_ms = (time.perf_counter() - started) * 1000
+    _record_leg(name, result.elapsed_ms, result.error)
+    return result
+
+async def _atimed_leg(name: str, run, *args) -> _LegResult:
+    started = time.perf_counter()
+    try:
+        ids, scores = await run(*args)
+        result = _LegResult(name, ids=ids, scores=scores)
+    except Exception as e:
+        result = _LegResult(name, error=e)
+    result.elapsed_ms = (time.perf_counter() - started) * 1000
+    _record_leg(name, result.elapsed_ms, result.error)
+    return result
+
+class ConcurrentHybridRetriever(BaseRetriever):
+    """
+    Hybrid retriever (Semantic + BM25), ветки которого выполняются одновременно
+
+    Semantic ветка в async режиме ждет эмбеддинг запроса через aembed_query,
+    поиск по векторам и CPU-bound BM25 считаются в потоках _executor; в sync
+    режиме обе ветки целиком идут в потоках. Если ветка не уложилась в leg_timeout (или упала), возвращаются
+    результаты другой ветки. Если не уложились обе, ждем первую завершившуюся.
+
+    Ветки возвращают массивы chunk_id и оценок (без Document), объединение
+    (weighted RRF или взвешенная сумма нормализованных оценок) идет на массивах
+    по chunk_id, Document строятся только для итогового top_k. Оценка объединения
+    возвращается в metadata["fusion_score"] (для каскадного reranking).
+    """
+
+    vector_store: Any = Field(repr=False)  # NumpyVectorStore, ids - str(chunk_id)
+    bm25: BM25IndexRetriever = Field(repr=False)
+    semantic_k: int = 4
+    weights: List[float] = [0.5, 0.5]
+    fusion: str = "rrf"  # rrf/score
+    c: int = 60  # Константа RRF
+    top_k: int = 0  # Сколько документов вернуть, 0 - все найденные ветками
+    leg_timeout: float = 0.0  # Дедлайн ветки в секундах, 0 - без дедлайна
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    _lookup: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def _get_lookup(self) -> dict:
+        """Отображения позиций веток в chunk_id и chunk_id в позицию корпуса (строятся один раз)"""
+        if self._lookup is None:
+            with self._lock:
+                if self._lookup is None:
+                    corpus_ids = np.array([doc.metadata["chunk_id"] for doc in self.bm25.docs], dtype=np.int64)
+                    order = np.argsort(corpus_ids, kind="stable")
+                    self._lookup = {
+                        "semantic": np.array([int(doc_id) for doc_id in self.vector_store.ids], dtype=np.int64),
+                        "bm25": corpus_ids,
+                        "sorted_ids": corpus_ids[order],
+                        "sorted_positions": order,
+                    }
+        return self._lookup
+
+    def _semantic_search(self, embedding: list):
+        positions, scores = self.vector_store.search_positions(embedding, self.semantic_k)
+        return self._get_lookup()["semantic"][positions], scores
+
+    def _semantic_leg(self, query: str):
+        return self._semantic_search(self.vector_store.embeddings.embed_query(query))
+
+    async def _asemantic_leg(self, query: str):
+        embedding = await self.vector_store.embeddings.aembed_query(query)
+        # Поиск по матрице (или HNSW) - CPU-bound, не выполняем его в event loop
+        return await asyncio.get_running_loop().run_in_executor(_executor, self._semantic_search, embedding)
+
+    def _bm25_leg(self, query: str):
+        index = self.bm25.index
+        positions, scores = index.search(index.tokenize(query), self.bm25.k)
+        return self._get_lookup()["bm25"][positions], scores
+
+    def _fuse(self, results: list) -> List[Document]:
+        """Объединение веток, уложившихся в дедлайн (вместо остальных - пустые массивы)"""
+        by_name = {result.name: result for result in results if result.error is None}
+        if not by_name:
+            errors = [result.error for result in results if result.error is not None]
+            raise errors[0] if errors else TimeoutError("Hybrid retrieval: no leg finished")
+        finished = {result.name for result in results}
+        if len(by_name) < len(LEG_NAMES):
+            _stats_fallbacks["count"] += 1
+            for result in results:
+                if result.error is not None:
+                    logger.warning(f"Hybrid retrieval: {result.name} leg failed ({result.error}), using the other leg")
+            for name in LEG_NAMES:
+                if name not in finished:
+                    _stats[name]["timeouts"] += 1
+                    logger.warning(f"Hybrid retrieval: {name} leg exceeded {self.leg_timeout:.2f}s, using the other leg")
+        logger.info(
+            "Hybrid retrieval legs: "
+            + ", ".join(f"{result.name} {result.elapsed_ms:.0f} ms" for result in results)
+        )
+
+        empty = _LegResult("", ids=np.zeros(0, dtype=np.int64), scores=np.zeros(0))
+        legs = [by_name.get(name, empty) for name in LEG_NAMES]
+        if self.fusion == "score":
+            ids, scores = weighted_score_fusion([leg.ids for leg in legs], [leg.scores for leg in legs], self.weights)
+        else:
+            ids, scores = weighted_rrf([leg.ids for leg in legs], self.weights, self.c)
+        if self.top_k > 0:
+            ids, scores = ids[:self.top_k], scores[:self.top_k]
+
+        lookup = self._get_lookup()
+        positions = lookup["sorted_positions"][np.searchsorted(lookup["sorted_ids"], ids)]
+        # Копии с оценкой объединения (документы корпуса общие для всех запросов и не меняются)
+        return [
+            Document(
+                page_content=self.bm25.docs[position].page_content,
+                metadata={**self.bm25.docs[position].metadata, "fusion_score": float(score)},
+            )
+            for position, score in zip(positions, scores)
+        ]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        futures = [
+            _executor.submit(_timed_leg, "semantic", self._semantic_leg, query),
+            _executor.submit(_timed_leg, "bm25", self._bm25_leg, query),
+        ]
+        done, pending = concurrent.futures.wait(futures, timeout=self.leg_timeout or None)
+        while pending and not any(future.result().error is None for future in done):
+            finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            done |= finished
+        return self._fuse([future.result() for future in futures if future in done])
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        loop = asyncio.get_running_loop()
+        tasks = [
+            asyncio.ensure_future(_atimed_leg("semantic", self._asemantic_leg, query)),
+            asyncio.ensure_future(_atimed_leg(
+                "bm25", lambda q: loop.run_in_executor(_executor, self._bm25_leg, q), query
+            )),
+        ]
+        done, pending = await asyncio.wait(tasks, timeout=self.leg_timeout or None)
+        while pending and not any(task.result().error is None for task in done):
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            done |= finished
+        for task in pending:
+            task.cancel()
+        return self._fuse([task.result() for task in tasks if task in done])
+
+def get_hybrid_stats() -> dict:
+    """Время веток hybrid retrieval для /index_status"""
+    legs = {}
+    for name, leg in _stats.items():
+        legs[name] = {
+            "count": leg["count"],
+            "mean_ms": leg["total_ms"] / leg["count"] if leg["count"] else 0.0,
+            "last_ms": leg["last_ms"],
+            "timeouts": leg["timeouts"],
+            "errors": leg["errors"],
+        }
+    return {"legs": legs, "fallbacks": _stats_fallbacks["count"]}
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import threading
+import time
+from config import config
+import indexer
+import rag
+import warmup
+
+logger = logging.getLogger(__name__)
+
+class ReindexJob:
+    """
+    Фоновая задача переиндексации
+
+    Парсинг, эмбеддинги и построение retriever выполняются в отдельном потоке,
+    event loop бота продолжает обслуживать сообщения. Прогресс обновляется
+    из потока через set_stage(), там же проверяется запрос на отмену.
+    Отменить можно только до записи нового индекса на диск (mark_committed):
+    иначе бот остался бы на старом индексе, а после перезапуска молча
+    перешел бы на новый.
+    """
+
+    def __init__(self, full: bool):
+        self.full = full
+        self.status = "running"  # running/completed/failed/cancelled
+        self.stage = "queued"
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.report = None
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.task = None
+        self.committed = False
+        self._cancel_event = threading.Event()
+
+    def set_stage(self, stage: str, done: int = 0, total: int = 0):
+        """Обновление прогресса (вызывается из потока индексации)"""
+        if self._cancel_event.is_set() and not self.committed:
+            raise indexer.IndexingCancelled()
+        self.stage = stage
+        self.done = done
+        self.total = total
+
+    def mark_committed(self):
+        """Новый индекс записан на диск: дальше задача доводится до подмены"""
+        self.committed = True
+
+    def cancel(self):
+        """Запрос отмены: индексация остановится на ближайшей контрольной точке"""
+        self._cancel_event.set()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+# Текущая (или последняя завершенная) задача
+current_job = None
+
+def is_running() -> bool:
+    return current_job is not None and current_job.status == "running"
+
+def start_reindex(full: bool = False, on_finish=None) -> ReindexJob:
+    """
+    Запуск переиндексации в фоне
+
+    Args:
+        full: полная переиндексация вместо инкрементальной
+        on_finish: async callback(job), вызывается после завершения задачи
+
+    Raises:
+        RuntimeError: если переиндексация уже идет
+    """
+    global current_job
+    if is_running():
+        raise RuntimeError("Reindexing is already running")
+
+    job = ReindexJob(full)
+    job.task = asyncio.create_task(_run_job(job, on_finish))
+    current_job = job
+    logger.info(f"Background {'full' if full else 'incremental'} reindexing started")
+    return job
+
+def cancel_reindex() -> bool:
+    """Отмена текущей переиндексации (False если отменять нечего или поздно)"""
+    if not is_running() or current_job.committed:
+        return False
+    current_job.cancel()
+    logger.info("Reindexing cancellation requested")
+    return True
+
+async def _run_job(job: ReindexJob, on_finish):
+    try:
+        if job.full:
+            result = await indexer.reindex_all(job)
+        else:
+            result = await indexer.update_index(job)
+
+        if result and result[0] is not None:
+            new_vector_store, new_chunks = result
+            # Retriever (включая BM25) строится до подмены, тоже вне event loop
+            job.set_stage("retriever")
+            started = time.perf_counter()
+            new_retriever = await asyncio.to_thread(rag.create_retriever, new_vector_store, new_chunks)
+            if config.WARMUP_MODE != "off":
+                # Новые эмбеддинги и BM25 загружаются до подмены, а не на первом запросе
+                job.set_stage("warmup")
+                await asyncio.to_thread(warmup.warm_index, new_vector_store, new_retriever)
+            job.set_stage("swap")
+
+            job.report = dict(indexer.last_report or {})
+            job.report["timings"] = dict(job.report.get("timings", {}), retriever=time.perf_counter() - started)
+
+            rag.swap_index(new_vector_store, new_chunks, new_retriever)
+            job.status = "completed"
+        else:
+            job.status = "failed"
+            job.error = "Не найдено документов для индексации"
+    except indexer.IndexingCancelled:
+        job.status = "cancelled"
+        logger.info("Background reindexing cancelled, keeping the current index")
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        logger.error(f"Background reindexing failed: {e}", exc_info=True)
+    finally:
+        job.finished_at = time.perf_counter()
+
+    logger.info(f"Background reindexing finished: {job.status} in {job.elapsed:.1f}s")
+    if on_finish is not None:
+        try:
+            await on_finish(job)
+        except Exception as e:
+            logger.error(f"Error in reindexing callback: {e}", exc_info=True)
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+from langchain_core.documents import Document
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Версия формата артефакта: при несовместимых изменениях индекс пересобирается
+INDEX_FORMAT_VERSION = 2
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+# Поля манифеста, от которых зависит содержимое индекса
+MANIFEST_MATCH_KEYS = [
+    "format_version",
+    "embedding_provider",
+    "embedding_model",
+    "chunk_size",
+    "chunk_overlap",
+    "corpus_hash",
+]
+
+# Настройки, при совпадении которых возможна инкрементальная переиндексация
+SETTINGS_MATCH_KEYS = [key for key in MANIFEST_MATCH_KEYS if key != "corpus_hash"]
+
+def get_embedding_model_name() -> str:
+    """Имя embedding модели для текущего провайдера"""
+    if config.EMBEDDING_PROVIDER == "huggingface":
+        return config.HUGGINGFACE_EMBEDDING_MODEL
+    return config.EMBEDDING_MODEL
+
+def hash_file(path: Path) -> str:
+    """SHA-256 содержимого файла (читается блоками)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def compute_file_states(files: list, previous: dict = None) -> dict:
+    """
+    Состояние файлов корпуса: размер, mtime и SHA-256
+
+    Если размер и mtime совпадают с предыдущим состоянием, хеш берется из него,
+    и файл не перечитывается.
+
+    Args:
+        files: список путей к индексируемым файлам
+        previous: состояния из манифеста предыдущего индекса (name -> state)
+
+    Returns:
+        dict: имя файла -> {"size", "mtime", "sha256"}
+    """
+    previous = previous or {}
+    states = {}
+    for path in files:
+        stat = path.stat()
+        prev = previous.get(path.name)
+        if prev and prev.get("size") == stat.st_size and prev.get("mtime") == stat.st_mtime:
+            sha256 = prev["sha256"]
+        else:
+            sha256 = hash_file(path)
+        states[path.name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+    return states
+
+def compute_corpus_hash(file_states: dict) -> str:
+    """Хеш корпуса: имена и содержимое всех индексируемых файлов"""
+    digest = hashlib.sha256()
+    for name in sorted(file_states):
+        digest.update(name.encode("utf-8"))
+        digest.update(file_states[name]["sha256"].encode("ascii"))
+    return digest.hexdigest()
+
+def build_manifest(file_states: dict, count: int = 0, dim: int = 0) -> dict:
+    """Манифест индекса для текущей конфигурации"""
+    return {
+        "format_version": INDEX_FORMAT_VERSION,
+        "embedding_provider": config.EMBEDDING_PROVIDER,
+        "embedding_model": get_embedding_model_name(),
+        "chunk_size": config.CHUNK_SIZE,
+        "chunk_overlap": config.CHUNK_OVERLAP,
+        "corpus_hash": compute_corpus_hash(file_states),
+        "files": file_states,
+        "count": count,
+        "dim": dim,
+        "dtype": "float32",
+        "normalized": True,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+def manifest_matches(manifest: dict, expected: dict, keys: list = None) -> bool:
+    """Проверка, что сохраненный индекс построен с теми же настройками и по тому же корпусу"""
+    keys = keys or MANIFEST_MATCH_KEYS
+    mismatched = [key for key in keys if manifest.get(key) != expected.get(key)]
+    if mismatched:
+        logger.info(f"Index manifest mismatch: {', '.join(mismatched)}")
+        return False
+    return True
+
+def load_manifest(index_dir: str):
+    """Чтение манифеста (None если индекса нет или он поврежден)"""
+    manifest_path = Path(index_dir) / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    try:
+        return json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Cannot read index manifest {manifest_path}: {e}")
+        return None
+
+# Сырые векторы во время потоковой записи (в embeddings.npy переносятся при commit)
+RAW_VECTORS_FILE = "embeddings.f32"
+
+class IndexWriter:
+    """
+    Потоковая запись индекса
+
+    Чанки и векторы дописываются во временную директорию по мере готовности
+    (в памяти не накапливаются), commit() формирует embeddings.npy, пишет
+    манифест и подменяет директорию индекса целиком, поэтому при сбое на диске
+    остается предыдущий целый индекс.
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_path = Path(index_dir)
+        self.tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        self.tmp_path.mkdir(parents=True)
+        self.count = 0
+        self.dim = 0
+        self._chunks_file = open(self.tmp_path / CHUNKS_FILE, "w", encoding="utf-8")
+        self._vectors_file = open(self.tmp_path / RAW_VECTORS_FILE, "wb")
+
+    def add(self, chunks: list, vectors: np.ndarray):
+        """Дописать чанки (metadata содержит chunk_id) и их нормализованные векторы"""
+        if len(chunks) != len(vectors):
+            raise ValueError(f"Chunks/vectors size mismatch: {len(chunks)} != {len(vectors)}")
+        if len(chunks) == 0:
+            return
+        if self.dim and vectors.shape[1] != self.dim:
+            raise ValueError(f"Vector dimension mismatch: {vectors.shape[1]} != {self.dim}")
+        self.dim = int(vectors.shape[1])
+        for chunk in chunks:
+            record = {"page_content": chunk.page_content, "metadata": chunk.metadata}
+            self._chunks_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self.count += len(chunks)
+
+    def commit(self, manifest: dict):
+        """Завершение записи и подмена директории индекса"""
+        self._chunks_file.close()
+        self._vectors_file.close()
+
+        raw_path = self.tmp_path / RAW_VECTORS_FILE
+        raw = np.memmap(raw_path, dtype=np.float32, mode="r", shape=(self.count, self.dim)) if self.count else None
+        vectors = np.lib.format.open_memmap(
+            self.tmp_path / EMBEDDINGS_FILE, mode="w+", dtype=np.float32, shape=(self.count, self.dim)
+        )
+        block = max(1, (16 * 1024 * 1024) // (max(self.dim, 1) * 4))
+        for start in range(0, self.count, block):
+            vectors[start:start + block] = raw[start:start + block]
+        vectors.flush()
+        del vectors, raw
+        raw_path.unlink()
+
+        manifest = dict(manifest, count=self.count, dim=self.dim)
+        (self.tmp_path / MANIFEST_FILE).write_text(
+            json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+
+        # Подмена директорий: старый индекс удаляется только после появления нового
+        old_path = self.index_path.with_name(self.index_path.name + ".old")
+        shutil.rmtree(old_path, ignore_errors=True)
+        if self.index_path.exists():
+            os.replace(self.index_path, old_path)
+        os.replace(self.tmp_path, self.index_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        logger.info(f"Index saved to {self.index_path} ({self.count} chunks)")
+
+    def abort(self):
+        """Отмена записи: временная директория удаляется, текущий индекс не меняется"""
+        self._chunks_file.close()
+        self._vectors_file.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+def save_index(index_dir: str, chunks: list, vectors: np.ndarray, manifest: dict):
+    """
+    Сохранение индекса на диск
+
+    Args:
+        index_dir: директория индекса
+        chunks: список Document (metadata содержит chunk_id)
+        vectors: L2-нормализованная матрица эмбеддингов float32 (len(chunks) x dim)
+        manifest: манифест из build_manifest()
+    """
+    if len(chunks) != len(vectors):
+        raise ValueError(f"Chunks/vectors size mismatch: {len(chunks)} != {len(vectors)}")
+
+    writer = IndexWriter(index_dir)
+    try:
+        writer.add(chunks, vectors)
+        writer.commit(manifest)
+    except BaseException:
+        writer.abort()
+        raise
+
+def load_vectors(index_dir: str):
+    """Memory-map матрицы эмбеддингов сохраненного индекса (None если ее нет)"""
+    try:
+        return np.load(Path(index_dir) / EMBEDDINGS_FILE, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Cannot open saved embeddings in {index_dir}: {e}")
+        return None
+
+def load_index(index_dir: str):
+    """
+    Загрузка индекса с диска
+
+    Матрица эмбеддингов открывается через memory-map, поэтому загрузка
+    не зависит от размера индекса - данные подгружаются с диска по мере доступа.
+
+    Returns:
+        tuple: (chunks, vectors, manifest) или None если индекса нет
+    """
+    index_path = Path(index_dir)
+    manifest = load_manifest(index_dir)
+    if manifest is None:
+        return None
+
+    try:
+        vectors = np.load(index_path / EMBEDDINGS_FILE, mmap_mode="r")
+        chunks = []
+        with open(index_path / CHUNKS_FILE, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                chunks.append(Document(page_content=record["page_content"], metadata=record["metadata"]))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Cannot load index from {index_path}: {e}")
+        return None
+
+    if len(chunks) != len(vectors) or len(chunks) != manifest.get("count"):
+        logger.warning(f"Index at {index_path} is inconsistent, ignoring it")
+        return None
+
+    return chunks, vectors, manifest
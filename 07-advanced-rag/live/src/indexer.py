@@ -1,38 +1,120 @@
+import asyncio
 import logging
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
+import pypdf
+from langchain_core.documents import Document
 from langchain_community.document_loaders import PyPDFLoader, JSONLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import InMemoryVectorStore
 from config import config
+import index_store
+from embedding_cache import CachedEmbeddings, QueryMemoEmbeddings
+from batched_embeddings import create_batched_openai_embeddings
+from numpy_vector_store import NumpyVectorStore, normalize_rows
+from ingest_pipeline import IngestPipeline
+from pdf_pages import extract_pdf_pages
+from ann_index import HnswIndex, measure_recall
+from quantization import Quantizer, create_quantizer, measure_quantization_recall
+from bm25_index import BM25Index
 
 logger = logging.getLogger(__name__)
 
+JSON_FILE_NAME = "sberbank_help_documents.json"
+
+# Отчет последней индексации (что добавлено/удалено/сохранено и время этапов)
+last_report = None
+
+# Сколько чанков эмбеддится за один вызов модели: между вызовами
+# обновляется прогресс и проверяется отмена индексации
+EMBED_SLICE_SIZE = 1024
+
+class IndexingCancelled(Exception):
+    """Индексация отменена пользователем"""
+
+def _set_stage(progress, stage: str, done: int = 0, total: int = 0):
+    """Передача прогресса фоновой задаче (progress.set_stage может бросить IndexingCancelled)"""
+    if progress is not None:
+        progress.set_stage(stage, done, total)
+
+def _set_committed(progress):
+    """Новый индекс записан на диск: после этого отмена уже не применяется"""
+    if progress is not None:
+        progress.mark_committed()
+
 def load_pdf_documents(data_dir: str) -> list:
     """Загрузка всех PDF документов из директории"""
-    pages = []
     data_path = Path(data_dir)
     
     if not data_path.exists():
         logger.warning(f"Directory {data_dir} does not exist")
-        return pages
+        return []
     
     pdf_files = list(data_path.glob("*.pdf"))
     logger.info(f"Found {len(pdf_files)} PDF files in {data_dir}")
     
+    return load_pdf_files(pdf_files)
+
+def load_pdf_files(pdf_files: list) -> list:
+    """Загрузка страниц PDF файлов (последовательно или в пуле процессов)"""
+    return list(iter_pdf_pages(pdf_files))
+
+def iter_pdf_pages(pdf_files: list):
+    """Генератор страниц PDF файлов: страницы не накапливаются в памяти"""
+    if config.PDF_INGEST_WORKERS > 1 and pdf_files:
+        yield from iter_pdf_pages_parallel(pdf_files, config.PDF_INGEST_WORKERS)
+        return
+    
     for pdf_file in pdf_files:
         loader = PyPDFLoader(str(pdf_file))
-        pages.extend(loader.load())
+        yield from loader.lazy_load()
         logger.info(f"Loaded {pdf_file.name}")
+
+def iter_pdf_pages_parallel(pdf_files: list, workers: int):
+    """
+    Параллельная загрузка PDF в пуле процессов
+    
+    Задачи нарезаются по файлам и по диапазонам страниц (PDF_PAGES_PER_TASK),
+    поэтому большие файлы тоже разбираются на нескольких ядрах. Страницы
+    выдаются в исходном порядке, метаданные совпадают с PyPDFLoader. В работе
+    не больше 2 * workers задач, чтобы готовые страницы не копились в памяти.
+    
+    Воркеры запускаются через spawn: пул создается из потока конвейера или фоновой
+    переиндексации в процессе, где уже работают потоки эмбеддингов и reranking,
+    а fork многопоточного процесса может зависнуть на унаследованной блокировке.
+    """
+    tasks = []
+    for pdf_file in pdf_files:
+        page_count = len(pypdf.PdfReader(str(pdf_file)).pages)
+        for start in range(0, page_count, config.PDF_PAGES_PER_TASK):
+            tasks.append((str(pdf_file), start, min(start + config.PDF_PAGES_PER_TASK, page_count), page_count))
+    
+    logger.info(f"Parsing {len(pdf_files)} PDF files as {len(tasks)} tasks on {workers} workers")
     
-    return pages
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = deque()
+        next_task = 0
+        while pending or next_task < len(tasks):
+            while next_task < len(tasks) and len(pending) < 2 * workers:
+                path, start, end, _ = tasks[next_task]
+                pending.append((tasks[next_task], pool.submit(extract_pdf_pages, path, start, end)))
+                next_task += 1
+            (path, start, end, page_count), future = pending.popleft()
+            for page_number, text in enumerate(future.result(), start=start):
+                yield Document(page_content=text, metadata={"source": path, "page": page_number})
+            if end == page_count:
+                logger.info(f"Loaded {Path(path).name}")
 
 def split_documents(pages: list) -> list:
     """Разбиение документов на чанки"""
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50
+        chunk_size=config.CHUNK_SIZE,
+        chunk_overlap=config.CHUNK_OVERLAP
     )
     chunks = text_splitter.split_documents(pages)
     logger.info(f"Split into {len(chunks)} chunks")
@@ -62,16 +144,25 @@ def create_embeddings():
     """
     Фабрика для создания embeddings по провайдеру из конфига
     Поддерживает: openai, huggingface
+    
+    При EMBEDDING_CACHE_ENABLED эмбеддинги документов кешируются на диске,
+    и переиндексация платит только за новые и измененные чанки. Последние
+    эмбеддинги запросов запоминаются в памяти при любых настройках кеша.
+    Время создания модели сохраняется в load_ms для отчета прогрева.
     """
     provider = config.EMBEDDING_PROVIDER.lower()
+    started = time.perf_counter()
     
     if provider == "openai":
         logger.info(f"Creating OpenAI embeddings: {config.EMBEDDING_MODEL}")
-        return OpenAIEmbeddings(model=config.EMBEDDING_MODEL)
+        if config.EMBEDDING_BATCHING_ENABLED:
+            embeddings = create_batched_openai_embeddings(config.EMBEDDING_MODEL)
+        else:
+            embeddings = OpenAIEmbeddings(model=config.EMBEDDING_MODEL)
     
     elif provider == "huggingface":
         logger.info(f"Creating HuggingFace embeddings: {config.HUGGINGFACE_EMBEDDING_MODEL} on {config.HUGGINGFACE_DEVICE}")
-        return HuggingFaceEmbeddings(
+        embeddings = HuggingFaceEmbeddings(
             model_name=config.HUGGINGFACE_EMBEDDING_MODEL,
             model_kwargs={'device': config.HUGGINGFACE_DEVICE},
             encode_kwargs={'normalize_embeddings': True}
@@ -79,55 +170,549 @@ def create_embeddings():
     
     else:
         raise ValueError(f"Unknown embedding provider: {provider}. Use 'openai' or 'huggingface'")
+    load_ms = (time.perf_counter() - started) * 1000
+    
+    embeddings = QueryMemoEmbeddings(embeddings)
+    if config.EMBEDDING_CACHE_ENABLED:
+        embeddings = CachedEmbeddings(
+            embeddings,
+            provider=provider,
+            model=index_store.get_embedding_model_name(),
+            path=config.EMBEDDING_CACHE_PATH,
+            max_bytes=config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        )
+    embeddings.load_ms = load_ms
+    return embeddings
+
+def get_corpus_files(data_dir: str) -> list:
+    """
+    Список индексируемых файлов: все PDF + JSON с Q&A парами
+    
+    PDF сортируются по имени (порядок glob зависит от файловой системы):
+    порядок чанков и chunk_id не меняются от сборки к сборке.
+    """
+    data_path = Path(data_dir)
+    if not data_path.exists():
+        return []
+    files = sorted(data_path.glob("*.pdf"))
+    json_file = data_path / JSON_FILE_NAME
+    if json_file.exists():
+        files.append(json_file)
+    return files
+
+def embed_chunks(chunks: list, embeddings, progress=None) -> np.ndarray:
+    """Вычисление эмбеддингов чанков в L2-нормализованную матрицу float32"""
+    texts = [chunk.page_content for chunk in chunks]
+    parts = []
+    for start in range(0, len(texts), EMBED_SLICE_SIZE):
+        _set_stage(progress, "embed", start, len(texts))
+        parts.append(normalize_rows(embeddings.embed_documents(texts[start:start + EMBED_SLICE_SIZE])))
+    _set_stage(progress, "embed", len(texts), len(texts))
+    vectors = np.vstack(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+    if isinstance(embeddings, CachedEmbeddings):
+        logger.info(f"Embedded {len(texts)} chunks (cache hits: {embeddings.hits}, misses: {embeddings.misses})")
+    else:
+        logger.info(f"Embedded {len(texts)} chunks")
+    return vectors
+
+def build_vector_store(chunks: list, vectors: np.ndarray, embeddings=None):
+    """Создание векторного хранилища из готовых нормализованных эмбеддингов (без обращения к модели)"""
+    if embeddings is None:
+        embeddings = create_embeddings()
+    return NumpyVectorStore.from_vectors(
+        chunks,
+        vectors,
+        embeddings,
+        ids=[str(chunk.metadata["chunk_id"]) for chunk in chunks],
+        normalized=True
+    )
+
+def attach_ann_index(vector_store, vectors: np.ndarray, ann=None, progress=None):
+    """Подключение HNSW индекса к хранилищу (при VECTOR_INDEX_BACKEND=hnsw)
+    
+    Args:
+        vector_store: NumpyVectorStore, метки индекса - chunk_id его документов
+        vectors: нормализованная матрица эмбеддингов хранилища
+        ann: готовый индекс (загруженный или обновленный), иначе строится заново
+    
+    Returns:
+        HnswIndex или None для точного поиска
+    """
+    if config.VECTOR_INDEX_BACKEND != "hnsw" or len(vectors) == 0:
+        return None
+    
+    _set_stage(progress, "ann")
+    if ann is None:
+        started = time.perf_counter()
+        ann = HnswIndex.from_config(vectors.shape[1])
+        ann.add(vectors, np.array([int(doc_id) for doc_id in vector_store.ids], dtype=np.int64))
+        logger.info(f"Built HNSW index over {len(ann)} vectors in {time.perf_counter() - started:.1f}s")
+    
+    # Recall сохраняется вместе с графом: после загрузки без изменений не пересчитывается
+    if config.ANN_RECALL_SAMPLE > 0 and ann.recall is None:
+        ann.recall = measure_recall(vectors, ann, k=config.SEMANTIC_RETRIEVER_K, num_queries=config.ANN_RECALL_SAMPLE)
+        logger.info(f"HNSW recall@{config.SEMANTIC_RETRIEVER_K} vs exact search: {ann.recall:.3f}")
+    
+    vector_store.attach_ann_index(ann)
+    return ann
+
+def attach_quantizer(vector_store, vectors: np.ndarray, quantizer=None, progress=None):
+    """Сжатие эмбеддингов хранилища (при VECTOR_QUANTIZATION != none)
+    
+    Args:
+        vector_store: NumpyVectorStore
+        vectors: нормализованная матрица эмбеддингов хранилища
+        quantizer: готовые коды (загруженные или обновленные), иначе кодируются заново
+    
+    Returns:
+        Quantizer или None без сжатия
+    """
+    if config.VECTOR_QUANTIZATION == "none" or len(vectors) == 0:
+        return None
+    
+    _set_stage(progress, "quantize")
+    if quantizer is None:
+        started = time.perf_counter()
+        quantizer = create_quantizer(vectors.shape[1]).fit(vectors)
+        quantizer.add(vectors)
+        logger.info(f"Encoded {len(quantizer)} vectors as {quantizer.mode} in {time.perf_counter() - started:.1f}s")
+    
+    # Recall сохраняется вместе с кодами: после загрузки без изменений не пересчитывается
+    if config.ANN_RECALL_SAMPLE > 0 and quantizer.recall is None:
+        quantizer.recall = measure_quantization_recall(
+            vectors, quantizer, k=config.SEMANTIC_RETRIEVER_K,
+            num_queries=config.ANN_RECALL_SAMPLE, rescore_factor=config.VECTOR_RESCORE_FACTOR
+        )
+        logger.info(f"{quantizer.mode} recall@{config.SEMANTIC_RETRIEVER_K} vs exact search: {quantizer.recall:.3f}")
+    
+    vector_store.attach_quantizer(quantizer, config.VECTOR_RESCORE_FACTOR)
+    return quantizer
+
+def build_bm25_index(chunks: list, corpus_hash: str, progress=None):
+    """Построение BM25 статистик при индексации и сохранение рядом с индексом
+    
+    Hybrid retriever загружает их лениво (BM25IndexRetriever) и не токенизирует
+    корпус в процессе бота. Уже сохраненный для этого корпуса индекс не перестраивается.
+    """
+    if BM25Index.is_saved(config.INDEX_DIR, corpus_hash, len(chunks), config.BM25_NORMALIZATION):
+        return
+    _set_stage(progress, "bm25")
+    started = time.perf_counter()
+    bm25_index = BM25Index.build((chunk.page_content for chunk in chunks), config.BM25_NORMALIZATION)
+    logger.info(
+        f"Built BM25 index over {len(chunks)} chunks in {time.perf_counter() - started:.1f}s "
+        f"(normalization: {config.BM25_NORMALIZATION}, {len(bm25_index.vocabulary)} terms)"
+    )
+    _save_search_index(bm25_index, corpus_hash)
+
+def _save_search_index(search_index, corpus_hash: str):
+    """Сохранение HNSW графа, сжатых векторов или BM25 рядом с сохраненным индексом (после записи индекса)"""
+    if search_index is None:
+        return
+    try:
+        search_index.save(config.INDEX_DIR, corpus_hash)
+    except (OSError, RuntimeError) as e:
+        logger.error(f"Failed to save {type(search_index).__name__} to {config.INDEX_DIR}: {e}")
 
 def create_vector_store(chunks: list):
-    """Создание векторного хранилища"""
+    """Создание векторного хранилища
+
+    Returns:
+        tuple: (vector_store, vectors) - хранилище и матрица эмбеддингов для сохранения
+    """
     embeddings = create_embeddings()
-    vector_store = InMemoryVectorStore.from_documents(
-        documents=chunks,
-        embedding=embeddings
-    )
+    vectors = embed_chunks(chunks, embeddings)
+    vector_store = build_vector_store(chunks, vectors, embeddings)
     logger.info(f"Created vector store with {len(chunks)} chunks")
-    return vector_store
+    return vector_store, vectors
 
-async def reindex_all():
-    """Полная переиндексация всех документов (PDF + JSON)
+def iter_file_chunks(paths: list):
+    """
+    Генератор чанков файлов корпуса (PDF и JSON с Q&A парами)
+    
+    Страницы PDF режутся по одной (результат тот же, что у split_documents
+    для всех страниц сразу), поэтому ни страницы, ни чанки не накапливаются.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=config.CHUNK_SIZE,
+        chunk_overlap=config.CHUNK_OVERLAP
+    )
+    pdf_files = [path for path in paths if path.suffix.lower() == ".pdf"]
+    for page in iter_pdf_pages(pdf_files):
+        yield from text_splitter.split_documents([page])
+    for path in paths:
+        if path.suffix.lower() != ".pdf":
+            yield from load_json_documents(str(path))
+
+def stream_chunks_to_index(writer, paths: list, embeddings, first_chunk_id: int, progress=None):
+    """
+    Потоковая индексация файлов: load/split -> embed -> запись в IndexWriter
+    
+    Стадии перекрываются (IngestPipeline), в памяти остаются только документы
+    чанков, векторы сразу пишутся на диск.
     
+    Returns:
+        tuple: (chunks, busy) - чанки с присвоенными chunk_id и время работы стадий
+    """
+    chunks = []
+    
+    def embed(batch: list) -> np.ndarray:
+        return normalize_rows(embeddings.embed_documents([chunk.page_content for chunk in batch]))
+    
+    def insert(batch: list, vectors: np.ndarray):
+        for chunk_id, chunk in enumerate(batch, start=first_chunk_id + len(chunks)):
+            chunk.metadata["chunk_id"] = chunk_id
+        writer.add(batch, vectors)
+        chunks.extend(batch)
+        _set_stage(progress, "embed", len(chunks))
+    
+    pipeline = IngestPipeline(EMBED_SLICE_SIZE, config.INGEST_QUEUE_SIZE)
+    pipeline.run(iter_file_chunks(paths), embed, insert)
+    if isinstance(embeddings, CachedEmbeddings):
+        logger.info(f"Embedded {len(chunks)} chunks (cache hits: {embeddings.hits}, misses: {embeddings.misses})")
+    else:
+        logger.info(f"Embedded {len(chunks)} chunks")
+    return chunks, pipeline.busy
+
+def get_chunk_file_name(chunk) -> str:
+    """Имя файла корпуса, из которого получен чанк"""
+    return Path(chunk.metadata.get("source", "")).name
+
+def load_saved_index():
+    """Загрузка сохраненного индекса, если его манифест совпадает с текущими настройками и корпусом
+
+    Returns:
+        tuple: (vector_store, chunks) или None если нужна переиндексация
+    """
+    started = time.perf_counter()
+    loaded = index_store.load_index(config.INDEX_DIR)
+    if loaded is None:
+        logger.info(f"No saved index in {config.INDEX_DIR}")
+        return None
+
+    chunks, vectors, manifest = loaded
+    file_states = index_store.compute_file_states(get_corpus_files(config.DATA_DIR), manifest.get("files"))
+    if not index_store.manifest_matches(manifest, index_store.build_manifest(file_states)):
+        return None
+
+    vector_store = build_vector_store(chunks, vectors)
+    if config.VECTOR_INDEX_BACKEND == "hnsw":
+        ann = HnswIndex.load(config.INDEX_DIR, vectors.shape[1], manifest["corpus_hash"])
+        if ann is None:
+            _save_search_index(attach_ann_index(vector_store, vectors), manifest["corpus_hash"])
+        else:
+            measured = ann.recall is None
+            attach_ann_index(vector_store, vectors, ann)
+            if measured and ann.recall is not None:
+                # Recall для этого графа измерен впервые (другие параметры измерения) - сохраняем
+                _save_search_index(ann, manifest["corpus_hash"])
+    if config.VECTOR_QUANTIZATION != "none":
+        quantizer = Quantizer.load(config.INDEX_DIR, vectors.shape[1], manifest["corpus_hash"])
+        if quantizer is None:
+            _save_search_index(attach_quantizer(vector_store, vectors), manifest["corpus_hash"])
+        else:
+            measured = quantizer.recall is None
+            attach_quantizer(vector_store, vectors, quantizer)
+            if measured and quantizer.recall is not None:
+                # Recall для этих кодов измерен впервые (другие параметры измерения) - сохраняем
+                _save_search_index(quantizer, manifest["corpus_hash"])
+    build_bm25_index(chunks, manifest["corpus_hash"])
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"Loaded saved index: {len(chunks)} chunks in {elapsed_ms:.0f} ms")
+    return vector_store, chunks
+
+async def load_or_reindex():
+    """Загрузка индекса с диска или переиндексация, если индекс устарел
+
     Returns:
         tuple: (vector_store, chunks) для инициализации retriever
     """
-    logger.info("Starting full reindexing...")
+    try:
+        result = await asyncio.to_thread(load_saved_index)
+        if result is not None:
+            return result
+    except Exception as e:
+        logger.error(f"Error loading saved index: {e}", exc_info=True)
+    return await update_index()
+
+async def update_index(progress=None):
+    """Инкрементальная переиндексация в отдельном потоке (event loop не блокируется)"""
+    return await asyncio.to_thread(build_incremental_index, progress)
+
+async def reindex_all(progress=None):
+    """Полная переиндексация в отдельном потоке (event loop не блокируется)"""
+    return await asyncio.to_thread(build_full_index, progress)
+
+def build_incremental_index(progress=None):
+    """Инкрементальная переиндексация по изменениям в DATA_DIR
+    
+    Файлы сравниваются с манифестом сохраненного индекса по размеру, mtime и хешу.
+    Чанки удаленных и измененных файлов выбрасываются, новые и измененные файлы
+    парсятся и эмбеддятся заново, чанки и векторы остальных файлов переиспользуются.
+    Если сохраненного индекса нет или изменились настройки - полная переиндексация.
+    
+    Args:
+        progress: объект с методами set_stage(stage, done, total) для отчета о прогрессе
+            и mark_committed() после записи нового индекса на диск
+    
+    Returns:
+        tuple: (vector_store, chunks) для инициализации retriever
+    """
+    global last_report
+    logger.info("Starting incremental reindexing...")
+    timings = {}
     
     try:
-        # Загрузка PDF документов
-        pages = load_pdf_documents(config.DATA_DIR)
-        pdf_chunks = split_documents(pages) if pages else []
-        logger.info(f"PDF: {len(pdf_chunks)} chunks")
+        _set_stage(progress, "scan")
+        started = time.perf_counter()
+        loaded = index_store.load_index(config.INDEX_DIR)
+        if loaded is None or "files" not in loaded[2]:
+            logger.info("No saved index with file states, falling back to full reindexing")
+            return build_full_index(progress)
+        
+        old_chunks, old_vectors, manifest = loaded
+        old_files = manifest["files"]
+        file_states = index_store.compute_file_states(get_corpus_files(config.DATA_DIR), old_files)
+        new_manifest = index_store.build_manifest(file_states)
+        if not index_store.manifest_matches(manifest, new_manifest, index_store.SETTINGS_MATCH_KEYS):
+            return build_full_index(progress)
+        
+        added = [name for name in file_states if name not in old_files]
+        removed = [name for name in old_files if name not in file_states]
+        changed = [
+            name for name in file_states
+            if name in old_files and old_files[name]["sha256"] != file_states[name]["sha256"]
+        ]
+        kept = [name for name in file_states if name in old_files and name not in changed]
+        timings["scan"] = time.perf_counter() - started
+        
+        kept_names = set(kept)
+        keep_mask = np.array([get_chunk_file_name(chunk) in kept_names for chunk in old_chunks], dtype=bool)
+        kept_chunks = [chunk for chunk, keep in zip(old_chunks, keep_mask) if keep]
+        
+        # HNSW граф и сжатые векторы старого индекса читаем до того, как директория будет подменена
+        dim = old_vectors.shape[1] if len(old_vectors) else 0
+        ann = None
+        if config.VECTOR_INDEX_BACKEND == "hnsw" and dim:
+            ann = HnswIndex.load(config.INDEX_DIR, dim, manifest["corpus_hash"])
+        quantizer = None
+        if config.VECTOR_QUANTIZATION != "none" and dim:
+            quantizer = Quantizer.load(config.INDEX_DIR, dim, manifest["corpus_hash"])
+        
+        embeddings = create_embeddings()
+        if added or removed or changed:
+            # Новый индекс пишется потоково: векторы неизмененных файлов копируются
+            # блоками из старого, новые и измененные файлы парсятся и эмбеддятся
+            _set_stage(progress, "load")
+            started = time.perf_counter()
+            next_id = max((chunk.metadata["chunk_id"] for chunk in old_chunks), default=-1) + 1
+            data_path = Path(config.DATA_DIR)
+            result = _write_index(
+                [data_path / name for name in added + changed], embeddings, next_id, new_manifest, progress,
+                kept_chunks=kept_chunks, old_vectors=old_vectors, kept_positions=np.flatnonzero(keep_mask)
+            )
+            if result is None:
+                logger.warning("No documents found to index")
+                return None, []
+            new_chunks, busy = result
+            timings["ingest"] = time.perf_counter() - started
+            timings.update(busy)
+            vectors = index_store.load_vectors(config.INDEX_DIR)
+            if vectors is None:
+                raise OSError(f"Cannot open saved embeddings in {config.INDEX_DIR}")
+        else:
+            new_chunks = []
+            vectors = old_vectors
+        all_chunks = kept_chunks + new_chunks
+        new_vectors = vectors[len(kept_chunks):]
         
-        # Загрузка JSON Q&A пар
-        json_file = Path(config.DATA_DIR) / "sberbank_help_documents.json"
-        json_documents = load_json_documents(str(json_file))
-        logger.info(f"JSON: {len(json_documents)} Q&A pairs")
+        _set_stage(progress, "build")
+        started = time.perf_counter()
+        vector_store = build_vector_store(all_chunks, vectors, embeddings)
+        timings["build"] = time.perf_counter() - started
         
-        # Объединяем все чанки
-        all_chunks = pdf_chunks + json_documents
+        # HNSW граф старого индекса обновляется на месте: чанки удаленных файлов
+        # помечаются удаленными, новые добавляются. При большой доле удаленных - перестройка
+        started = time.perf_counter()
+        if ann is not None:
+            ann.delete([chunk.metadata["chunk_id"] for chunk, keep in zip(old_chunks, keep_mask) if not keep])
+            if new_chunks:
+                ann.add(new_vectors, np.array([chunk.metadata["chunk_id"] for chunk in new_chunks], dtype=np.int64))
+            if ann.deleted > len(ann):
+                ann = None
+        ann_saved = ann is not None and not (added or removed or changed)
+        ann = attach_ann_index(vector_store, vectors, ann, progress)
+        if ann is not None:
+            timings["ann"] = time.perf_counter() - started
         
-        if not all_chunks:
+        # Коды неизмененных чанков переиспользуются, кодируются только новые
+        # (кодовые книги PQ переобучаются при полной переиндексации)
+        started = time.perf_counter()
+        if quantizer is not None:
+            quantizer.select(keep_mask)
+            if new_chunks:
+                quantizer.add(new_vectors)
+        quantizer_saved = quantizer is not None and not (added or removed or changed)
+        quantizer = attach_quantizer(vector_store, vectors, quantizer, progress)
+        if quantizer is not None:
+            timings["quantize"] = time.perf_counter() - started
+        
+        _set_stage(progress, "save")
+        started = time.perf_counter()
+        if not ann_saved:
+            _save_search_index(ann, new_manifest["corpus_hash"])
+        if not quantizer_saved:
+            _save_search_index(quantizer, new_manifest["corpus_hash"])
+        timings["save"] = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        build_bm25_index(all_chunks, new_manifest["corpus_hash"], progress)
+        timings["bm25"] = time.perf_counter() - started
+        
+        last_report = {
+            "mode": "incremental",
+            "added": added,
+            "removed": removed,
+            "changed": changed,
+            "kept": kept,
+            "chunks_added": len(new_chunks),
+            "chunks_removed": len(old_chunks) - len(kept_chunks),
+            "chunks_total": len(all_chunks),
+            "timings": timings,
+        }
+        logger.info(
+            f"Incremental reindexing completed: added {len(added)}, changed {len(changed)}, "
+            f"removed {len(removed)}, kept {len(kept)} files ({len(all_chunks)} chunks)"
+        )
+        return vector_store, all_chunks
+        
+    except IndexingCancelled:
+        logger.info("Incremental reindexing cancelled")
+        raise
+    except Exception as e:
+        logger.error(f"Error during incremental reindexing: {e}", exc_info=True)
+        return None, []
+
+def _write_index(paths: list, embeddings, first_chunk_id: int, manifest: dict, progress=None,
+                 kept_chunks: list = (), old_vectors: np.ndarray = None, kept_positions: np.ndarray = ()):
+    """
+    Потоковая запись нового индекса в INDEX_DIR
+    
+    Сначала переносятся сохраняемые чанки и их векторы (блоками из memory-map
+    старого индекса), затем через конвейер индексируются файлы paths. Директория
+    индекса подменяется только после успешной записи; при отмене или ошибке
+    текущий индекс остается нетронутым.
+    
+    Returns:
+        tuple: (new_chunks, busy) или None если индексировать нечего
+    """
+    writer = index_store.IndexWriter(config.INDEX_DIR)
+    try:
+        for start in range(0, len(kept_chunks), EMBED_SLICE_SIZE):
+            positions = kept_positions[start:start + EMBED_SLICE_SIZE]
+            writer.add(kept_chunks[start:start + EMBED_SLICE_SIZE], np.asarray(old_vectors[positions], dtype=np.float32))
+        new_chunks, busy = stream_chunks_to_index(writer, paths, embeddings, first_chunk_id, progress)
+        if writer.count == 0:
+            writer.abort()
+            return None
+        # Последняя проверка отмены: после commit на диске уже новый индекс
+        _set_stage(progress, "save")
+        writer.commit(manifest)
+        _set_committed(progress)
+    except BaseException:
+        writer.abort()
+        raise
+    return new_chunks, busy
+
+def build_full_index(progress=None):
+    """Полная переиндексация всех документов (PDF + JSON)
+    
+    Загрузка, разбиение, эмбеддинги и запись на диск идут потоково с перекрытием
+    стадий (IngestPipeline): пиковая память не растет с размером корпуса.
+    
+    Args:
+        progress: объект с методами set_stage(stage, done, total) для отчета о прогрессе
+            и mark_committed() после записи нового индекса на диск
+    
+    Returns:
+        tuple: (vector_store, chunks) для инициализации retriever
+    """
+    global last_report
+    logger.info("Starting full reindexing...")
+    timings = {}
+    
+    try:
+        # Состояние файлов фиксируем до загрузки, чтобы манифест соответствовал прочитанным файлам
+        _set_stage(progress, "scan")
+        started = time.perf_counter()
+        corpus_files = get_corpus_files(config.DATA_DIR)
+        file_states = index_store.compute_file_states(corpus_files)
+        manifest = index_store.build_manifest(file_states)
+        timings["scan"] = time.perf_counter() - started
+        logger.info(f"Found {len(corpus_files)} files to index in {config.DATA_DIR}")
+        
+        _set_stage(progress, "load")
+        started = time.perf_counter()
+        embeddings = create_embeddings()
+        result = _write_index(corpus_files, embeddings, 0, manifest, progress)
+        if result is None:
             logger.warning("No documents found to index")
             return None, []
+        all_chunks, busy = result
+        timings["ingest"] = time.perf_counter() - started
+        timings.update(busy)
+        
+        vectors = index_store.load_vectors(config.INDEX_DIR)
+        if vectors is None:
+            raise OSError(f"Cannot open saved embeddings in {config.INDEX_DIR}")
+        
+        _set_stage(progress, "build")
+        started = time.perf_counter()
+        vector_store = build_vector_store(all_chunks, vectors, embeddings)
+        timings["build"] = time.perf_counter() - started
         
-        logger.info(f"Total chunks to index: {len(all_chunks)} (PDF: {len(pdf_chunks)}, JSON: {len(json_documents)})")
+        started = time.perf_counter()
+        ann = attach_ann_index(vector_store, vectors, progress=progress)
+        if ann is not None:
+            timings["ann"] = time.perf_counter() - started
         
-        vector_store = create_vector_store(all_chunks)
+        started = time.perf_counter()
+        quantizer = attach_quantizer(vector_store, vectors, progress=progress)
+        if quantizer is not None:
+            timings["quantize"] = time.perf_counter() - started
+        
+        _set_stage(progress, "save")
+        started = time.perf_counter()
+        _save_search_index(ann, manifest["corpus_hash"])
+        _save_search_index(quantizer, manifest["corpus_hash"])
+        timings["save"] = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        build_bm25_index(all_chunks, manifest["corpus_hash"], progress)
+        timings["bm25"] = time.perf_counter() - started
         logger.info("Reindexing completed successfully")
         
+        last_report = {
+            "mode": "full",
+            "added": list(file_states),
+            "removed": [],
+            "changed": [],
+            "kept": [],
+            "chunks_added": len(all_chunks),
+            "chunks_removed": 0,
+            "chunks_total": len(all_chunks),
+            "timings": timings,
+        }
+        
         # Возвращаем vector_store и chunks для BM25
         return vector_store, all_chunks
         
+    except IndexingCancelled:
+        logger.info("Full reindexing cancelled")
+        raise
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
         return None, []
     except Exception as e:
         logger.error(f"Error during reindexing: {e}", exc_info=True)
         return None, []
-
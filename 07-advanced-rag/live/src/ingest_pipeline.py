@@ -0,0 +1,125 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Маркер конца потока между стадиями
+_DONE = object()
+
+class _StageError:
+    """Исключение стадии, передаваемое по очереди следующей стадии"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+class IngestPipeline:
+    """
+    Потоковый конвейер индексации: load/split -> embed -> insert
+
+    Стадии работают одновременно в отдельных потоках и связаны очередями
+    ограниченного размера, поэтому в памяти находится не больше queue_size
+    батчей между соседними стадиями, независимо от размера корпуса. Пока
+    эмбеддится один батч, следующий уже парсится, а предыдущий пишется на диск.
+
+    Вставка (insert) выполняется в вызывающем потоке: там же можно бросить
+    исключение (например, отмену индексации), конвейер остановит остальные стадии.
+    """
+
+    def __init__(self, batch_size: int, queue_size: int):
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        # Суммарное время работы каждой стадии (без ожидания очередей)
+        self.busy = {"load": 0.0, "embed": 0.0, "write": 0.0}
+        self._stop = threading.Event()
+
+    def _put(self, out_queue: queue.Queue, item):
+        """Блокирующая запись в очередь, прерываемая остановкой конвейера"""
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, in_queue: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _load(self, items, out_queue: queue.Queue):
+        try:
+            iterator = iter(items)
+            while True:
+                started = time.perf_counter()
+                batch = []
+                for item in iterator:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                self.busy["load"] += time.perf_counter() - started
+                if not batch:
+                    break
+                if not self._put(out_queue, batch):
+                    return
+        except BaseException as e:
+            self._put(out_queue, _StageError(e))
+            return
+        self._put(out_queue, _DONE)
+
+    def _embed(self, embed, in_queue: queue.Queue, out_queue: queue.Queue):
+        while True:
+            batch = self._get(in_queue)
+            if batch is _DONE or isinstance(batch, _StageError):
+                self._put(out_queue, batch)
+                return
+            try:
+                started = time.perf_counter()
+                vectors = embed(batch)
+                self.busy["embed"] += time.perf_counter() - started
+            except BaseException as e:
+                self._put(out_queue, _StageError(e))
+                return
+            if not self._put(out_queue, (batch, vectors)):
+                return
+
+    def run(self, items, embed, insert):
+        """
+        Запуск конвейера
+
+        Args:
+            items: итерируемый источник элементов (генератор чанков)
+            embed: функция batch -> vectors (выполняется в потоке эмбеддингов)
+            insert: функция (batch, vectors) -> None (выполняется в вызывающем потоке)
+        """
+        loaded = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(target=self._load, args=(items, loaded), name="ingest-load", daemon=True),
+            threading.Thread(target=self._embed, args=(embed, loaded, embedded), name="ingest-embed", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(embedded)
+                if item is _DONE:
+                    break
+                if isinstance(item, _StageError):
+                    raise item.error
+                started = time.perf_counter()
+                insert(*item)
+                self.busy["write"] += time.perf_counter() - started
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        logger.info(
+            "Ingest pipeline busy time: "
+            + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in self.busy.items())
+        )
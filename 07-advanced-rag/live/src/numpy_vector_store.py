@@ -0,0 +1,211 @@
+import logging
+import uuid
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-нормализация строк матрицы (нулевые векторы остаются нулевыми)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Индексы k наибольших значений по убыванию (argpartition + сортировка только k элементов)"""
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+class NumpyVectorStore(VectorStore):
+    """
+    Векторное хранилище с точным top-k поиском на NumPy
+
+    Нормализованные эмбеддинги лежат в одной непрерывной матрице float32
+    (может быть memory-map сохраненного индекса). Поиск - одно матрично-векторное
+    произведение (косинусная близость) и argpartition для top-k, без Python-цикла
+    по документам. Подключается к LangChain через стандартный as_retriever().
+
+    Опционально поиск делегируется ANN индексу (attach_ann_index), метки
+    которого - целочисленные id документов, или идет по сжатым векторам
+    (attach_quantizer) с пересчетом shortlist по полной матрице.
+    """
+
+    def __init__(self, embedding: Embeddings):
+        self.embedding = embedding
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.documents = []
+        self.ids = []
+        self.ann_index = None
+        self._ann_positions = None
+        self.quantizer = None
+        self.rescore_factor = 0
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @classmethod
+    def from_vectors(cls, documents: list, vectors: np.ndarray, embedding: Embeddings,
+                     ids: list = None, normalized: bool = False) -> "NumpyVectorStore":
+        """
+        Создание хранилища из готовых эмбеддингов без обращения к модели
+
+        Args:
+            documents: список Document
+            vectors: матрица эмбеддингов (len(documents) x dim)
+            embedding: embeddings для запросов
+            ids: идентификаторы документов (по умолчанию - uuid)
+            normalized: векторы уже L2-нормализованы (матрица используется как есть, без копии)
+        """
+        if len(documents) != len(vectors):
+            raise ValueError(f"Documents/vectors size mismatch: {len(documents)} != {len(vectors)}")
+        store = cls(embedding)
+        store.matrix = vectors if normalized else normalize_rows(vectors)
+        store.documents = list(documents)
+        store.ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in documents]
+        return store
+
+    @classmethod
+    def from_texts(cls, texts: list, embedding: Embeddings, metadatas: list = None,
+                   ids: list = None, **kwargs) -> "NumpyVectorStore":
+        store = cls(embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def add_vectors(self, documents: list, vectors: np.ndarray, ids: list = None) -> list:
+        """Добавление документов с готовыми эмбеддингами"""
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in documents]
+        if len(ids) != len(documents) or len(vectors) != len(documents):
+            raise ValueError("documents, vectors and ids must have the same length")
+        new_rows = normalize_rows(vectors)
+        self.matrix = new_rows if len(self.documents) == 0 else np.vstack([self.matrix, new_rows])
+        self.documents.extend(documents)
+        self.ids.extend(ids)
+        if self.ann_index is not None:
+            self.ann_index.add(new_rows, np.array([int(doc_id) for doc_id in ids], dtype=np.int64))
+            self._ann_positions.update({int(doc_id): len(self.ids) - len(ids) + i for i, doc_id in enumerate(ids)})
+        if self.quantizer is not None:
+            self.quantizer.add(new_rows)
+        return ids
+
+    def add_texts(self, texts, metadatas: list = None, ids: list = None, **kwargs) -> list:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        vectors = np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+        return self.add_vectors(documents, vectors, ids)
+
+    def delete(self, ids: list = None, **kwargs):
+        if not ids:
+            return
+        to_delete = set(ids)
+        keep = np.array([doc_id not in to_delete for doc_id in self.ids], dtype=bool)
+        self.matrix = self.matrix[keep]
+        self.documents = [doc for doc, flag in zip(self.documents, keep) if flag]
+        self.ids = [doc_id for doc_id, flag in zip(self.ids, keep) if flag]
+        if self.ann_index is not None:
+            self.ann_index.delete([int(doc_id) for doc_id in to_delete if doc_id.isdigit()])
+            self.attach_ann_index(self.ann_index)
+        if self.quantizer is not None:
+            self.quantizer.select(keep)
+
+    def get_by_ids(self, ids) -> list:
+        positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        return [self._make_document(positions[doc_id]) for doc_id in ids if doc_id in positions]
+
+    def _make_document(self, position: int) -> Document:
+        doc = self.documents[position]
+        return Document(id=self.ids[position], page_content=doc.page_content, metadata=doc.metadata)
+
+    def attach_ann_index(self, ann_index):
+        """Подключение ANN индекса; метки индекса - int(id) документов хранилища"""
+        self.ann_index = ann_index
+        self._ann_positions = {int(doc_id): i for i, doc_id in enumerate(self.ids)}
+
+    def attach_quantizer(self, quantizer, rescore_factor: int = 0):
+        """
+        Поиск по сжатым векторам
+
+        Args:
+            quantizer: сжатое представление матрицы (quantization.Quantizer) в том же порядке строк
+            rescore_factor: k * rescore_factor лучших кандидатов пересчитываются по полной
+                матрице float32 (обычно memory-map на диске), 0 - без пересчета
+        """
+        self.quantizer = quantizer
+        self.rescore_factor = rescore_factor
+
+    def _quantized_search(self, query: np.ndarray, k: int):
+        scores = self.quantizer.scores(query)
+        if self.rescore_factor > 1:
+            # Отсортированные позиции - последовательное чтение memory-map
+            candidates = np.sort(top_k_indices(scores, k * self.rescore_factor))
+            exact = np.asarray(self.matrix[candidates], dtype=np.float32) @ query
+            best = top_k_indices(exact, k)
+            return candidates[best], exact[best]
+        best = top_k_indices(scores, k)
+        return best, scores[best]
+
+    def search_positions(self, embedding: list, k: int = 4):
+        """
+        Top-k поиск без построения Document
+
+        Returns:
+            tuple: (positions, scores) - позиции документов в хранилище и косинусная близость
+        """
+        if len(self.documents) == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = normalize_rows(embedding)[0]
+        if self.ann_index is not None:
+            labels, scores = self.ann_index.search(query.reshape(1, -1), k)
+            positions = np.array([self._ann_positions[int(label)] for label in labels[0]], dtype=np.int64)
+            return positions, scores[0]
+        if self.quantizer is not None:
+            return self._quantized_search(query, k)
+        scores = self.matrix @ query
+        best = top_k_indices(scores, k)
+        return best, scores[best]
+
+    def similarity_search_with_score_by_vector(self, embedding: list, k: int = 4, **kwargs) -> list:
+        positions, scores = self.search_positions(embedding, k)
+        return [(self._make_document(int(position)), float(score)) for position, score in zip(positions, scores)]
+
+    def similarity_search_by_vector(self, embedding: list, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        embedding = await self.embedding.aembed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k)
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Косинусная близость [-1, 1] -> релевантность [0, 1]
+        return lambda score: (score + 1) / 2
+
+    def get_memory_usage(self) -> int:
+        """
+        Объем эмбеддингов в RAM в байтах
+
+        При сжатии memory-map полной матрицы не учитывается: с диска читается только shortlist.
+        """
+        if self.quantizer is None:
+            return int(self.matrix.nbytes)
+        full = 0 if isinstance(self.matrix, np.memmap) else int(self.matrix.nbytes)
+        return self.quantizer.nbytes + full
@@ -0,0 +1,16 @@
+import pypdf
+
+# Функция воркера пула парсинга PDF вынесена из indexer: пул запускается через
+# spawn, и дочерний процесс импортирует только этот модуль, а не langchain/torch
+
+def extract_pdf_pages(path: str, start: int, end: int) -> list:
+    """Извлечение текста страниц [start, end) в процессе-воркере (как в PyPDFParser)"""
+    reader = pypdf.PdfReader(path)
+    texts = []
+    for page_number in range(start, end):
+        page = reader.pages[page_number]
+        if pypdf.__version__.startswith("3"):
+            texts.append(page.extract_text())
+        else:
+            texts.append(page.extract_text(extraction_mode="plain"))
+    return texts
@@ -0,0 +1,325 @@
+import json
+import logging
+from pathlib import Path
+import numpy as np
+from config import config
+from numpy_vector_store import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_FILE = "quantization.npz"
+QUANTIZATION_META_FILE = "quantization.json"
+
+# Размер блока при кодировании и поиске: временные float32 копии не превышают ~16 МБ
+BLOCK_BYTES = 16 * 1024 * 1024
+
+# Обучение кодовых книг PQ
+PQ_CENTROIDS = 256  # uint8 код на подвектор
+PQ_TRAIN_SAMPLE = 10000
+PQ_TRAIN_ITERATIONS = 10
+
+def _block_rows(dim: int) -> int:
+    return max(1, BLOCK_BYTES // (max(dim, 1) * 4))
+
+class Quantizer:
+    """
+    Сжатое хранение нормализованных эмбеддингов с приближенным скалярным произведением
+
+    Коды хранятся в RAM вместо матрицы float32, поиск считает приближенные
+    близости блоками (без полной float32 копии). Полная матрица при этом может
+    оставаться на диске (memory-map) для точного пересчета shortlist.
+    """
+
+    mode = None
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.codes = None
+        self.recall = None  # recall@k относительно точного поиска (если измерялся)
+
+    def __len__(self) -> int:
+        return 0 if self.codes is None else len(self.codes)
+
+    def fit(self, vectors: np.ndarray) -> "Quantizer":
+        """Обучение параметров квантования (нужно только PQ)"""
+        return self
+
+    def _encode(self, vectors: np.ndarray) -> dict:
+        raise NotImplementedError
+
+    def _prepare_query(self, query: np.ndarray):
+        """Представление запроса для _score_block (для PQ - таблица близостей с центроидами)"""
+        return query
+
+    def _score_block(self, start: int, end: int, query) -> np.ndarray:
+        raise NotImplementedError
+
+    def _arrays(self) -> dict:
+        """Построчные массивы кодов (добавляются и фильтруются вместе)"""
+        return {"codes": self.codes}
+
+    def _set_arrays(self, arrays: dict):
+        self.codes = arrays["codes"]
+
+    def add(self, vectors: np.ndarray):
+        """Кодирование и добавление векторов (блоками, vectors может быть memory-map)"""
+        parts = [self._arrays()] if len(self) else []
+        for start in range(0, len(vectors), _block_rows(self.dim)):
+            block = np.asarray(vectors[start:start + _block_rows(self.dim)], dtype=np.float32)
+            parts.append(self._encode(block))
+        if parts:
+            self._set_arrays({key: np.concatenate([part[key] for part in parts]) for key in parts[0]})
+        # Recall измерялся на прежнем наборе векторов
+        self.recall = None
+
+    def select(self, mask: np.ndarray):
+        """Оставить только строки по маске (удаление документов)"""
+        self._set_arrays({key: value[mask] for key, value in self._arrays().items()})
+        self.recall = None
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Приближенная близость запроса ко всем векторам"""
+        prepared = self._prepare_query(query)
+        result = np.empty(len(self), dtype=np.float32)
+        rows = _block_rows(self.dim)
+        for start in range(0, len(self), rows):
+            end = min(start + rows, len(self))
+            result[start:end] = self._score_block(start, end, prepared)
+        return result
+
+    @property
+    def nbytes(self) -> int:
+        """Объем сжатого представления в байтах"""
+        return int(sum(value.nbytes for value in self._arrays().values()))
+
+    def _params(self) -> dict:
+        return {}
+
+    def _model_arrays(self) -> dict:
+        """Обученные параметры (кодовые книги), сохраняются вместе с кодами"""
+        return {}
+
+    def _set_model_arrays(self, arrays: dict):
+        pass
+
+    def save(self, index_dir: str, corpus_hash: str):
+        """Сохранение кодов рядом с сохраненным индексом"""
+        index_path = Path(index_dir)
+        np.savez(index_path / QUANTIZATION_FILE, **self._arrays(), **self._model_arrays())
+        meta = {"mode": self.mode, "dim": self.dim, "corpus_hash": corpus_hash, **self._params()}
+        if self.recall is not None:
+            meta["recall"] = self.recall
+            meta["recall_params"] = recall_params()
+        (index_path / QUANTIZATION_META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        logger.info(f"Quantized vectors ({self.mode}) saved to {index_path}")
+
+    @classmethod
+    def load(cls, index_dir: str, dim: int, corpus_hash: str):
+        """Загрузка кодов, если они построены для того же корпуса и с теми же параметрами (иначе None)"""
+        index_path = Path(index_dir)
+        meta_path = index_path / QUANTIZATION_META_FILE
+        if not meta_path.exists() or not (index_path / QUANTIZATION_FILE).exists():
+            return None
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        quantizer = create_quantizer(dim)
+        expected = {"mode": quantizer.mode, "dim": dim, "corpus_hash": corpus_hash, **quantizer._params()}
+        if any(meta.get(key) != value for key, value in expected.items()):
+            logger.info("Saved quantized vectors do not match the current index, re-encoding")
+            return None
+
+        try:
+            with np.load(index_path / QUANTIZATION_FILE) as data:
+                arrays = {key: data[key] for key in data.files}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot load quantized vectors from {index_path}: {e}")
+            return None
+        quantizer._set_model_arrays(arrays)
+        quantizer._set_arrays({key: arrays[key] for key in quantizer._arrays()})
+        # Recall не меняется, пока не изменились корпус, коды и параметры измерения
+        if meta.get("recall_params") == recall_params():
+            quantizer.recall = meta.get("recall")
+        return quantizer
+
+class Float16Quantizer(Quantizer):
+    """float16: в 2 раза меньше памяти, потеря точности пренебрежимо мала"""
+
+    mode = "float16"
+
+    def _encode(self, vectors: np.ndarray) -> dict:
+        return {"codes": vectors.astype(np.float16)}
+
+    def _score_block(self, start: int, end: int, query: np.ndarray) -> np.ndarray:
+        return self.codes[start:end].astype(np.float32) @ query
+
+class Int8Quantizer(Quantizer):
+    """int8 со scale на строку: в 4 раза меньше памяти"""
+
+    mode = "int8"
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.scales = None
+
+    def _arrays(self) -> dict:
+        return {"codes": self.codes, "scales": self.scales}
+
+    def _set_arrays(self, arrays: dict):
+        self.codes = arrays["codes"]
+        self.scales = arrays["scales"]
+
+    def _encode(self, vectors: np.ndarray) -> dict:
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return {"codes": codes, "scales": scales.astype(np.float32)}
+
+    def _score_block(self, start: int, end: int, query: np.ndarray) -> np.ndarray:
+        return (self.codes[start:end].astype(np.float32) @ query) * self.scales[start:end]
+
+class ProductQuantizer(Quantizer):
+    """
+    Product quantization: вектор режется на subvectors частей, каждая заменяется
+    номером ближайшего из 256 центроидов (1 байт). Для 3072-мерных эмбеддингов
+    и 384 частей - 384 байта вместо 12 КБ. Близость считается через таблицу
+    скалярных произведений запроса с центроидами, поэтому shortlist имеет смысл
+    пересчитывать по полной матрице (VECTOR_RESCORE).
+    """
+
+    mode = "pq"
+
+    def __init__(self, dim: int, subvectors: int):
+        super().__init__(dim)
+        self.subvectors = subvectors
+        self.sub_dim = -(-dim // subvectors)
+        self.codebooks = None  # subvectors x centroids x sub_dim
+
+    def _params(self) -> dict:
+        return {"subvectors": self.subvectors}
+
+    def _model_arrays(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+    def _set_model_arrays(self, arrays: dict):
+        self.codebooks = arrays["codebooks"]
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        """Разбиение на подвекторы (с дополнением нулями до subvectors * sub_dim)"""
+        padded = np.zeros((len(vectors), self.subvectors * self.sub_dim), dtype=np.float32)
+        padded[:, :vectors.shape[1]] = vectors
+        return padded.reshape(len(vectors), self.subvectors, self.sub_dim)
+
+    @staticmethod
+    def _assign(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (centroids ** 2).sum(axis=1) - 2 * points @ centroids.T
+        return distances.argmin(axis=1)
+
+    def fit(self, vectors: np.ndarray) -> "ProductQuantizer":
+        """k-means в каждом подпространстве на случайной выборке векторов"""
+        rng = np.random.default_rng(0)
+        sample_size = min(PQ_TRAIN_SAMPLE, len(vectors))
+        sample = np.sort(rng.choice(len(vectors), size=sample_size, replace=False))
+        parts = self._split(np.asarray(vectors[sample], dtype=np.float32))
+        centroids_count = min(PQ_CENTROIDS, sample_size)
+
+        self.codebooks = np.zeros((self.subvectors, PQ_CENTROIDS, self.sub_dim), dtype=np.float32)
+        for j in range(self.subvectors):
+            points = parts[:, j, :]
+            centroids = points[rng.choice(sample_size, size=centroids_count, replace=False)].copy()
+            for _ in range(PQ_TRAIN_ITERATIONS):
+                assignment = self._assign(points, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, points)
+                counts = np.bincount(assignment, minlength=centroids_count)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            self.codebooks[j, :centroids_count] = centroids
+        logger.info(f"Trained PQ codebooks: {self.subvectors} subvectors x {centroids_count} centroids on {sample_size} vectors")
+        return self
+
+    def _encode(self, vectors: np.ndarray) -> dict:
+        parts = self._split(vectors)
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        for j in range(self.subvectors):
+            codes[:, j] = self._assign(parts[:, j, :], self.codebooks[j])
+        return {"codes": codes}
+
+    def _prepare_query(self, query: np.ndarray) -> np.ndarray:
+        # Скалярные произведения частей запроса с центроидами: subvectors x 256
+        return np.einsum("jcd,jd->jc", self.codebooks, self._split(query.reshape(1, -1))[0])
+
+    def _score_block(self, start: int, end: int, table: np.ndarray) -> np.ndarray:
+        return table[np.arange(self.subvectors), self.codes[start:end]].sum(axis=1)
+
+def create_quantizer(dim: int):
+    """Квантователь по VECTOR_QUANTIZATION (None для float32 без сжатия)"""
+    mode = config.VECTOR_QUANTIZATION
+    if mode == "float16":
+        return Float16Quantizer(dim)
+    if mode == "int8":
+        return Int8Quantizer(dim)
+    if mode == "pq":
+        subvectors = config.PQ_SUBVECTORS or max(1, dim // 8)
+        return ProductQuantizer(dim, min(subvectors, dim))
+    return None
+
+def recall_params() -> dict:
+    """Параметры измерения recall из конфига (сохраняются вместе с результатом)"""
+    return {
+        "k": config.SEMANTIC_RETRIEVER_K,
+        "num_queries": config.ANN_RECALL_SAMPLE,
+        "rescore_factor": config.VECTOR_RESCORE_FACTOR,
+    }
+
+def exact_kth_scores(matrix: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    k-я по величине точная близость для каждого запроса
+
+    Один проход по матрице блоками (matrix может быть memory-map): для всех
+    запросов сразу держится текущий top-k, полная матрица близостей
+    (запросы x корпус) не создается.
+    """
+    top = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    rows = _block_rows(queries.shape[1])
+    for start in range(0, len(matrix), rows):
+        block = np.asarray(matrix[start:start + rows], dtype=np.float32)
+        merged = np.concatenate([top, queries @ block.T], axis=1)
+        top = -np.partition(-merged, k - 1, axis=1)[:, :k]
+    return top.min(axis=1)
+
+def measure_quantization_recall(matrix: np.ndarray, quantizer: Quantizer, k: int = 10,
+                                num_queries: int = 100, rescore_factor: int = 0, seed: int = 0) -> float:
+    """
+    Recall@k поиска по сжатым векторам относительно точного (как measure_recall для HNSW)
+
+    Точный top-k для всей выборки считается за один проход по матрице, для
+    пересчета shortlist читаются только строки кандидатов.
+
+    Args:
+        matrix: нормализованная матрица эмбеддингов float32
+        quantizer: сжатое представление той же матрицы
+        rescore_factor: пересчет k * rescore_factor кандидатов по полной матрице (0 - без пересчета)
+    """
+    if len(matrix) == 0:
+        return 1.0
+    k = min(k, len(matrix))
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(len(matrix), size=min(num_queries, len(matrix)), replace=False))
+    queries = np.asarray(matrix[sample], dtype=np.float32)
+    kth_scores = exact_kth_scores(matrix, queries, k)
+
+    hits = 0
+    for query, kth_score in zip(queries, kth_scores):
+        approx = quantizer.scores(query)
+        if rescore_factor > 1:
+            candidates = top_k_indices(approx, k * rescore_factor)
+        else:
+            candidates = top_k_indices(approx, k)
+        exact_scores = np.asarray(matrix[np.sort(candidates)], dtype=np.float32) @ query
+        # Найденные top-k: после пересчета - лучшие по точной близости среди кандидатов
+        found_scores = exact_scores[top_k_indices(exact_scores, k)] if rescore_factor > 1 else exact_scores
+        hits += int(np.sum(found_scores >= kth_score - 1e-5))
+    return hits / (len(sample) * k)
@@ -1,18 +1,29 @@
+import asyncio
+import concurrent.futures
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
 
 # Fix Pydantic forward reference issues
 from langchain_core.caches import BaseCache
 from langchain_core.callbacks.base import Callbacks
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableGenerator, RunnableLambda, RunnablePassthrough, RunnablePick
 from langchain_openai import ChatOpenAI
 
 # Force rebuild with proper namespace
 ChatOpenAI.model_rebuild(_types_namespace={"BaseCache": BaseCache, "Callbacks": Callbacks})
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
 from config import config
+import embedding_cache
+import index_store
+from bm25_index import BM25IndexRetriever
+from hybrid_retriever import ConcurrentHybridRetriever, get_hybrid_stats
+from rerank_worker import RerankWorker
+import rerank_cache
+import answer_cache
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +32,22 @@ vector_store = None
 retriever = None
 chunks = None  # Для BM25 retriever
 cross_encoder = None  # Для reranking (lazy loading)
+_cross_encoder_lock = threading.Lock()  # Прогрев и первый запрос могут загружать модель одновременно
+rerank_worker = None  # Микробатчинг cross-encoder (lazy)
+rerank_score_cache = None  # Кеш оценок cross-encoder (lazy)
+# Пул для обращений к SQLite кешу оценок из async цепочки (соединение одно, под lock кеша)
+_rerank_cache_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="rerank-cache")
+semantic_answer_cache = None  # Кеш ответов по близости запроса (lazy)
+index_version = None  # corpus_hash текущего индекса (для инвалидации кеша reranking)
+
+# Глубина reranking: сколько кандидатов пришло, сколько оценено (каскад) и сколько ушло в модель (мимо кеша)
+_rerank_stats = {"requests": 0, "candidates": 0, "depth": 0, "scored": 0}
+_rerank_stats_lock = threading.Lock()  # rerank_documents и arerank_documents пишут из разных потоков
+
+# Собранная RAG-цепочка: (ключ (режим, версия индекса, id retriever), цепочка) - подменяется целиком
+_chain_cache = (None, None)
+_chain_lock = threading.Lock()
+_chain_stats = {"builds": 0, "hits": 0}
 
 # Кеши для промптов и LLM клиентов
 _conversational_answering_prompt = None
@@ -28,53 +55,221 @@ _retrieval_query_transform_prompt = None
 _llm_query_transform = None
 _llm = None
 
-def create_semantic_retriever():
+# Трансформация запроса: LRU память (хеш окна истории и вопроса -> запрос) и счетчики вызовов LLM;
+# счетчики меняются из sync и async цепочек - только под _transform_lock
+_transform_memo = OrderedDict()
+_transform_lock = threading.Lock()
+_transform_stats = {"calls": 0, "skipped": 0, "memo_hits": 0}
+
+def create_semantic_retriever(store=None):
     """Создание semantic retriever из vector store"""
-    if vector_store is None:
+    if store is None:
+        store = vector_store
+    if store is None:
         raise ValueError("Vector store not initialized")
-    return vector_store.as_retriever(
+    return store.as_retriever(
         search_kwargs={'k': config.SEMANTIC_RETRIEVER_K}
     )
 
-def create_bm25_retriever():
-    """Создание BM25 retriever из chunks"""
-    if chunks is None or len(chunks) == 0:
+def create_bm25_retriever(corpus=None, normalization: str = None):
+    """Создание BM25 retriever из chunks
+    
+    Статистики BM25 строятся при индексации и загружаются из INDEX_DIR лениво,
+    при первом запросе. Если сохраненных нет (или они от другого корпуса или
+    с другой нормализацией), индекс строится из chunks.
+    
+    Args:
+        corpus: чанки (по умолчанию - текущие глобальные)
+        normalization: нормализация терминов none/stem/lemma (по умолчанию - BM25_NORMALIZATION)
+    """
+    if corpus is None:
+        corpus = chunks
+    if corpus is None or len(corpus) == 0:
         raise ValueError("Chunks not initialized for BM25")
-    bm25 = BM25Retriever.from_documents(chunks)
-    bm25.k = config.BM25_RETRIEVER_K
-    return bm25
+    manifest = index_store.load_manifest(config.INDEX_DIR)
+    return BM25IndexRetriever(
+        docs=corpus,
+        k=config.BM25_RETRIEVER_K,
+        index_dir=config.INDEX_DIR,
+        corpus_hash=manifest.get("corpus_hash") if manifest else None,
+        normalization=normalization or config.BM25_NORMALIZATION,
+    )
 
-def create_hybrid_retriever():
-    """Создание гибридного retriever (Semantic + BM25)"""
-    semantic = create_semantic_retriever()
-    bm25 = create_bm25_retriever()
+def create_hybrid_retriever(store=None, corpus=None):
+    """Создание гибридного retriever (Semantic + BM25)
+    
+    Ветки выполняются одновременно, результаты объединяются по chunk_id
+    (HYBRID_FUSION: weighted RRF или сумма нормализованных оценок) с весами ENSEMBLE_*.
+    """
+    if store is None:
+        store = vector_store
+    if store is None:
+        raise ValueError("Vector store not initialized")
+    bm25 = create_bm25_retriever(corpus)
     
     logger.info(f"Hybrid retriever: semantic_k={config.SEMANTIC_RETRIEVER_K}, bm25_k={config.BM25_RETRIEVER_K}")
     logger.info(f"Ensemble weights: semantic={config.ENSEMBLE_SEMANTIC_WEIGHT}, bm25={config.ENSEMBLE_BM25_WEIGHT}")
-    
-    return EnsembleRetriever(
-        retrievers=[semantic, bm25],
-        weights=[config.ENSEMBLE_SEMANTIC_WEIGHT, config.ENSEMBLE_BM25_WEIGHT]
+    logger.info(f"Fusion: {config.HYBRID_FUSION}, top_k={config.HYBRID_TOP_K or 'all'}")
+    
+    return ConcurrentHybridRetriever(
+        vector_store=store,
+        bm25=bm25,
+        semantic_k=config.SEMANTIC_RETRIEVER_K,
+        weights=[config.ENSEMBLE_SEMANTIC_WEIGHT, config.ENSEMBLE_BM25_WEIGHT],
+        fusion=config.HYBRID_FUSION,
+        top_k=config.HYBRID_TOP_K,
+        leg_timeout=config.HYBRID_LEG_TIMEOUT_MS / 1000,
     )
 
 def get_cross_encoder():
-    """Ленивая инициализация cross-encoder для reranking"""
+    """Ленивая инициализация cross-encoder для reranking (torch или ONNX int8)"""
     global cross_encoder
-    if cross_encoder is None:
+    if cross_encoder is not None:
+        return cross_encoder
+    with _cross_encoder_lock:
+        if cross_encoder is not None:
+            return cross_encoder
         try:
-            from sentence_transformers import CrossEncoder
-            logger.info(f"Loading cross-encoder model: {config.CROSS_ENCODER_MODEL}")
-            cross_encoder = CrossEncoder(config.CROSS_ENCODER_MODEL)
+            logger.info(f"Loading cross-encoder model: {config.CROSS_ENCODER_MODEL} ({config.CROSS_ENCODER_BACKEND})")
+            if config.CROSS_ENCODER_BACKEND == "onnx":
+                from cross_encoder_onnx import OnnxCrossEncoder
+                cross_encoder = OnnxCrossEncoder(
+                    config.CROSS_ENCODER_MODEL,
+                    config.CROSS_ENCODER_ONNX_DIR,
+                    threads=config.CROSS_ENCODER_THREADS,
+                )
+            else:
+                from sentence_transformers import CrossEncoder
+                if config.CROSS_ENCODER_THREADS > 0:
+                    import torch
+                    torch.set_num_threads(config.CROSS_ENCODER_THREADS)
+                cross_encoder = CrossEncoder(config.CROSS_ENCODER_MODEL)
             logger.info("✓ Cross-encoder loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load cross-encoder: {e}", exc_info=True)
             raise
     return cross_encoder
 
+def _cross_encoder_version() -> str:
+    """Модель и backend: оценки torch и ONNX int8 немного различаются, кешируются раздельно"""
+    return f"{config.CROSS_ENCODER_MODEL}:{config.CROSS_ENCODER_BACKEND}"
+
+def _predict_pairs(pairs: list) -> list:
+    """Один forward pass cross-encoder по всем парам батча"""
+    return get_cross_encoder().predict(pairs, batch_size=max(len(pairs), 1), show_progress_bar=False)
+
+def get_rerank_worker():
+    """Ленивая инициализация потока микробатчинга reranking"""
+    global rerank_worker
+    if rerank_worker is None:
+        rerank_worker = RerankWorker(
+            _predict_pairs,
+            window=config.RERANK_BATCH_WINDOW_MS / 1000,
+            max_batch_pairs=config.RERANK_MAX_BATCH_PAIRS,
+        )
+    return rerank_worker
+
+def get_rerank_cache():
+    """Ленивая инициализация кеша оценок reranking (None, если отключен)"""
+    global rerank_score_cache
+    if rerank_score_cache is None and config.RERANK_CACHE_ENABLED:
+        rerank_score_cache = rerank_cache.RerankScoreCache(config.RERANK_CACHE_MAX_ENTRIES, config.RERANK_CACHE_PATH or None)
+        rerank_score_cache.set_version(_cross_encoder_version(), index_version)
+    return rerank_score_cache
+
+def _set_index_version():
+    """Версия индекса из манифеста; при смене кеш reranking сбрасывается"""
+    global index_version
+    manifest = index_store.load_manifest(config.INDEX_DIR)
+    index_version = manifest.get("corpus_hash") if manifest else None
+    if rerank_score_cache is not None:
+        rerank_score_cache.set_version(_cross_encoder_version(), index_version)
+
+def _cached_scores(query: str, documents: list):
+    """
+    Оценки из кеша reranking
+    
+    Returns:
+        tuple: (scores с None для промахов, позиции промахов, функция сохранения новых оценок)
+    """
+    cache = get_rerank_cache()
+    if cache is None:
+        return [None] * len(documents), list(range(len(documents))), lambda computed: None
+    version = cache.version
+    chunk_ids = [doc.metadata.get("chunk_id") for doc in documents]
+    scores = cache.get_many(query, chunk_ids, version)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    
+    def store(computed: list):
+        cache.put_many(query, [(chunk_ids[i], score) for i, score in zip(missing, computed)], version)
+    
+    return scores, missing, store
+
+def _fill_scores(scores: list, missing: list, computed: list) -> list:
+    for i, score in zip(missing, computed):
+        scores[i] = score
+    return scores
+
+def cascade_depth(documents: list, top_k: int) -> int:
+    """
+    Сколько первых кандидатов (по оценке hybrid) отдавать cross-encoder
+    
+    Начинаем с RERANK_CASCADE_DEPTH и расширяем на столько же, пока отрыв
+    top_k-го кандидата от первого неоцененного меньше RERANK_CASCADE_MIN_GAP
+    (доля разброса оценок hybrid по всем кандидатам): неоцененные кандидаты с
+    близкой оценкой могли бы после reranking попасть в top_k. Если hybrid
+    уверенно отделяет лидеров, оцениваются только первые N пар.
+    """
+    count = len(documents)
+    if not config.RERANK_CASCADE_ENABLED or count <= top_k:
+        return count
+    scores = [doc.metadata.get("fusion_score") for doc in documents]
+    if any(score is None for score in scores):
+        return count
+    # Предел не ниже top_k: иначе reranker получил бы меньше top_k кандидатов
+    limit = max(top_k, min(count, config.RERANK_CASCADE_MAX_DEPTH)) if config.RERANK_CASCADE_MAX_DEPTH > 0 else count
+    spread = scores[0] - scores[-1]
+    depth = min(max(config.RERANK_CASCADE_DEPTH, top_k), limit)
+    while depth < limit and spread > 0 and (scores[top_k - 1] - scores[depth]) / spread < config.RERANK_CASCADE_MIN_GAP:
+        depth = min(depth + max(config.RERANK_CASCADE_DEPTH, 1), limit)
+    return depth
+
+def _record_rerank(candidates: int, depth: int, scored: int):
+    with _rerank_stats_lock:
+        _rerank_stats["requests"] += 1
+        _rerank_stats["candidates"] += candidates
+        _rerank_stats["depth"] += depth
+        _rerank_stats["scored"] += scored
+    if depth < candidates:
+        logger.info(f"Rerank cascade: {depth} of {candidates} candidates, {scored} pairs sent to the model")
+
+def get_rerank_depth_stats() -> dict:
+    """Среднее число кандидатов, оцененных пар и пар, ушедших в модель, на запрос"""
+    with _rerank_stats_lock:
+        stats = dict(_rerank_stats)
+    requests = stats["requests"]
+    return {
+        "cascade": config.RERANK_CASCADE_ENABLED,
+        "requests": requests,
+        "mean_candidates": stats["candidates"] / requests if requests else 0.0,
+        "mean_depth": stats["depth"] / requests if requests else 0.0,
+        "mean_scored": stats["scored"] / requests if requests else 0.0,
+    }
+
+def _rank(documents: list, scores: list, top_k: int) -> list:
+    ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
+    logger.info(f"Reranked {len(documents)} documents, returning top {top_k}")
+    return ranked[:top_k]
+
 def rerank_documents(query: str, documents: list, top_k: int = None):
     """
     Переранжирование документов с помощью cross-encoder
     
+    В каскадном режиме оцениваются только первые кандидаты по оценке hybrid
+    (см. cascade_depth). Оценки уже встречавшихся пар (запрос, chunk_id) берутся
+    из кеша, остальные пары (query, document_text) оцениваются потоком
+    RerankWorker вместе с парами одновременных запросов других пользователей.
+    
     Args:
         query: Запрос пользователя
         documents: Список Document объектов
@@ -89,39 +284,69 @@ def rerank_documents(query: str, documents: list, top_k: int = None):
     if not documents:
         return []
     
-    encoder = get_cross_encoder()
-    
+    candidates = len(documents)
+    documents = documents[:cascade_depth(documents, top_k)]
+    scores, missing, store = _cached_scores(query, documents)
     # Создаем пары (query, document_text) для cross-encoder
-    pairs = [(query, doc.page_content) for doc in documents]
-    
-    # Cross-encoder оценивает релевантность каждой пары
-    scores = encoder.predict(pairs)
+    pairs = [(query, documents[i].page_content) for i in missing]
+    computed = get_rerank_worker().score(pairs)
+    store(computed)
+    _record_rerank(candidates, len(documents), len(pairs))
+    return _rank(documents, _fill_scores(scores, missing, computed), top_k)
+
+async def arerank_documents(query: str, documents: list, top_k: int = None):
+    """
+    Async версия rerank_documents: event loop не блокируется на время работы модели
     
-    # Сортируем по убыванию score
-    ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
+    Модель работает в потоке RerankWorker, обращения к SQLite кешу оценок -
+    в небольшом отдельном пуле; executor по умолчанию не используется.
+    """
+    if top_k is None:
+        top_k = config.RERANKER_TOP_K
     
-    logger.info(f"Reranked {len(documents)} documents, returning top {top_k}")
+    if not documents:
+        return []
     
-    # Возвращаем top_k наиболее релевантных
-    return ranked[:top_k]
+    candidates = len(documents)
+    documents = documents[:cascade_depth(documents, top_k)]
+    cache = get_rerank_cache()
+    if cache is not None and cache.path is not None:
+        # Кеш в SQLite - чтение и запись с диска в своем пуле, а не в event loop
+        loop = asyncio.get_running_loop()
+        scores, missing, store = await loop.run_in_executor(_rerank_cache_executor, _cached_scores, query, documents)
+        pairs = [(query, documents[i].page_content) for i in missing]
+        computed = await get_rerank_worker().ascore(pairs)
+        await loop.run_in_executor(_rerank_cache_executor, store, computed)
+    else:
+        scores, missing, store = _cached_scores(query, documents)
+        pairs = [(query, documents[i].page_content) for i in missing]
+        computed = await get_rerank_worker().ascore(pairs)
+        store(computed)
+    _record_rerank(candidates, len(documents), len(pairs))
+    return _rank(documents, _fill_scores(scores, missing, computed), top_k)
 
-def create_retriever():
-    """Фабрика для создания retriever по режиму"""
+def create_retriever(store=None, corpus=None):
+    """Фабрика для создания retriever по режиму
+    
+    Args:
+        store: векторное хранилище (по умолчанию - текущее глобальное)
+        corpus: чанки для BM25 (по умолчанию - текущие глобальные)
+    """
     mode = config.RETRIEVAL_MODE.lower()
     
     if mode == "semantic":
         logger.info("Creating semantic retriever")
-        return create_semantic_retriever()
+        return create_semantic_retriever(store)
     
     elif mode == "hybrid":
         logger.info("Creating hybrid retriever (Semantic + BM25)")
-        return create_hybrid_retriever()
+        return create_hybrid_retriever(store, corpus)
     
     elif mode == "hybrid_reranker":
         logger.info("Creating hybrid retriever with reranker (Semantic + BM25 + Cross-encoder)")
         # Для hybrid_reranker используем тот же hybrid retriever
         # Reranking будет применен в get_rag_chain()
-        return create_hybrid_retriever()
+        return create_hybrid_retriever(store, corpus)
     
     else:
         raise ValueError(f"Unknown retrieval mode: {mode}. Use 'semantic', 'hybrid', or 'hybrid_reranker'")
@@ -135,12 +360,26 @@ def initialize_retriever():
     
     try:
         retriever = create_retriever()
+        _set_index_version()
         logger.info(f"✓ Retriever initialized in '{config.RETRIEVAL_MODE}' mode")
         return True
     except Exception as e:
         logger.error(f"Failed to initialize retriever: {e}", exc_info=True)
         return False
 
+def swap_index(new_vector_store, new_chunks, new_retriever):
+    """
+    Атомарная подмена индекса
+    
+    Retriever для нового индекса строится заранее (create_retriever(store, corpus)),
+    здесь глобальные переменные меняются одним шагом без await. Запросы, которые уже
+    собрали цепочку в rag_answer(), дорабатывают на старом retriever.
+    """
+    global vector_store, chunks, retriever
+    vector_store, chunks, retriever = new_vector_store, new_chunks, new_retriever
+    _set_index_version()
+    logger.info(f"✓ Index swapped: {len(new_chunks)} chunks")
+
 def format_chunks(chunks):
     """
     Форматирование чанков с метаданными для лучшей прозрачности
@@ -252,66 +491,279 @@ def _get_llm():
         logger.info(f"Main LLM initialized: {config.MODEL}")
     return _llm
 
+def _transform_window(messages: list) -> list:
+    """Последние QUERY_TRANSFORM_HISTORY_WINDOW сообщений истории и текущий вопрос"""
+    window = config.QUERY_TRANSFORM_HISTORY_WINDOW
+    return messages[-(window + 1):] if window > 0 else messages
+
+def _transform_key(messages: list) -> str:
+    payload = "\0".join([config.MODEL_QUERY_TRANSFORM] + [f"{m.type}\0{m.content}" for m in messages])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _transform_shortcut(messages: list):
+    """
+    Запрос без вызова LLM, если он возможен
+    
+    Returns:
+        tuple: (query или None, ключ кеша или None)
+    """
+    question = messages[-1].content if messages else ""
+    if config.QUERY_TRANSFORM_SKIP_FIRST and not any(m.type != "system" for m in messages[:-1]):
+        # Первое сообщение диалога: разрешать ссылки на историю не на что
+        with _transform_lock:
+            _transform_stats["skipped"] += 1
+        return question, None
+    if config.QUERY_TRANSFORM_CACHE_SIZE <= 0:
+        with _transform_lock:
+            _transform_stats["calls"] += 1
+        return None, None
+    key = _transform_key(messages)
+    with _transform_lock:
+        query = _transform_memo.get(key)
+        if query is not None:
+            _transform_memo.move_to_end(key)
+            _transform_stats["memo_hits"] += 1
+        else:
+            _transform_stats["calls"] += 1
+    return query, key
+
+def _remember_transform(key: str, query: str):
+    if key is None:
+        return
+    with _transform_lock:
+        _transform_memo[key] = query
+        while len(_transform_memo) > config.QUERY_TRANSFORM_CACHE_SIZE:
+            _transform_memo.popitem(last=False)
+
 def get_retrieval_query_transformation_chain():
-    """Цепочка трансформации запроса"""
+    """
+    Цепочка трансформации запроса
+    
+    LLM вызывается только когда нужна: первый вопрос диалога идет в retrieval
+    как есть (QUERY_TRANSFORM_SKIP_FIRST), результат для того же окна истории
+    и вопроса берется из памяти (QUERY_TRANSFORM_CACHE_SIZE).
+    """
     _, retrieval_query_transform_prompt = _load_prompts()
-    return (
+    transform_chain = (
         retrieval_query_transform_prompt
         | _get_llm_query_transform()
         | StrOutputParser()
     )
+    
+    def transform(x: dict) -> str:
+        messages = _transform_window(x["messages"])
+        query, key = _transform_shortcut(messages)
+        if query is None:
+            query = transform_chain.invoke({"messages": messages})
+            _remember_transform(key, query)
+        return query
+    
+    async def atransform(x: dict) -> str:
+        messages = _transform_window(x["messages"])
+        query, key = _transform_shortcut(messages)
+        if query is None:
+            query = await transform_chain.ainvoke({"messages": messages})
+            _remember_transform(key, query)
+        return query
+    
+    return RunnableLambda(transform, afunc=atransform)
 
-def get_rag_chain():
-    """Финальная RAG-цепочка возвращающая answer и documents в LCEL стиле"""
-    if retriever is None:
-        raise ValueError("Retriever not initialized")
+def get_query_transform_stats() -> dict:
+    """Сколько вызовов LLM трансформации запроса сэкономлено, для /index_status"""
+    with _transform_lock:
+        stats = dict(_transform_stats)
+        memo_entries = len(_transform_memo)
+    avoided = stats["skipped"] + stats["memo_hits"]
+    total = avoided + stats["calls"]
+    return {
+        **stats,
+        "avoided": avoided,
+        "avoided_rate": avoided / total if total else 0.0,
+        "memo_entries": memo_entries,
+    }
+
+def _rerank_step(x: dict) -> list:
+    query = x["messages"][-1].content if x["messages"] else ""
+    return [doc for doc, score in rerank_documents(query, x["ensemble_docs"], config.RERANKER_TOP_K)]
+
+async def _arerank_step(x: dict) -> list:
+    query = x["messages"][-1].content if x["messages"] else ""
+    return [doc for doc, score in await arerank_documents(query, x["ensemble_docs"], config.RERANKER_TOP_K)]
+
+def _answer_inputs(x: dict) -> dict:
+    """Вход подцепочки ответа: контекст из documents и история диалога"""
+    return {"context": format_chunks(x["documents"]), "messages": x["messages"]}
+
+async def _aanswer_inputs(x: dict) -> dict:
+    # Async вариант нужен, чтобы LCEL не отправлял легкий шаг в executor по умолчанию
+    return _answer_inputs(x)
+
+def get_answer_cache():
+    """Ленивая инициализация кеша ответов (None, если отключен)"""
+    global semantic_answer_cache
+    if semantic_answer_cache is None and config.ANSWER_CACHE_ENABLED:
+        semantic_answer_cache = answer_cache.SemanticAnswerCache(
+            threshold=config.ANSWER_CACHE_THRESHOLD,
+            ttl=config.ANSWER_CACHE_TTL_SECONDS,
+            max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+        )
+    return semantic_answer_cache
+
+def _answer_cache_steps(cache, version: str, embeddings):
+    """
+    Шаги кеша ответов: поиск по эмбеддингу запроса, выбор пути и сохранение ответа
+    
+    Returns:
+        tuple: (lookup, route(generate) -> Runnable)
+    """
+    def lookup(x: dict) -> dict:
+        started = time.perf_counter()
+        vector = embeddings.embed_query(x["query"])
+        return {"embedding": vector, "hit": cache.lookup(vector, version), "started": started}
+    
+    async def alookup(x: dict) -> dict:
+        started = time.perf_counter()
+        vector = await embeddings.aembed_query(x["query"])
+        return {"embedding": vector, "hit": cache.lookup(vector, version), "started": started}
+    
+    def store(result: dict):
+        cached = result.get("answer_cache")
+        if cached is None or not result.get("answer"):
+            return
+        cost_ms = (time.perf_counter() - cached["started"]) * 1000
+        cache.put(
+            cached["embedding"],
+            answer_cache.CachedAnswer(result["query"], result["answer"], result["documents"], cost_ms),
+            version,
+        )
+    
+    def collect(result: dict, chunk: dict):
+        # Фрагменты ответа при стриминге склеиваются, остальные ключи приходят целиком
+        for key, value in chunk.items():
+            result[key] = result[key] + value if key == "answer" and key in result else value
+    
+    def store_transform(chunks):
+        result = {}
+        for chunk in chunks:
+            yield chunk
+            collect(result, chunk)
+        store(result)
+    
+    async def astore_transform(chunks):
+        result = {}
+        async for chunk in chunks:
+            yield chunk
+            collect(result, chunk)
+        store(result)
+    
+    def route(generate):
+        miss = generate | RunnableGenerator(store_transform, astore_transform)
+        
+        def choose(x: dict):
+            hit = x["answer_cache"]["hit"]
+            if hit is None:
+                return miss
+            logger.info(f"Answer cache hit: '{x['query'][:80]}' ~ '{hit.query[:80]}'")
+            return {"answer": hit.answer, "documents": hit.documents}
+        
+        async def achoose(x: dict):
+            return choose(x)
+        
+        return RunnableLambda(choose, afunc=achoose)
+    
+    return RunnableLambda(lookup, afunc=alookup), route
+
+def _build_rag_chain(chain_retriever, chain_store):
+    """
+    Сборка RAG-цепочки, возвращающей answer и documents, в LCEL стиле
     
+    Все шаги async-native: при ainvoke трансформация запроса и генерация ответа
+    идут через async клиент LLM (ainvoke), retriever - через свой async путь,
+    reranking - через поток RerankWorker, а не через ограниченный executor
+    по умолчанию. Sync invoke (evaluation) работает как раньше.
+    
+    С кешем ответов после трансформации запроса ищется близкий сохраненный
+    запрос: при попадании retrieval, reranking и генерация пропускаются.
+    """
     conversational_answering_prompt, _ = _load_prompts()
     mode = config.RETRIEVAL_MODE.lower()
+    # Подцепочки собираются один раз вместе с цепочкой, а не на каждый вызов шага
+    answer_chain = (
+        RunnableLambda(_answer_inputs, afunc=_aanswer_inputs)
+        | conversational_answering_prompt
+        | _get_llm()
+        | StrOutputParser()
+    )
     
     # Для hybrid_reranker режима добавляем промежуточный шаг reranking
     if mode == "hybrid_reranker":
-        # LCEL цепочка с reranking: ensemble_docs → rerank → documents → answer
-        return (
+        # ensemble_docs → rerank → documents
+        retrieval = (
             RunnablePassthrough.assign(
-                ensemble_docs=get_retrieval_query_transformation_chain() | retriever
-            )
-            # Шаг reranking: переранжируем документы cross-encoder
-            | RunnablePassthrough.assign(
-                documents=lambda x: [doc for doc, score in rerank_documents(
-                    query=x["messages"][-1].content if x["messages"] else "",
-                    documents=x["ensemble_docs"],
-                    top_k=config.RERANKER_TOP_K
-                )]
+                ensemble_docs=RunnablePick("query") | chain_retriever
             )
-            # Генерируем ответ на основе переранжированных documents
+            # Шаг reranking: переранжируем документы cross-encoder (через RerankWorker)
             | RunnablePassthrough.assign(
-                answer=lambda x: (conversational_answering_prompt | _get_llm() | StrOutputParser()).invoke({
-                    "context": format_chunks(x["documents"]),
-                    "messages": x["messages"]
-                })
+                documents=RunnableLambda(_rerank_step, afunc=_arerank_step)
             )
-            # Возвращаем только answer и documents
-            | (lambda x: {"answer": x["answer"], "documents": x["documents"]})
         )
-    
-    # Для semantic и hybrid режимов - стандартная цепочка без reranking
-    # LCEL цепочка в стиле из референсного ноутбука
-    # Шаг 1: Получаем documents через query transformation
-    return (
-        RunnablePassthrough.assign(
-            documents=get_retrieval_query_transformation_chain() | retriever
-        )
-        # Шаг 2: Генерируем ответ на основе documents
-        | RunnablePassthrough.assign(
-            answer=lambda x: (conversational_answering_prompt | _get_llm() | StrOutputParser()).invoke({
-                "context": format_chunks(x["documents"]),
-                "messages": x["messages"]
-            })
+    else:
+        # Для semantic и hybrid режимов - стандартный retrieval без reranking
+        retrieval = RunnablePassthrough.assign(
+            documents=RunnablePick("query") | chain_retriever
         )
-        # Шаг 3: Возвращаем только answer и documents
-        | (lambda x: {"answer": x["answer"], "documents": x["documents"]})
-    )
+    # Генерируем ответ на основе documents
+    generate = retrieval | RunnablePassthrough.assign(answer=answer_chain)
+    
+    # Шаг 1: самостоятельный запрос через query transformation
+    chain = RunnablePassthrough.assign(query=get_retrieval_query_transformation_chain())
+    cache = get_answer_cache()
+    if cache is None:
+        chain = chain | generate
+    else:
+        # Ответы собранной ранее цепочки (старый индекс, другой режим) не переиспользуются
+        version = f"{mode}\0{config.MODEL}\0{index_version}\0{id(chain_retriever)}"
+        cache.set_version(version)
+        lookup, route = _answer_cache_steps(cache, version, chain_store.embeddings)
+        chain = chain | RunnablePassthrough.assign(answer_cache=lookup) | route(generate)
+    # Возвращаем только answer и documents
+    return chain | RunnablePick(["answer", "documents"])
+
+def get_rag_chain():
+    """
+    Собранная RAG-цепочка для текущего режима и индекса
+    
+    Цепочка кешируется по режиму retrieval, версии индекса и самому retriever
+    и пересобирается только после /index (подмена retriever) или смены
+    RETRIEVAL_MODE. Запросы, взявшие цепочку до подмены индекса, дорабатывают
+    на старом retriever, который она держит. Пересборка сбрасывает кеш ответов.
+    """
+    if retriever is None:
+        raise ValueError("Retriever not initialized")
+    
+    global _chain_cache
+    current, current_store = retriever, vector_store
+    key = (config.RETRIEVAL_MODE.lower(), index_version, id(current))
+    cached_key, chain = _chain_cache
+    if cached_key == key:
+        _chain_stats["hits"] += 1
+        return chain
+    with _chain_lock:
+        cached_key, chain = _chain_cache
+        if cached_key != key:
+            started = time.perf_counter()
+            chain = _build_rag_chain(current, current_store)
+            _chain_cache = (key, chain)
+            _chain_stats["builds"] += 1
+            logger.info(
+                f"RAG chain built for '{key[0]}' mode, index {index_version}: "
+                f"{(time.perf_counter() - started) * 1000:.1f} ms"
+            )
+        return chain
+
+def get_chain_stats() -> dict:
+    """Сколько раз цепочка собиралась и сколько раз взята из кеша"""
+    return dict(_chain_stats)
 
 async def rag_answer(messages):
     """
@@ -331,6 +783,20 @@ async def rag_answer(messages):
     result = await rag_chain.ainvoke({"messages": messages})
     return result
 
+async def rag_answer_stream(messages):
+    """
+    Потоковый ответ RAG (astream той же цепочки)
+    
+    Сначала приходит {"documents": list[Document]} - retrieval (и reranking)
+    завершен, затем фрагменты ответа {"answer": str} по мере генерации.
+    """
+    if vector_store is None or retriever is None:
+        logger.error("Vector store or retriever not initialized")
+        raise ValueError("Векторное хранилище не инициализировано. Запустите индексацию.")
+    
+    async for chunk in get_rag_chain().astream({"messages": messages}):
+        yield chunk
+
 def get_vector_store_stats():
     """Возвращает статистику векторного хранилища с полной информацией о конфигурации"""
     stats = {
@@ -341,8 +807,24 @@ def get_vector_store_stats():
     }
     
     if vector_store is not None:
-        doc_count = len(vector_store.store) if hasattr(vector_store, 'store') else 0
-        stats["count"] = doc_count
+        stats["count"] = len(vector_store)
+    
+    stats["vector_index_backend"] = config.VECTOR_INDEX_BACKEND
+    ann = getattr(vector_store, "ann_index", None)
+    if ann is not None:
+        stats["hnsw_m"] = ann.m
+        stats["hnsw_ef_construction"] = ann.ef_construction
+        stats["hnsw_ef_search"] = ann.ef_search
+        stats["ann_recall"] = ann.recall
+    
+    stats["vector_quantization"] = config.VECTOR_QUANTIZATION
+    if vector_store is not None:
+        stats["vector_memory_bytes"] = vector_store.get_memory_usage()
+        stats["vector_memory_float32_bytes"] = int(len(vector_store) * vector_store.matrix.shape[1] * 4) if len(vector_store) else 0
+    quantizer = getattr(vector_store, "quantizer", None)
+    if quantizer is not None:
+        stats["quantization_recall"] = quantizer.recall
+        stats["rescore_factor"] = vector_store.rescore_factor
     
     # Добавляем информацию о моделях в зависимости от провайдера
     if config.EMBEDDING_PROVIDER == "openai":
@@ -351,6 +833,11 @@ def get_vector_store_stats():
         stats["embedding_model"] = config.HUGGINGFACE_EMBEDDING_MODEL
         stats["device"] = config.HUGGINGFACE_DEVICE
     
+    stats["embedding_cache"] = embedding_cache.get_cache_stats()
+    stats["rag_chain"] = get_chain_stats()
+    stats["query_transform"] = get_query_transform_stats()
+    stats["answer_cache"] = answer_cache.get_cache_stats(semantic_answer_cache)
+    
     # Добавляем параметры retrieval режима
     if config.RETRIEVAL_MODE == "semantic":
         stats["semantic_k"] = config.SEMANTIC_RETRIEVER_K
@@ -359,13 +846,23 @@ def get_vector_store_stats():
         stats["bm25_k"] = config.BM25_RETRIEVER_K
         stats["semantic_weight"] = config.ENSEMBLE_SEMANTIC_WEIGHT
         stats["bm25_weight"] = config.ENSEMBLE_BM25_WEIGHT
+        stats["bm25_normalization"] = config.BM25_NORMALIZATION
+        stats["hybrid"] = get_hybrid_stats()
+        stats["hybrid_fusion"] = config.HYBRID_FUSION
     elif config.RETRIEVAL_MODE == "hybrid_reranker":
         stats["semantic_k"] = config.SEMANTIC_RETRIEVER_K
         stats["bm25_k"] = config.BM25_RETRIEVER_K
         stats["semantic_weight"] = config.ENSEMBLE_SEMANTIC_WEIGHT
         stats["bm25_weight"] = config.ENSEMBLE_BM25_WEIGHT
+        stats["bm25_normalization"] = config.BM25_NORMALIZATION
+        stats["hybrid"] = get_hybrid_stats()
+        stats["hybrid_fusion"] = config.HYBRID_FUSION
         stats["cross_encoder_model"] = config.CROSS_ENCODER_MODEL
+        stats["cross_encoder_backend"] = config.CROSS_ENCODER_BACKEND
         stats["reranker_top_k"] = config.RERANKER_TOP_K
+        stats["rerank"] = rerank_worker.get_stats() if rerank_worker is not None else None
+        stats["rerank_cache"] = rerank_cache.get_cache_stats()
+        stats["rerank_depth"] = get_rerank_depth_stats()
     
     return stats
 
@@ -0,0 +1,167 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from config import config
+from embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Накопительная статистика кеша за время работы процесса
+_stats = {"hits": 0, "misses": 0}
+
+# Лимит параметров в одном SQL запросе (SQLITE_MAX_VARIABLE_NUMBER)
+_SQL_BATCH = 500
+
+class RerankScoreCache:
+    """
+    LRU кеш оценок cross-encoder: (нормализованный запрос, chunk_id, модель) -> score
+
+    Повторные и уточняющие вопросы часто дают тот же запрос после трансформации
+    и те же чанки-кандидаты, такие пары не отправляются в модель повторно.
+    Версия (модель + версия индекса) входит в ключ; при ее смене кеш очищается,
+    так что оценки старого индекса или другой модели не используются.
+
+    В памяти - не больше max_entries записей. Если задан path, записи также
+    пишутся в SQLite и переживают перезапуск бота (пока не сменилась версия).
+    """
+
+    def __init__(self, max_entries: int, path: str = None):
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _get_conn(self):
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "key TEXT PRIMARY KEY, score REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_scores_last_used ON scores(last_used)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        return self._conn
+
+    def set_version(self, model: str, index_version: str):
+        """Смена модели или версии индекса сбрасывает кеш (в памяти и на диске)"""
+        version = f"{model}\0{index_version}"
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            self._entries.clear()
+            if self.path is None:
+                return
+            conn = self._get_conn()
+            row = conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+            if row is None or row[0] != version:
+                conn.execute("DELETE FROM scores")
+                conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('version', ?)", (version,))
+                conn.commit()
+                logger.info(f"Rerank cache reset for model {model}, index {index_version}")
+
+    @staticmethod
+    def _key(version: str, query: str, chunk_id) -> str:
+        payload = f"{version}\0{normalize_text(query)}\0{chunk_id}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, score: float):
+        self._entries[key] = score
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, query: str, chunk_ids: list, version: str) -> list:
+        """
+        Оценки по chunk_id (None - нет в кеше или chunk_id неизвестен)
+
+        version - значение self.version на момент получения кандидатов: запрос,
+        начатый до подмены индекса, не читает и не пишет оценки нового индекса.
+        """
+        keys = [
+            self._key(version, query, chunk_id) if chunk_id is not None and version == self.version else None
+            for chunk_id in chunk_ids
+        ]
+        with self._lock:
+            scores = []
+            for key in keys:
+                score = self._entries.get(key) if key is not None else None
+                if score is not None:
+                    self._entries.move_to_end(key)
+                scores.append(score)
+
+            missing = [key for key, score in zip(keys, scores) if key is not None and score is None]
+            if missing and self.path is not None:
+                found = self._lookup(missing)
+                for key, score in found.items():
+                    self._remember(key, score)
+                scores = [found.get(key, score) for key, score in zip(keys, scores)]
+
+        hits = sum(score is not None for score in scores)
+        _stats["hits"] += hits
+        _stats["misses"] += len(scores) - hits
+        return scores
+
+    def put_many(self, query: str, items: list, version: str):
+        """Сохранение оценок: items - список (chunk_id, score)"""
+        rows = {self._key(version, query, chunk_id): float(score) for chunk_id, score in items if chunk_id is not None}
+        if not rows:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            for key, score in rows.items():
+                self._remember(key, score)
+            if self.path is not None:
+                self._store(rows)
+
+    def _lookup(self, keys: list) -> dict:
+        conn = self._get_conn()
+        found = {}
+        for start in range(0, len(keys), _SQL_BATCH):
+            batch = keys[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(f"SELECT key, score FROM scores WHERE key IN ({placeholders})", batch).fetchall()
+            found.update(rows)
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE scores SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            conn.commit()
+        return found
+
+    def _store(self, rows: dict):
+        conn = self._get_conn()
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO scores (key, score, last_used) VALUES (?, ?, ?)",
+            [(key, score, now) for key, score in rows.items()]
+        )
+        count = conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        if count > self.max_entries:
+            # Вытесняем с запасом (до 90% лимита), чтобы не чистить на каждой вставке
+            conn.execute(
+                "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY last_used LIMIT ?)",
+                (count - int(self.max_entries * 0.9),)
+            )
+        conn.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def get_cache_stats() -> dict:
+    """Статистика кеша для /index_status"""
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        "enabled": config.RERANK_CACHE_ENABLED,
+        "persistent": bool(config.RERANK_CACHE_PATH),
+        "hits": _stats["hits"],
+        "misses": _stats["misses"],
+        "hit_rate": _stats["hits"] / total if total else 0.0,
+    }
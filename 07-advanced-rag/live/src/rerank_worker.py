@@ -0,0 +1,145 @@
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class _RerankRequest:
+    """Пары одного запроса и future для его оценок"""
+
+    def __init__(self, pairs: list):
+        self.pairs = pairs
+        self.future = concurrent.futures.Future()
+        self.enqueued = time.perf_counter()
+
+class RerankWorker:
+    """
+    Микробатчинг cross-encoder: пары из одновременных запросов - один forward pass
+
+    Запросы кладутся в очередь, поток-обработчик берет первый и в течение
+    window секунд добирает следующие (пока пар не больше max_batch_pairs),
+    затем оценивает все пары одним вызовом predict и раздает оценки по future.
+    Модель работает вне event loop, в единственном потоке.
+    """
+
+    def __init__(self, predict, window: float, max_batch_pairs: int):
+        """
+        Args:
+            predict: функция pairs -> scores (например, CrossEncoder.predict)
+            window: сколько ждать запросы для батча, секунды
+            max_batch_pairs: максимум пар в одном batch
+        """
+        self.predict = predict
+        self.window = window
+        self.max_batch_pairs = max_batch_pairs
+        self._queue = queue.Queue()
+        self._carry = None  # Запрос, не поместившийся в предыдущий batch
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats = {"batches": 0, "requests": 0, "pairs": 0, "queue_ms": 0.0, "predict_ms": 0.0, "max_pairs": 0}
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="rerank-worker", daemon=True)
+                    self._thread.start()
+
+    def submit(self, pairs: list) -> concurrent.futures.Future:
+        """Поставить пары (query, text) в очередь; future вернет список оценок"""
+        request = _RerankRequest(pairs)
+        if not pairs:
+            request.future.set_result([])
+            return request.future
+        self._ensure_started()
+        self._queue.put(request)
+        return request.future
+
+    def score(self, pairs: list) -> list:
+        return self.submit(pairs).result()
+
+    async def ascore(self, pairs: list) -> list:
+        return await asyncio.wrap_future(self.submit(pairs))
+
+    def _collect(self) -> list:
+        """
+        Первый запрос из очереди и все, что пришли за window (не больше max_batch_pairs пар)
+
+        Запросы, чей вызывающий уже отменен (future cancelled), в batch не попадают;
+        принятые переводятся в running и отменить их больше нельзя.
+        """
+        while True:
+            first, self._carry = self._carry or self._queue.get(), None
+            if first.future.set_running_or_notify_cancel():
+                break
+        batch = [first]
+        size = len(first.pairs)
+        deadline = time.perf_counter() + self.window
+        while size < self.max_batch_pairs:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if size + len(request.pairs) > self.max_batch_pairs:
+                self._carry = request
+                break
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            batch.append(request)
+            size += len(request.pairs)
+        return batch
+
+    @staticmethod
+    def _deliver(setter, value):
+        """Отдать результат в future; ошибка одного запроса не должна остановить поток-обработчик"""
+        try:
+            setter(value)
+        except concurrent.futures.InvalidStateError as e:
+            logger.warning(f"Rerank result dropped: {e}")
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            pairs = [pair for request in batch for pair in request.pairs]
+            try:
+                scores = [float(score) for score in self.predict(pairs)]
+            except Exception as e:
+                logger.error(f"Rerank batch of {len(pairs)} pairs failed: {e}", exc_info=True)
+                for request in batch:
+                    self._deliver(request.future.set_exception, e)
+                continue
+            predict_ms = (time.perf_counter() - started) * 1000
+
+            offset = 0
+            for request in batch:
+                self._deliver(request.future.set_result, scores[offset:offset + len(request.pairs)])
+                offset += len(request.pairs)
+
+            self._stats["batches"] += 1
+            self._stats["requests"] += len(batch)
+            self._stats["pairs"] += len(pairs)
+            self._stats["queue_ms"] += sum((started - request.enqueued) * 1000 for request in batch)
+            self._stats["predict_ms"] += predict_ms
+            self._stats["max_pairs"] = max(self._stats["max_pairs"], len(pairs))
+            logger.info(f"Reranked batch: {len(batch)} requests, {len(pairs)} pairs in {predict_ms:.0f} ms")
+
+    def get_stats(self) -> dict:
+        """Метрики батчинга для /index_status"""
+        stats = self._stats
+        batches = stats["batches"]
+        return {
+            "batches": batches,
+            "requests": stats["requests"],
+            "mean_batch_pairs": stats["pairs"] / batches if batches else 0.0,
+            "mean_batch_requests": stats["requests"] / batches if batches else 0.0,
+            "max_batch_pairs": stats["max_pairs"],
+            "mean_queue_ms": stats["queue_ms"] / stats["requests"] if stats["requests"] else 0.0,
+            "mean_predict_ms": stats["predict_ms"] / batches if batches else 0.0,
+        }
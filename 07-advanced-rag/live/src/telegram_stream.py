@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+STREAM_PLACEHOLDER = "⏳ Формирую ответ..."
+STREAM_CURSOR = " ▌"
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    """Разбиение длинного текста на части не длиннее limit (по переводам строк, если возможно)"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+class StreamingReply:
+    """
+    Ответ в Telegram, который дописывается по мере генерации
+
+    Сообщение-заглушка отправляется, как только закончился retrieval, затем
+    текст обновляется через edit_text не чаще раза в interval секунд: Telegram
+    ограничивает частоту правок, при RetryAfter следующая правка откладывается.
+    Промежуточные обновления между правками не отправляются, финальный текст
+    (с источниками) - всегда.
+    """
+
+    def __init__(self, message: Message, interval: float):
+        self.message = message
+        self.interval = interval
+        self.reply = None
+        self.shown = ""
+        self.next_edit = 0.0
+        self.edits = 0
+
+    async def start(self):
+        """Заглушка на месте будущего ответа"""
+        if self.reply is None:
+            self.reply = await self.message.answer(STREAM_PLACEHOLDER)
+            self.shown = STREAM_PLACEHOLDER
+            self.next_edit = time.monotonic() + self.interval
+
+    async def update(self, text: str):
+        """Промежуточный текст: отправляется, только если подошло время следующей правки"""
+        if self.reply is None:
+            await self.start()
+        if time.monotonic() < self.next_edit or not text.strip():
+            return
+        await self._edit(text[:TELEGRAM_MESSAGE_LIMIT - len(STREAM_CURSOR)].rstrip() + STREAM_CURSOR, final=False)
+
+    async def finish(self, text: str):
+        """Финальный текст: длинный ответ продолжается отдельными сообщениями"""
+        parts = split_message(text)
+        if self.reply is None:
+            await self.message.answer(parts[0])
+        else:
+            await self._edit(parts[0], final=True)
+        for part in parts[1:]:
+            await self.message.answer(part)
+
+    async def fail(self, text: str):
+        """Сообщение об ошибке вместо заглушки (или отдельным сообщением, если ее еще нет)"""
+        if self.reply is None:
+            await self.message.answer(text)
+        else:
+            await self._edit(text, final=True)
+
+    async def _edit(self, text: str, final: bool):
+        if text == self.shown:
+            return
+        while True:
+            try:
+                await self.reply.edit_text(text)
+                self.shown = text
+                self.edits += 1
+                break
+            except TelegramRetryAfter as e:
+                if not final:
+                    # Промежуточную правку пропускаем, следующая - после паузы от Telegram
+                    self.next_edit = time.monotonic() + e.retry_after
+                    return
+                logger.warning(f"Telegram edit rate limit, retrying final edit in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+                break
+        self.next_edit = time.monotonic() + self.interval
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from config import config
+import rag
+
+logger = logging.getLogger(__name__)
+
+# Компоненты в порядке прогрева
+COMPONENTS = ("embeddings", "bm25", "cross_encoder")
+
+# Тексты для пробного инференса
+WARMUP_QUERY = "Как оформить кредитную карту?"
+# Повторный вызов - с другим текстом: одинаковый запрос взяли бы из памяти эмбеддингов запросов
+WARMUP_REPEAT_QUERY = "Какие документы нужны для открытия вклада?"
+WARMUP_TEXT = "Оформить кредитную карту можно в СберБанк Онлайн или в офисе банка."
+
+# Готовность бота: pending -> warming -> ready (degraded, если компонент не загрузился);
+# off - прогрев отключен (WARMUP_MODE=off), модели загружаются при первом запросе
+_state = {"status": "pending", "started": None, "elapsed_ms": 0.0}
+_components = {
+    name: {"status": "pending", "load_ms": 0.0, "first_ms": 0.0, "warm_ms": 0.0, "error": None}
+    for name in COMPONENTS
+}
+_task = None  # Фоновый прогрев (WARMUP_MODE=background)
+
+def _run_component(name: str, load, infer, load_ms: float = None):
+    """
+    Загрузка компонента и два пробных вызова
+
+    load_ms - время загрузки, измеренное там, где модель создавалась на самом деле
+    (load тогда только возвращает готовый объект и не замеряется).
+
+    first_ms - первый (холодный) вызов после загрузки, warm_ms - повторный:
+    разница показывает, сколько ждал бы первый пользователь без прогрева.
+    infer(model, query) вызывается с разными запросами, чтобы повторный вызов
+    не попал в кеши и мерил именно прогретую модель.
+    """
+    component = _components[name]
+    component["status"] = "loading"
+    component["error"] = None
+    try:
+        started = time.perf_counter()
+        model = load()
+        component["load_ms"] = (time.perf_counter() - started) * 1000 if load_ms is None else load_ms
+        started = time.perf_counter()
+        infer(model, WARMUP_QUERY)
+        component["first_ms"] = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        infer(model, WARMUP_REPEAT_QUERY)
+        component["warm_ms"] = (time.perf_counter() - started) * 1000
+        component["status"] = "ready"
+        logger.info(
+            f"Warmup {name}: load {component['load_ms']:.0f} ms, first call {component['first_ms']:.0f} ms, "
+            f"warm call {component['warm_ms']:.0f} ms"
+        )
+    except Exception as e:
+        component["status"] = "failed"
+        component["error"] = str(e)
+        logger.error(f"Warmup {name} failed: {e}", exc_info=True)
+
+def warm_index(store, retriever):
+    """
+    Прогрев моделей индекса: локальные эмбеддинги запроса и BM25 статистики
+
+    Вызывается при старте и для нового индекса перед подменой (после /index
+    эмбеддинги создаются заново и снова холодные). OpenAI эмбеддинги - удаленный
+    API, их не прогреваем.
+    """
+    if config.EMBEDDING_PROVIDER == "huggingface" and store is not None:
+        # Модель создана при загрузке индекса (indexer.create_embeddings), там и замерена
+        _run_component(
+            "embeddings",
+            lambda: store.embeddings,
+            lambda embeddings, query: embeddings.embed_query(query),
+            load_ms=getattr(store.embeddings, "load_ms", 0.0),
+        )
+    else:
+        _components["embeddings"]["status"] = "skipped"
+
+    bm25 = getattr(retriever, "bm25", None)
+    if bm25 is not None:
+        _run_component("bm25", lambda: bm25.index, lambda index, query: index.search(index.tokenize(query), bm25.k))
+    else:
+        _components["bm25"]["status"] = "skipped"
+
+def warm_models():
+    """Прогрев всех локальных моделей текущего индекса и cross-encoder (блокирующий, вне event loop)"""
+    warm_index(rag.vector_store, rag.retriever)
+    if config.RETRIEVAL_MODE == "hybrid_reranker":
+        _run_component(
+            "cross_encoder",
+            rag.get_cross_encoder,
+            lambda model, query: model.predict([(query, WARMUP_TEXT)], batch_size=1, show_progress_bar=False),
+        )
+    else:
+        _components["cross_encoder"]["status"] = "skipped"
+
+async def warmup():
+    """Прогрев при старте бота: модели загружаются до первого вопроса пользователя"""
+    _state["status"] = "warming"
+    _state["started"] = time.perf_counter()
+    await asyncio.to_thread(warm_models)
+    _state["elapsed_ms"] = (time.perf_counter() - _state["started"]) * 1000
+    failed = [name for name, component in _components.items() if component["status"] == "failed"]
+    _state["status"] = "degraded" if failed else "ready"
+    if failed:
+        logger.warning(f"Warmup finished in {_state['elapsed_ms']:.0f} ms, failed: {', '.join(failed)}")
+    else:
+        logger.info(f"✓ Warmup finished in {_state['elapsed_ms']:.0f} ms")
+
+def start_background():
+    """Прогрев параллельно с приемом сообщений; ссылка на задачу хранится, чтобы ее не собрал GC"""
+    global _task
+    _task = asyncio.create_task(warmup())
+
+def disable():
+    _state["status"] = "off"
+
+def get_warmup_stats() -> dict:
+    """Готовность и время загрузки моделей для /index_status"""
+    elapsed_ms = _state["elapsed_ms"]
+    if _state["status"] == "warming":
+        elapsed_ms = (time.perf_counter() - _state["started"]) * 1000
+    return {
+        "status": _state["status"],
+        "elapsed_ms": elapsed_ms,
+        "components": {name: dict(component) for name, component in _components.items()},
+    }